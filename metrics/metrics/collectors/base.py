@@ -1,7 +1,8 @@
 from abc import ABC, abstractmethod
 from functools import wraps
+from typing import List
 
-from metrics.metrics import MetricsCollection
+from metrics.metrics import MetricsCollection, Rollup
 
 
 def ensure_connected(func):
@@ -35,6 +36,27 @@ class AbstractMetricsCollector(ABC):
         """
         pass
 
+    async def collect_rollup(self, rollup: Rollup):
+        """
+        Method called for each collected rollup of aggregated metrics from Kafka.
+        Collectors which don't support rollups ignore them
+        """
+        pass
+
+    async def collect_batch(
+        self, metrics: List[MetricsCollection], rollups: List[Rollup]
+    ):
+        """
+        Method called for each batch of metrics and rollups consumed from Kafka.
+        Offsets of the batch are committed when it returns, so it should return
+        only after the batch is stored. If it raises, the batch is consumed again.
+        By default each item is passed to collect or collect_rollup
+        """
+        for item in metrics:
+            await self.collect(item)
+        for rollup in rollups:
+            await self.collect_rollup(rollup)
+
     @abstractmethod
     async def shutdown(self):
         """
@@ -1,11 +1,18 @@
+import asyncio
+import json
 import logging
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 from ssl import create_default_context
-from typing import Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 import asyncpg
-from pydantic import BaseSettings, PostgresDsn
+from pydantic import BaseSettings, PostgresDsn, validator
 
-from metrics.metrics import MetricsCollection
+from metrics.metrics import MetricsCollection, Rollup
+from metrics.sketch import LatencySketch
 from metrics.utils import BackoffPolicy
 
 from .base import AbstractMetricsCollector, ensure_connected
@@ -19,75 +26,604 @@ class PostgresSettings(BaseSettings):
     """Connection string for PostgreSQL"""
 
     table: str = "metrics"
-    """Name of the table to write metrics"""
+    """Name of the table to write metrics. Rollups are written to {table}_rollups"""
 
     ssl: bool = False
     """Establish connection with SSL"""
 
+    batch_size: int = 1000
+    """
+    Maximum number of metrics written at once. Number of buffered metrics
+    which triggers write to the database
+    """
+
+    batch_linger: float = 0.5
+    """
+    Maximum time metrics are kept in the buffer before written (in seconds).
+    Only metrics passed to collect one by one are buffered
+    """
+
+    pool_min_size: int = 1
+    """Number of connections kept open in the pool"""
+
+    pool_max_size: int = 4
+    """Maximum number of connections in the pool"""
+
+    writers: int = 2
+    """Number of batches written to the database concurrently"""
+
+    stats_interval: float = 60
+    """How often to log stats of the pool and writers (in seconds). 0 disables it"""
+
+    partition_days: int = 0
+    """
+    Length of partitions of the metrics table by created_at (in days).
+    0 creates a plain table
+    """
+
+    partitions_ahead: int = 2
+    """Number of future partitions created in advance"""
+
+    retention_days: int = 0
+    """
+    How long to keep metrics in the partitioned table (in days). Partitions older
+    than that are dropped. 0 keeps all of them
+    """
+
+    partition_check_interval: float = 3600
+    """How often to create new partitions and drop old ones (in seconds)"""
+
+    @validator("retention_days")
+    def check_retention(cls, retention_days: int, values: Dict[str, Any]) -> int:
+        if retention_days and not values.get("partition_days"):
+            raise ValueError("retention_days works with partitioned table only")
+        return retention_days
+
     class Config:
         env_prefix = "wm_postgres_"
 
 
+MetricsRecord = Tuple[
+    str,
+    float,
+    int,
+    Optional[bool],
+    Optional[float],
+    Optional[float],
+    Optional[float],
+    Optional[float],
+    Optional[str],
+    Optional[int],
+]
+
+
+Batch = Tuple[List[MetricsRecord], "asyncio.Future[None]"]
+"""Records to write and future resolved when they are written"""
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
 class PostgresMetricsCollector(AbstractMetricsCollector):
+    """
+    Collector which writes metrics to PostgreSQL. Metrics are buffered
+    and written in batches with binary COPY, when batch_size of them are collected
+    or batch_linger passed. Buffered metrics are written on shutdown too.
+    Batches are written concurrently by several writers with connections
+    from the pool. Failed writes are retried with new connections, and if
+    all retries fail, the error is raised to callers waiting for the batch.
+    With partition_days set metrics table is partitioned by created_at,
+    partitions are created in advance and old ones are dropped after retention_days.
+    Metrics outside of created partitions are kept in the default partition
+    and moved to the partition once it's created
+    """
+
+    COLUMNS = (
+        "url",
+        "response_time",
+        "status_code",
+        "regex_found",
+        "dns_time",
+        "connect_time",
+        "ttfb",
+        "download_time",
+        "check_mode",
+        "bytes_transferred",
+    )
+
     def __init__(self, settings: Optional[PostgresSettings] = None):
         self.settings = settings or PostgresSettings()
         self.backoff_policy = BackoffPolicy(3, 5, 5)
-        self._conn: Optional[asyncpg.Connection] = None
+        self.written = 0
+        """Number of metrics written to the database"""
+
+        self.failed = 0
+        """Number of metrics which couldn't be written after all retries"""
+
+        self.acquires = 0
+        """Number of connections acquired from the pool"""
+
+        self.acquire_wait = 0.0
+        """Total time spent waiting for connections from the pool (in seconds)"""
+
+        self.max_acquire_wait = 0.0
+        """Maximum time spent waiting for a connection from the pool (in seconds)"""
+
+        self.busy_time = 0.0
+        """Total time writers spent writing batches (in seconds)"""
+
+        self._pool: Optional[asyncpg.Pool] = None
+        self._buffer: List[MetricsRecord] = []
+        self._buffered: Optional["asyncio.Future[None]"] = None
+        """Future resolved when buffered metrics are written"""
+        self._batches: "asyncio.Queue[Batch]" = asyncio.Queue(self.settings.writers * 2)
+        self._writers: List[asyncio.Task] = []
+        self._flusher: Optional[asyncio.Task] = None
+        self._stats_reporter: Optional[asyncio.Task] = None
+        self._partitions_keeper: Optional[asyncio.Task] = None
+        self._started_at = time.monotonic()
+
+    @property
+    def partitioned(self) -> bool:
+        """Metrics table is partitioned by created_at"""
+        return self.settings.partition_days > 0
+
+    @property
+    def pool_size(self) -> int:
+        """Number of open connections in the pool"""
+        return self._pool.get_size() if self._pool is not None else 0
+
+    @property
+    def pool_idle(self) -> int:
+        """Number of idle connections in the pool"""
+        return self._pool.get_idle_size() if self._pool is not None else 0
+
+    @property
+    def writer_utilization(self) -> float:
+        """Share of time writers spent writing batches since start"""
+        elapsed = time.monotonic() - self._started_at
+        return self.busy_time / (elapsed * self.settings.writers) if elapsed else 0.0
 
     async def connect(self):
-        if self._conn is None:
+        if self._pool is None:
             ssl_context = None
             if self.settings.ssl:
                 ssl_context = create_default_context(cafile="init/postgres/ca.pem")
-            self._conn = await self.backoff_policy.run(
-                asyncpg.connect, self.settings.dsn, ssl=ssl_context
+            # Broken connections are replaced by the pool on the next acquire.
+            # Statements are prepared once per connection and cached by asyncpg
+            self._pool = await self.backoff_policy.run(
+                asyncpg.create_pool,
+                self.settings.dsn,
+                min_size=self.settings.pool_min_size,
+                max_size=self.settings.pool_max_size,
+                ssl=ssl_context,
             )
             logger.debug("Connected to database")
+        if not self._writers:
+            loop = asyncio.get_event_loop()
+            self._started_at = time.monotonic()
+            self._writers = [
+                loop.create_task(self._write_batches())
+                for _ in range(self.settings.writers)
+            ]
 
     @ensure_connected
     async def start(self):
-        assert self._conn is not None, "Configuration error"
-
         logger.info("Start PostgreSQL metrics collector")
-        await self._create_tables()
+        async with self._acquire() as conn:
+            await self._create_tables(conn)
+            if self.partitioned:
+                await self._maintain_partitions(conn)
+        loop = asyncio.get_event_loop()
+        if self._flusher is None:
+            self._flusher = loop.create_task(self._flush_periodically())
+        if self._stats_reporter is None and self.settings.stats_interval > 0:
+            self._stats_reporter = loop.create_task(self._report_stats_periodically())
+        if self._partitions_keeper is None and self.partitioned:
+            self._partitions_keeper = loop.create_task(
+                self._maintain_partitions_periodically()
+            )
 
     @ensure_connected
     async def collect(self, metrics: MetricsCollection):
-        assert self._conn is not None, "Configuration error"
-
+        """
+        Buffers metrics and waits until the batch with them is written.
+        Concurrent calls share batches, failure of the batch is raised to all of them
+        """
         logger.debug(f"Received {metrics!r}")
-        await self._insert_metrics(metrics)
+        if self._buffered is None:
+            self._buffered = asyncio.get_event_loop().create_future()
+        written = self._buffered
+        self._buffer.append(self._to_record(metrics))
+        if len(self._buffer) >= self.settings.batch_size:
+            await self._enqueue()
+        # Future is shared with other callers, so it isn't cancelled with this one
+        await asyncio.shield(written)
+
+    @ensure_connected
+    async def collect_batch(
+        self, metrics: List[MetricsCollection], rollups: List[Rollup]
+    ):
+        """
+        Writes batch of metrics by writers right away, bypassing the buffer,
+        and waits until all of it is written
+        """
+        loop = asyncio.get_event_loop()
+        records = [self._to_record(item) for item in metrics]
+        written = []
+        for i in range(0, len(records), self.settings.batch_size):
+            future = loop.create_future()
+            await self._batches.put((records[i : i + self.settings.batch_size], future))
+            written.append(future)
+        for rollup in rollups:
+            await self.collect_rollup(rollup)
+        await asyncio.gather(*written)
+
+    @ensure_connected
+    async def flush(self):
+        """
+        Writes buffered metrics to the database and waits until all batches are written.
+        Raises if buffered metrics couldn't be written
+        """
+        written = self._buffered
+        await self._enqueue()
+        await self._batches.join()
+        if written is not None:
+            await written
+
+    @ensure_connected
+    async def collect_rollup(self, rollup: Rollup):
+        logger.debug(f"Received {rollup!r}")
+        await self.backoff_policy.run(self._insert_rollup, rollup)
 
     async def shutdown(self):
-        if self._conn:
-            await self._conn.close(timeout=5)
-        logger.info("Postgres collector shutdown completed")
+        for task in (self._flusher, self._stats_reporter, self._partitions_keeper):
+            if task is not None:
+                task.cancel()
+        self._flusher = self._stats_reporter = self._partitions_keeper = None
+        if self._pool is not None:
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Failed to write buffered metrics on shutdown", exc_info=e)
+            finally:
+                for writer in self._writers:
+                    writer.cancel()
+                await asyncio.gather(*self._writers, return_exceptions=True)
+                self._writers = []
+                await self._pool.close()
+        logger.info(
+            f"Postgres collector shutdown completed "
+            f"(written: {self.written}, failed: {self.failed})"
+        )
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Stats of the pool and writers, to size the pool against the database capacity
+        """
+        return {
+            "pool_size": self.pool_size,
+            "pool_idle": self.pool_idle,
+            "acquire_wait_avg": (
+                self.acquire_wait / self.acquires if self.acquires else 0.0
+            ),
+            "acquire_wait_max": self.max_acquire_wait,
+            "writer_utilization": self.writer_utilization,
+            "queued_batches": self._batches.qsize(),
+        }
 
-    async def _create_tables(self):
-        assert self._conn is not None, "Configuration error"
+    async def _enqueue(self):
+        """
+        Passes buffered metrics to writers. Waits if all writers are busy
+        and the queue of batches is full
+        """
+        if not self._buffer:
+            return
+        records, self._buffer = self._buffer, []
+        written, self._buffered = self._buffered, None
+        assert written is not None, "Buffered metrics without future"
+        await self._batches.put((records, written))
 
+    async def _write_batches(self):
+        while True:
+            records, written = await self._batches.get()
+            started_at = time.monotonic()
+            try:
+                await self.backoff_policy.run(self._copy_metrics, records)
+                self.written += len(records)
+                if not written.done():
+                    written.set_result(None)
+            except Exception as e:
+                self.failed += len(records)
+                logger.error(
+                    f"Failed to write {len(records)} metrics to the database",
+                    exc_info=e,
+                )
+                if not written.done():
+                    written.set_exception(e)
+            finally:
+                self.busy_time += time.monotonic() - started_at
+                self._batches.task_done()
+
+    @staticmethod
+    def _to_record(metrics: MetricsCollection) -> MetricsRecord:
+        return (
+            metrics.url,
+            metrics.response_time,
+            metrics.status_code,
+            metrics.regex_found,
+            metrics.dns_time,
+            metrics.connect_time,
+            metrics.ttfb,
+            metrics.download_time,
+            metrics.check_mode,
+            metrics.bytes_transferred,
+        )
+
+    @asynccontextmanager
+    async def _acquire(self) -> AsyncIterator[asyncpg.Connection]:
+        """
+        Acquires connection from the pool and records the wait time
+        """
+        assert self._pool is not None, "Configuration error"
+
+        started_at = time.monotonic()
+        async with self._pool.acquire() as conn:
+            wait = time.monotonic() - started_at
+            self.acquires += 1
+            self.acquire_wait += wait
+            self.max_acquire_wait = max(self.max_acquire_wait, wait)
+            yield conn
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.settings.batch_linger)
+            try:
+                await self._enqueue()
+            except Exception as e:
+                logger.error("Failed to write metrics to the database", exc_info=e)
+
+    async def _report_stats_periodically(self):
+        while True:
+            await asyncio.sleep(self.settings.stats_interval)
+            stats = ", ".join(
+                f"{name}: {value:.3f}" for name, value in self.stats().items()
+            )
+            logger.info(f"Postgres collector stats ({stats})")
+
+    async def _maintain_partitions_periodically(self):
+        while True:
+            await asyncio.sleep(self.settings.partition_check_interval)
+            try:
+                async with self._acquire() as conn:
+                    await self._maintain_partitions(conn)
+            except Exception as e:
+                logger.error("Failed to maintain partitions of metrics", exc_info=e)
+
+    def _partition_start(self, moment: datetime) -> datetime:
+        """
+        Start of the partition which contains the moment.
+        Partitions are aligned to multiples of partition_days since epoch
+        """
+        days = (moment - EPOCH).days
+        return EPOCH + timedelta(days=days - days % self.settings.partition_days)
+
+    def _partition_name(self, start: datetime) -> str:
+        return f"{self.settings.table}_p{start:%Y%m%d}"
+
+    async def _maintain_partitions(
+        self, conn: asyncpg.Connection, now: Optional[datetime] = None
+    ):
+        """
+        Creates partitions of the metrics table for the current period and
+        partitions_ahead next ones, and drops partitions which ended before retention
+        """
+        now = now or datetime.now(timezone.utc)
+        length = timedelta(days=self.settings.partition_days)
+        current = self._partition_start(now)
+        for number in range(self.settings.partitions_ahead + 1):
+            start = current + number * length
+            await self._create_partition(conn, start, start + length)
+        if not self.settings.retention_days:
+            return
+
+        rows = await conn.fetch(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = $1::regclass",
+            self.settings.table,
+            timeout=10,
+        )
+        name_pattern = re.compile(rf"{re.escape(self.settings.table)}_p(\d{{8}})")
+        partitions = []
+        for row in rows:
+            match = name_pattern.fullmatch(row["relname"])
+            if match:
+                start = datetime.strptime(match.group(1), "%Y%m%d")
+                partitions.append((start.replace(tzinfo=timezone.utc), row["relname"]))
+        partitions.sort()
+        cutoff = now - timedelta(days=self.settings.retention_days)
+        # Partition ends where the next one starts, the latest one is never dropped
+        for (_, name), (next_start, _) in zip(partitions, partitions[1:]):
+            if next_start <= cutoff:
+                await conn.execute(f"DROP TABLE IF EXISTS {name}", timeout=10)
+                logger.info(f"Dropped partition {name} of metrics after retention")
+        # Default partition is normally empty, so rows are deleted only as a fallback
+        expired = await conn.fetchval(
+            f"SELECT EXISTS (SELECT 1 FROM {self.settings.table}_default "
+            f"WHERE created_at < $1)",
+            cutoff,
+            timeout=10,
+        )
+        if expired:
+            await conn.execute(
+                f"DELETE FROM {self.settings.table}_default WHERE created_at < $1",
+                cutoff,
+                timeout=60,
+            )
+            logger.warning("Deleted metrics of default partition after retention")
+
+    async def _create_partition(
+        self, conn: asyncpg.Connection, start: datetime, end: datetime
+    ):
+        """
+        Creates partition of the metrics table for the time range.
+        Metrics of this range written to the default partition meanwhile
+        (e.g. when partitions weren't created in time) are moved to the new one.
+        Indexes of the table are created for each partition by PostgreSQL
+        """
+        name = self._partition_name(start)
+        bounds = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        try:
+            await conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} "
+                f"PARTITION OF {self.settings.table} {bounds}",
+                timeout=10,
+            )
+            return
+        except asyncpg.CheckViolationError:
+            logger.warning(f"Default partition has metrics of {name}, move them")
+        async with conn.transaction():
+            await conn.execute(
+                f"CREATE TABLE {name} (LIKE {self.settings.table} INCLUDING DEFAULTS)",
+                timeout=10,
+            )
+            await conn.execute(
+                f"WITH moved AS (DELETE FROM {self.settings.table}_default "
+                f"WHERE created_at >= $1 AND created_at < $2 RETURNING *) "
+                f"INSERT INTO {name} SELECT * FROM moved",
+                start,
+                end,
+                timeout=60,
+            )
+            await conn.execute(
+                f"ALTER TABLE {self.settings.table} ATTACH PARTITION {name} {bounds}",
+                timeout=10,
+            )
+
+    async def _create_tables(self, conn: asyncpg.Connection):
         logger.debug("Create tables")
-        stmt = f"""CREATE TABLE IF NOT EXISTS {self.settings.table} (
+        if self.partitioned:
+            await self._check_not_plain_table(conn)
+            metrics_stmt = f"""CREATE TABLE IF NOT EXISTS {self.settings.table} (
+              id BIGSERIAL,
+              created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+              url VARCHAR(255) NOT NULL DEFAULT '',
+              response_time FLOAT NOT NULL DEFAULT 0,
+              status_code INTEGER NOT NULL DEFAULT 0,
+              regex_found BOOLEAN,
+              dns_time FLOAT,
+              connect_time FLOAT,
+              ttfb FLOAT,
+              download_time FLOAT,
+              check_mode VARCHAR(16),
+              bytes_transferred BIGINT,
+              PRIMARY KEY (id, created_at)
+            ) PARTITION BY RANGE (created_at);
+            CREATE TABLE IF NOT EXISTS {self.settings.table}_default
+              PARTITION OF {self.settings.table} DEFAULT;
+            CREATE INDEX IF NOT EXISTS {self.settings.table}_created_at_brin_idx
+              ON {self.settings.table} USING BRIN (created_at);
+            CREATE INDEX IF NOT EXISTS {self.settings.table}_url_created_at_idx
+              ON {self.settings.table}(url, created_at);
+            """
+        else:
+            metrics_stmt = f"""CREATE TABLE IF NOT EXISTS {self.settings.table} (
               id SERIAL PRIMARY KEY,
               created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
               url VARCHAR(255) NOT NULL DEFAULT '',
               response_time FLOAT NOT NULL DEFAULT 0,
               status_code INTEGER NOT NULL DEFAULT 0,
-              regex_found BOOLEAN
+              regex_found BOOLEAN,
+              dns_time FLOAT,
+              connect_time FLOAT,
+              ttfb FLOAT,
+              download_time FLOAT,
+              check_mode VARCHAR(16),
+              bytes_transferred BIGINT
             );
+            ALTER TABLE {self.settings.table}
+              ADD COLUMN IF NOT EXISTS dns_time FLOAT,
+              ADD COLUMN IF NOT EXISTS connect_time FLOAT,
+              ADD COLUMN IF NOT EXISTS ttfb FLOAT,
+              ADD COLUMN IF NOT EXISTS download_time FLOAT,
+              ADD COLUMN IF NOT EXISTS check_mode VARCHAR(16),
+              ADD COLUMN IF NOT EXISTS bytes_transferred BIGINT;
             CREATE INDEX IF NOT EXISTS url_idx ON {self.settings.table}(url);
             """
-        await self._conn.execute(stmt, timeout=10)
-
-    async def _insert_metrics(self, metrics: MetricsCollection):
-        assert self._conn is not None, "Configuration error"
+        rollups_stmt = f"""CREATE TABLE IF NOT EXISTS {self.settings.table}_rollups (
+              id SERIAL PRIMARY KEY,
+              created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+              url VARCHAR(255) NOT NULL DEFAULT '',
+              window_start TIMESTAMPTZ NOT NULL,
+              window_end TIMESTAMPTZ NOT NULL,
+              count INTEGER NOT NULL DEFAULT 0,
+              failures INTEGER NOT NULL DEFAULT 0,
+              status_counts JSONB NOT NULL,
+              regex_checked INTEGER NOT NULL DEFAULT 0,
+              regex_found INTEGER NOT NULL DEFAULT 0,
+              response_time_min FLOAT NOT NULL DEFAULT 0,
+              response_time_max FLOAT NOT NULL DEFAULT 0,
+              response_time_avg FLOAT NOT NULL DEFAULT 0,
+              response_time_p50 FLOAT,
+              response_time_p90 FLOAT,
+              response_time_p99 FLOAT,
+              response_time_sketch JSONB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS rollups_url_window_idx
+              ON {self.settings.table}_rollups(url, window_start);
+            """
+        await conn.execute(metrics_stmt + rollups_stmt, timeout=10)
 
-        stmt = f"INSERT INTO {self.settings.table}(url, response_time, status_code, regex_found) VALUES($1, $2, $3, $4)"
-        await self._conn.execute(
-            stmt,
-            metrics.url,
-            metrics.response_time,
-            metrics.status_code,
-            metrics.regex_found,
+    async def _check_not_plain_table(self, conn: asyncpg.Connection):
+        """
+        Plain metrics table created before can't be turned into partitioned one,
+        it should be renamed or migrated manually
+        """
+        kind = await conn.fetchval(
+            "SELECT relkind FROM pg_class WHERE oid = to_regclass($1)",
+            self.settings.table,
             timeout=10,
         )
+        if kind == "r":
+            raise ValueError(
+                f"Table {self.settings.table} exists and is not partitioned, "
+                f"rename or migrate it to use partition_days"
+            )
+
+    async def _copy_metrics(self, records: List[MetricsRecord]):
+        async with self._acquire() as conn:
+            await conn.copy_records_to_table(
+                self.settings.table, records=records, columns=self.COLUMNS, timeout=10
+            )
+
+    async def _insert_rollup(self, rollup: Rollup):
+        # Quantiles are stored for queries, sketch is kept to merge windows later
+        sketch = LatencySketch.from_dict(rollup.response_time_sketch)
+        stmt = (
+            f"INSERT INTO {self.settings.table}_rollups(url, window_start, window_end, "
+            f"count, failures, status_counts, regex_checked, regex_found, "
+            f"response_time_min, response_time_max, response_time_avg, "
+            f"response_time_p50, response_time_p90, response_time_p99, "
+            f"response_time_sketch) "
+            f"VALUES($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15)"
+        )
+        async with self._acquire() as conn:
+            await conn.execute(
+                stmt,
+                rollup.url,
+                rollup.window_start,
+                rollup.window_end,
+                rollup.count,
+                rollup.failures,
+                json.dumps(rollup.status_counts),
+                rollup.regex_checked,
+                rollup.regex_found,
+                rollup.response_time_min,
+                rollup.response_time_max,
+                rollup.response_time_sum / rollup.count if rollup.count else 0,
+                sketch.quantile(0.5),
+                sketch.quantile(0.9),
+                sketch.quantile(0.99),
+                json.dumps(rollup.response_time_sketch),
+                timeout=10,
+            )
@@ -12,6 +12,15 @@ class Settings(BaseSettings):
     metrics_topics: str
     """List of comma-separated topic to listen for new metrics"""
 
+    group_id: str = "wm_metrics"
+    """Consumer group of the listener, offsets of stored metrics are committed to it"""
+
+    batch_max_records: int = 1000
+    """Maximum number of messages consumed and passed to collectors at once"""
+
+    batch_timeout: float = 1
+    """How long to wait for messages when there are none (in seconds)"""
+
     kafka_ssl_auth: bool = False
     """Enable SSL authentication mechanism for Kafka."""
 
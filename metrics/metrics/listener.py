@@ -3,15 +3,37 @@ import logging
 import typing as t
 
 import aiokafka
+from aiokafka.errors import CommitFailedError, KafkaError
 from aiokafka.helpers import create_ssl_context
 
+from . import wire
 from .collectors.base import AbstractMetricsCollector
 from .config import Settings
-from .metrics import MetricsCollection
+from .metrics import MetricsCollection, Rollup
 from .utils import BackoffPolicy
 
 logger = logging.getLogger(__name__)
 
+Batch = t.Dict[aiokafka.TopicPartition, t.List[aiokafka.ConsumerRecord]]
+
+
+class InFlightRebalanceListener(aiokafka.ConsumerRebalanceListener):
+    """
+    Waits until the batch in progress is stored and committed before partitions
+    are revoked, so other members of the group don't receive it again
+    """
+
+    def __init__(self, listener: "MetricsListener"):
+        self.listener = listener
+
+    async def on_partitions_revoked(self, revoked: t.Set[aiokafka.TopicPartition]):
+        if revoked:
+            logger.info(f"Partitions {sorted(revoked)} revoked, flush in-flight batch")
+            await self.listener.wait_in_flight()
+
+    async def on_partitions_assigned(self, assigned: t.Set[aiokafka.TopicPartition]):
+        logger.info(f"Partitions {sorted(assigned)} assigned")
+
 
 class MetricsListener:
     """
@@ -27,12 +49,16 @@ class MetricsListener:
     ):
         self.settings = settings
         self.collectors = collectors
+        self._in_flight: t.Optional[asyncio.Task] = None
         self._conn = self._setup_connection()
         self.backoff_policy = BackoffPolicy(3, 10, 10)
 
     async def start(self):
         """
         Starts listen for new metrics.
+        Metrics are consumed in batches, and offsets of the batch are committed
+        only after all collectors stored it, so metrics are delivered at least once.
+        Partitions are shared between all listeners of the consumer group.
         """
         try:
             start_tasks = [
@@ -40,18 +66,17 @@ class MetricsListener:
             ]
             await asyncio.gather(*start_tasks)
             await self.backoff_policy.run(self._conn.start)
-            async for raw_message in self._conn:
-                raw_message: aiokafka.ConsumerRecord[bytes]
-                try:
-                    metrics = MetricsCollection.parse_raw(raw_message.value)
-                    coros = [
-                        collector.collect(metrics) for collector in self.collectors
-                    ]
-                    await asyncio.gather(*coros)
-                except Exception as e:
-                    logger.error(
-                        f"Failed to parse raw metrics {raw_message[:20]!r}", exc_info=e
-                    )
+            while True:
+                batch = await self._conn.getmany(
+                    timeout_ms=int(self.settings.batch_timeout * 1000),
+                    max_records=self.settings.batch_max_records,
+                )
+                if batch:
+                    self._in_flight = asyncio.ensure_future(self._process_batch(batch))
+                    try:
+                        await self._in_flight
+                    finally:
+                        self._in_flight = None
         except asyncio.CancelledError:
             logger.info("MetricsListener.start canceled, stop listen for new metrics")
 
@@ -63,6 +88,83 @@ class MetricsListener:
         await asyncio.gather(*coros)
         logger.info("Shutdown completed")
 
+    async def wait_in_flight(self):
+        """
+        Waits until the batch in progress is processed, if there is one
+        """
+        if self._in_flight is not None and not self._in_flight.done():
+            await asyncio.wait([self._in_flight])
+
+    async def _process_batch(self, batch: Batch):
+        """
+        Processes partitions of the batch concurrently.
+        Messages of one partition are passed to collectors at once to keep their order
+        """
+        await asyncio.gather(
+            *[
+                self._process_partition(partition, records)
+                for partition, records in batch.items()
+            ]
+        )
+
+    async def _process_partition(
+        self,
+        partition: aiokafka.TopicPartition,
+        records: t.List[aiokafka.ConsumerRecord],
+    ):
+        """
+        Decodes messages of the partition and passes them to all collectors at once.
+        Messages which couldn't be decoded are skipped. If any collector fails,
+        consumer is moved back to the first message to receive them again,
+        otherwise offset of the partition is committed.
+        Kafka errors of seek and commit are logged, so consuming goes on
+        """
+        metrics: t.List[MetricsCollection] = []
+        rollups: t.List[Rollup] = []
+        for raw_message in records:
+            try:
+                if wire.is_rollup(raw_message.headers):
+                    rollups.append(Rollup.parse_raw(raw_message.value))
+                else:
+                    metrics.append(
+                        wire.decode_message(raw_message.value, raw_message.headers)
+                    )
+            except Exception as e:
+                logger.error(
+                    f"Failed to parse raw metrics {raw_message!r:.100}", exc_info=e
+                )
+        try:
+            await asyncio.gather(
+                *[
+                    collector.collect_batch(metrics, rollups)
+                    for collector in self.collectors
+                ]
+            )
+        except Exception as e:
+            logger.error(
+                f"Failed to collect batch of {len(metrics) + len(rollups)} messages "
+                f"from {partition}, it will be received again",
+                exc_info=e,
+            )
+            try:
+                self._conn.seek(partition, records[0].offset)
+            except KafkaError as e:
+                # Partition was revoked meanwhile, its new owner receives them again
+                logger.warning(f"Failed to seek {partition}", exc_info=e)
+            return
+        try:
+            await self._conn.commit({partition: records[-1].offset + 1})
+        except CommitFailedError as e:
+            # Partition was assigned to another member of the group meanwhile
+            logger.warning(
+                f"Failed to commit offset of {partition}, "
+                f"messages will be received again",
+                exc_info=e,
+            )
+        except KafkaError as e:
+            # Offset is committed with the next batch of the partition
+            logger.error(f"Failed to commit offset of {partition}", exc_info=e)
+
     def _setup_connection(self) -> aiokafka.AIOKafkaConsumer:
         if self.settings.kafka_ssl_auth:
             ssl_context = create_ssl_context(
@@ -71,14 +173,20 @@ class MetricsListener:
                 keyfile="init/kafka/service.key",
             )
             connection = aiokafka.AIOKafkaConsumer(
-                *self.settings.metrics_topics.split(","),
                 bootstrap_servers=self.settings.bootstrap_servers,
+                group_id=self.settings.group_id,
+                enable_auto_commit=False,
                 ssl_context=ssl_context,
                 security_protocol="SSL",
             )
         else:
             connection = aiokafka.AIOKafkaConsumer(
-                *self.settings.metrics_topics.split(","),
                 bootstrap_servers=self.settings.bootstrap_servers,
+                group_id=self.settings.group_id,
+                enable_auto_commit=False,
             )
+        connection.subscribe(
+            self.settings.metrics_topics.split(","),
+            listener=InFlightRebalanceListener(self),
+        )
         return connection
@@ -1,4 +1,5 @@
-from typing import Optional
+import datetime
+from typing import Any, Dict, Optional
 
 from pydantic import BaseModel
 
@@ -8,3 +9,40 @@ class MetricsCollection(BaseModel):
     response_time: float
     status_code: int
     regex_found: Optional[bool]
+    dns_time: Optional[float] = None
+    """Time of DNS resolution. None if address was cached or connection reused"""
+    connect_time: Optional[float] = None
+    """Time of establishing connection with TLS handshake. None if connection reused"""
+    ttfb: Optional[float] = None
+    """Time from getting connection to receiving response headers"""
+    download_time: Optional[float] = None
+    """Time of reading response body. None if body wasn't read"""
+    check_mode: Optional[str] = None
+    """Mode of the check: get, head, range or conditional"""
+    bytes_transferred: Optional[int] = None
+    """Number of response body bytes read by the check"""
+
+
+class Rollup(BaseModel):
+    """
+    Aggregated metrics of all health checks of the url within time window
+    """
+
+    url: str
+    window_start: datetime.datetime
+    window_end: datetime.datetime
+    count: int
+    """Number of health checks"""
+    failures: int
+    """Number of failed health checks, which were also sent as raw metrics"""
+    status_counts: Dict[str, int]
+    """Number of health checks by status code"""
+    regex_checked: int
+    """Number of health checks which examined body with regex"""
+    regex_found: int
+    """Number of health checks which found regex in the body"""
+    response_time_min: float
+    response_time_max: float
+    response_time_sum: float
+    response_time_sketch: Dict[str, Any]
+    """Serialized LatencySketch of response time"""
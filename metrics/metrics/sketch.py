@@ -0,0 +1,94 @@
+"""
+Mergeable sketch of latency distribution.
+This module is shared by monitor and metrics services and must be kept
+identical in both of them.
+"""
+
+import math
+import typing as t
+
+MIN_VALUE = 1e-9
+"""Values below it are counted as zeros"""
+
+
+class LatencySketch:
+    """
+    Sketch of distribution of positive values with bounded relative error
+    of quantiles (like DDSketch). Values are counted in logarithmic bins,
+    so the sketch stays small for any number of values, and sketches
+    with the same accuracy could be merged by summing their bins.
+    """
+
+    __slots__ = ("relative_accuracy", "bins", "zeros", "count", "_gamma", "_log_gamma")
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        """Maximum relative error of quantiles"""
+
+        self.bins: t.Dict[int, int] = {}
+        """Number of values in each logarithmic bin"""
+
+        self.zeros = 0
+        """Number of values below MIN_VALUE"""
+
+        self.count = 0
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+
+    def add(self, value: float):
+        if value < MIN_VALUE:
+            self.zeros += 1
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + 1
+        self.count += 1
+
+    def merge(self, other: "LatencySketch"):
+        """
+        Adds all values of other sketch to this one
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Sketches with different accuracy can't be merged")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def quantile(self, q: float) -> t.Optional[float]:
+        """
+        Estimates quantile of added values
+        :param q: quantile from 0 to 1
+        :return: estimated value, None if sketch is empty
+        """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if rank < seen:
+                return 2 * self._gamma**index / (self._gamma + 1)
+        return 2 * self._gamma ** max(self.bins) / (self._gamma + 1)
+
+    def to_dict(self) -> t.Dict[str, t.Any]:
+        """
+        Serializes sketch into JSON compatible dict
+        """
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "zeros": self.zeros,
+            "bins": {str(index): count for index, count in self.bins.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: t.Dict[str, t.Any]) -> "LatencySketch":
+        """
+        Deserializes sketch from the result of to_dict
+        """
+        sketch = cls(data["relative_accuracy"])
+        sketch.zeros = data["zeros"]
+        sketch.bins = {int(index): count for index, count in data["bins"].items()}
+        sketch.count = sketch.zeros + sum(sketch.bins.values())
+        return sketch
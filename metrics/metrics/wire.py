@@ -0,0 +1,156 @@
+"""
+Compact binary wire format of MetricsCollection.
+This module is shared by monitor and metrics services and must be kept
+identical in both of them (except import of MetricsCollection).
+
+Messages in binary format are marked with CONTENT_TYPE_HEADER Kafka header,
+messages without it are JSON encoded. Rollups of aggregated metrics
+are JSON encoded and marked with ROLLUP_CONTENT_TYPE.
+
+Layout of version 2 (little-endian):
+    B  - format version
+    B  - flags of optional fields presence (see OPTIONAL_FIELDS),
+         regex_found value, presence of bytes_transferred and check_mode
+    H  - status_code
+    d  - response_time
+    d* - present optional fields, in order of OPTIONAL_FIELDS
+    Q  - bytes_transferred, if present
+    B  - index of check_mode in CHECK_MODES, if present
+    H  - length of url
+    s  - url, utf-8 encoded
+
+Version 1 has the same layout without bytes_transferred and check_mode,
+decoder supports both versions.
+"""
+
+import struct
+import typing as t
+
+from metrics.metrics import MetricsCollection
+
+CONTENT_TYPE_HEADER = "content-type"
+BINARY_CONTENT_TYPE = b"application/x-wh-metrics"
+ROLLUP_CONTENT_TYPE = b"application/x-wh-rollup+json"
+VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)
+
+OPTIONAL_FIELDS = ("dns_time", "connect_time", "ttfb", "download_time")
+CHECK_MODES = ("get", "head", "range", "conditional")
+
+_HEAD = struct.Struct("<BBHd")
+_FLOAT = struct.Struct("<d")
+_URL_LENGTH = struct.Struct("<H")
+_BYTES = struct.Struct("<Q")
+_MODE = struct.Struct("<B")
+
+_REGEX_PRESENT = 1
+_REGEX_FOUND = 1 << 1
+_OPTIONAL_FLAGS = {field: 1 << (2 + i) for i, field in enumerate(OPTIONAL_FIELDS)}
+_BYTES_PRESENT = 1 << 6
+_MODE_PRESENT = 1 << 7
+
+
+class UnsupportedWireFormat(ValueError):
+    pass
+
+
+def encode(metrics: MetricsCollection) -> bytes:
+    """
+    Encodes metrics into binary format
+    """
+    flags = 0
+    if metrics.regex_found is not None:
+        flags |= _REGEX_PRESENT
+        if metrics.regex_found:
+            flags |= _REGEX_FOUND
+    optional = []
+    for field in OPTIONAL_FIELDS:
+        value = getattr(metrics, field)
+        if value is not None:
+            flags |= _OPTIONAL_FLAGS[field]
+            optional.append(_FLOAT.pack(value))
+    if metrics.bytes_transferred is not None:
+        flags |= _BYTES_PRESENT
+        optional.append(_BYTES.pack(metrics.bytes_transferred))
+    if metrics.check_mode is not None:
+        flags |= _MODE_PRESENT
+        optional.append(_MODE.pack(CHECK_MODES.index(metrics.check_mode)))
+    url = metrics.url.encode()
+    return b"".join(
+        [
+            _HEAD.pack(VERSION, flags, metrics.status_code, metrics.response_time),
+            *optional,
+            _URL_LENGTH.pack(len(url)),
+            url,
+        ]
+    )
+
+
+def decode(data: bytes) -> MetricsCollection:
+    """
+    Decodes metrics from binary format.
+    Data is produced by our own encoder, so model validation is skipped.
+    """
+    version, flags, status_code, response_time = _HEAD.unpack_from(data)
+    if version not in SUPPORTED_VERSIONS:
+        raise UnsupportedWireFormat(f"Unsupported wire format version {version}")
+    offset = _HEAD.size
+    fields: t.Dict[str, t.Any] = {
+        "status_code": status_code,
+        "response_time": response_time,
+        "regex_found": bool(flags & _REGEX_FOUND) if flags & _REGEX_PRESENT else None,
+    }
+    for field in OPTIONAL_FIELDS:
+        if flags & _OPTIONAL_FLAGS[field]:
+            (fields[field],) = _FLOAT.unpack_from(data, offset)
+            offset += _FLOAT.size
+        else:
+            fields[field] = None
+    fields["bytes_transferred"] = None
+    if flags & _BYTES_PRESENT:
+        (fields["bytes_transferred"],) = _BYTES.unpack_from(data, offset)
+        offset += _BYTES.size
+    fields["check_mode"] = None
+    if flags & _MODE_PRESENT:
+        (mode,) = _MODE.unpack_from(data, offset)
+        fields["check_mode"] = CHECK_MODES[mode]
+        offset += _MODE.size
+    (url_length,) = _URL_LENGTH.unpack_from(data, offset)
+    offset += _URL_LENGTH.size
+    fields["url"] = data[offset : offset + url_length].decode()
+    return MetricsCollection.construct(**fields)
+
+
+def is_binary(headers: t.Optional[t.Iterable[t.Tuple[str, bytes]]]) -> bool:
+    """
+    Checks Kafka message headers for binary content type
+    """
+    return _has_content_type(headers, BINARY_CONTENT_TYPE)
+
+
+def is_rollup(headers: t.Optional[t.Iterable[t.Tuple[str, bytes]]]) -> bool:
+    """
+    Checks Kafka message headers for rollup content type
+    """
+    return _has_content_type(headers, ROLLUP_CONTENT_TYPE)
+
+
+def _has_content_type(
+    headers: t.Optional[t.Iterable[t.Tuple[str, bytes]]], content_type: bytes
+) -> bool:
+    return any(
+        key == CONTENT_TYPE_HEADER and value == content_type
+        for key, value in headers or ()
+    )
+
+
+def decode_message(
+    value: bytes, headers: t.Optional[t.Iterable[t.Tuple[str, bytes]]]
+) -> MetricsCollection:
+    """
+    Decodes Kafka message value according to its headers.
+    Messages without binary content type are treated as JSON
+    """
+    if is_binary(headers):
+        return decode(value)
+    return MetricsCollection.parse_raw(value)
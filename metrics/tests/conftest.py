@@ -1,6 +1,8 @@
+import asyncio
 from unittest.mock import Mock
 
 import pytest
+from aiokafka import TopicPartition
 
 from metrics.collectors.base import AbstractMetricsCollector
 from metrics.config import Settings
@@ -12,18 +14,31 @@ class KafkaConnectionMock:
         self.start_called = False
         self.stop_called = False
         self.messages = messages or []
+        self.commits = 0
+        self.committed = {}
+        self.seeks = []
 
     async def start(self):
         self.start_called = True
 
-    def __aiter__(self):
-        return self
-
-    async def __anext__(self):
-        try:
-            return self.messages.pop()
-        except IndexError:
-            raise StopAsyncIteration
+    async def getmany(self, timeout_ms=0, max_records=None):
+        if not self.messages:
+            # Stop the listener when all messages are consumed
+            raise asyncio.CancelledError()
+        count = min(max_records or len(self.messages), len(self.messages))
+        batch = {}
+        for _ in range(count):
+            record = self.messages.pop()
+            partition = TopicPartition("wm_metrics", getattr(record, "partition", 0))
+            batch.setdefault(partition, []).append(record)
+        return batch
+
+    async def commit(self, offsets=None):
+        self.commits += 1
+        self.committed.update(offsets or {})
+
+    def seek(self, partition, offset):
+        self.seeks.append((partition, offset))
 
     async def stop(self):
         self.stop_called = True
@@ -1,7 +1,13 @@
+import asyncio
+from types import SimpleNamespace
+
 import pytest
+from aiokafka import TopicPartition
+from aiokafka.errors import IllegalStateError, KafkaError
 
-from metrics.listener import MetricsListener
-from metrics.metrics import MetricsCollection
+from metrics import wire
+from metrics.listener import InFlightRebalanceListener, MetricsListener
+from metrics.metrics import MetricsCollection, Rollup
 
 
 @pytest.mark.asyncio
@@ -23,8 +29,243 @@ async def test_listener(listener: MetricsListener):
         .encode(),
     ]
 
-    listener._conn.messages = metrics
+    listener._conn.messages = [
+        SimpleNamespace(value=value, headers=[], offset=offset)
+        for offset, value in enumerate(metrics)
+    ]
     await listener.start()
-    listener.collectors[0].collect.assert_has_calls(metrics)  # type: ignore
+    listener.collectors[0].collect_batch.assert_called_once_with(  # type: ignore
+        [MetricsCollection.parse_raw(value) for value in reversed(metrics)], []
+    )
+    assert listener._conn.commits == 1
     await listener.shutdown()
     listener.collectors[0].shutdown.assert_called_once()  # type: ignore
+
+
+@pytest.mark.asyncio
+async def test_listener_wire_formats(listener: MetricsListener):
+    json_metrics = MetricsCollection(
+        url="https://example.com", status_code=200, response_time=3
+    )
+    binary_metrics = MetricsCollection(
+        url="https://google.com", status_code=500, response_time=1, ttfb=0.5
+    )
+    listener._conn.messages = [
+        SimpleNamespace(
+            value=wire.encode(binary_metrics),
+            headers=[(wire.CONTENT_TYPE_HEADER, wire.BINARY_CONTENT_TYPE)],
+            offset=1,
+        ),
+        SimpleNamespace(value=json_metrics.json().encode(), headers=[], offset=0),
+    ]
+    await listener.start()
+    listener.collectors[0].collect_batch.assert_called_once_with(  # type: ignore
+        [json_metrics, binary_metrics], []
+    )
+
+
+@pytest.mark.asyncio
+async def test_listener_rollups(listener: MetricsListener):
+    rollup = Rollup(
+        url="https://example.com",
+        window_start=0,
+        window_end=60,
+        count=2,
+        failures=1,
+        status_counts={"200": 1, "500": 1},
+        regex_checked=0,
+        regex_found=0,
+        response_time_min=1,
+        response_time_max=2,
+        response_time_sum=3,
+        response_time_sketch={"relative_accuracy": 0.01, "zeros": 0, "bins": {}},
+    )
+    listener._conn.messages = [
+        SimpleNamespace(
+            value=rollup.json().encode(),
+            headers=[(wire.CONTENT_TYPE_HEADER, wire.ROLLUP_CONTENT_TYPE)],
+            offset=0,
+        ),
+    ]
+    await listener.start()
+    listener.collectors[0].collect_batch.assert_called_once_with(  # type: ignore
+        [], [rollup]
+    )
+
+
+@pytest.mark.asyncio
+async def test_listener_batches(listener: MetricsListener):
+    listener.settings.batch_max_records = 2
+    messages = [
+        MetricsCollection(
+            url=f"https://{i}.example.com", status_code=200, response_time=1
+        )
+        for i in range(5)
+    ]
+    listener._conn.messages = [
+        SimpleNamespace(value=metrics.json().encode(), headers=[], offset=offset)
+        for offset, metrics in enumerate(messages)
+    ]
+    listener._conn.messages.insert(
+        0, SimpleNamespace(value=b"broken", headers=[], offset=5)
+    )
+    await listener.start()
+    calls = listener.collectors[0].collect_batch.call_args_list  # type: ignore
+    assert [len(call.args[0]) for call in calls] == [2, 2, 1]
+    # Batches are committed even if some of their messages couldn't be decoded
+    assert listener._conn.commits == 3
+
+
+@pytest.mark.asyncio
+async def test_listener_redelivers_failed_batch(listener: MetricsListener):
+    metrics = MetricsCollection(
+        url="https://example.com", status_code=200, response_time=1
+    )
+    listener._conn.messages = [
+        SimpleNamespace(value=metrics.json().encode(), headers=[], offset=offset)
+        for offset in (11, 10)
+    ]
+    listener.collectors[0].collect_batch.side_effect = ConnectionError()  # type: ignore
+    await listener.start()
+    assert listener._conn.commits == 0
+    assert [offset for _, offset in listener._conn.seeks] == [10]
+
+
+@pytest.mark.asyncio
+async def test_listener_processes_partitions_concurrently(listener: MetricsListener):
+    in_progress = 0
+    max_in_progress = 0
+    received = []
+
+    async def collect_batch(metrics, rollups):
+        nonlocal in_progress, max_in_progress
+        in_progress += 1
+        max_in_progress = max(max_in_progress, in_progress)
+        await asyncio.sleep(0.01)
+        received.append([m.url for m in metrics])
+        in_progress -= 1
+
+    listener.collectors[0].collect_batch.side_effect = collect_batch  # type: ignore
+    messages = [
+        SimpleNamespace(
+            value=MetricsCollection(
+                url=f"https://{partition}.example.com/{offset}",
+                status_code=200,
+                response_time=1,
+            )
+            .json()
+            .encode(),
+            headers=[],
+            offset=offset,
+            partition=partition,
+        )
+        for offset in range(3)
+        for partition in range(2)
+    ]
+    listener._conn.messages = list(reversed(messages))
+    await listener.start()
+    assert max_in_progress == 2
+    # Order is kept within partition
+    assert sorted(received) == [
+        [f"https://{partition}.example.com/{offset}" for offset in range(3)]
+        for partition in range(2)
+    ]
+    assert listener._conn.committed == {
+        TopicPartition("wm_metrics", 0): 3,
+        TopicPartition("wm_metrics", 1): 3,
+    }
+
+
+@pytest.mark.asyncio
+async def test_listener_redelivers_failed_partition(listener: MetricsListener):
+    async def collect_batch(metrics, rollups):
+        if metrics[0].url == "https://1.example.com":
+            raise ConnectionError()
+
+    listener.collectors[0].collect_batch.side_effect = collect_batch  # type: ignore
+    listener._conn.messages = [
+        SimpleNamespace(
+            value=MetricsCollection(
+                url=f"https://{partition}.example.com",
+                status_code=200,
+                response_time=1,
+            )
+            .json()
+            .encode(),
+            headers=[],
+            offset=7,
+            partition=partition,
+        )
+        for partition in range(2)
+    ]
+    await listener.start()
+    assert listener._conn.committed == {TopicPartition("wm_metrics", 0): 8}
+    assert listener._conn.seeks == [(TopicPartition("wm_metrics", 1), 7)]
+
+
+@pytest.mark.asyncio
+async def test_listener_survives_kafka_errors(listener: MetricsListener):
+    async def collect_batch(metrics, rollups):
+        if metrics[0].url == "https://1.example.com":
+            raise ConnectionError()
+
+    async def commit(offsets=None):
+        raise KafkaError()
+
+    def seek(partition, offset):
+        raise IllegalStateError()
+
+    listener.collectors[0].collect_batch.side_effect = collect_batch  # type: ignore
+    listener._conn.commit = commit  # type: ignore
+    listener._conn.seek = seek  # type: ignore
+    listener.settings.batch_max_records = 2
+    listener._conn.messages = [
+        SimpleNamespace(
+            value=MetricsCollection(
+                url=f"https://{index % 2}.example.com",
+                status_code=200,
+                response_time=1,
+            )
+            .json()
+            .encode(),
+            headers=[],
+            offset=index,
+            partition=index % 2,
+        )
+        for index in range(4)
+    ]
+    await listener.start()
+    # Listener keeps consuming after failed seek and commit
+    assert not listener._conn.messages
+    assert listener.collectors[0].collect_batch.call_count == 4  # type: ignore
+
+
+@pytest.mark.asyncio
+async def test_rebalance_waits_for_in_flight_batch(listener: MetricsListener):
+    stored = asyncio.Event()
+
+    async def collect_batch(metrics, rollups):
+        await asyncio.sleep(0.05)
+        stored.set()
+
+    listener.collectors[0].collect_batch.side_effect = collect_batch  # type: ignore
+    rebalance_listener = InFlightRebalanceListener(listener)
+    # Nothing to wait for
+    await rebalance_listener.on_partitions_revoked({TopicPartition("wm_metrics", 0)})
+
+    partition = TopicPartition("wm_metrics", 0)
+    record = SimpleNamespace(
+        value=MetricsCollection(
+            url="https://example.com", status_code=200, response_time=1
+        )
+        .json()
+        .encode(),
+        headers=[],
+        offset=4,
+    )
+    listener._in_flight = asyncio.ensure_future(
+        listener._process_batch({partition: [record]})
+    )
+    await rebalance_listener.on_partitions_revoked({partition})
+    assert stored.is_set()
+    assert listener._conn.committed == {partition: 5}
@@ -0,0 +1,233 @@
+"""
+Benchmark of the whole monitor: schedules synthetic entries against
+a local stub HTTP server and loads metrics with an in-memory loader.
+Reports completed checks per second, scheduling drift, peak RSS and CPU usage
+of the monitor process. Each schedule size is run in a fresh process.
+
+Run from the monitor directory:
+    python -m benchmarks.bench_monitor --entries 1000,10000,100000
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import tempfile
+import time
+import typing as t
+from collections import deque
+
+import yaml
+from aiohttp import web
+
+from monitor.config import Settings
+from monitor.loaders.base import AbstractLoader
+from monitor.metrics import MetricsCollection
+from monitor.monitor import HealthMonitor
+from monitor.scheduler import CronSchedule
+
+
+class MemoryLoader(AbstractLoader):
+    """
+    Loader which only counts metrics
+    """
+
+    def __init__(self):
+        self.loaded = 0
+        self.failed_checks = 0
+
+    async def connect(self):
+        pass
+
+    async def load(self, metric: MetricsCollection):
+        self.loaded += 1
+        if metric.status_code >= 500:
+            self.failed_checks += 1
+
+    async def load_batch(self, metrics: t.List[MetricsCollection]):
+        for metric in metrics:
+            await self.load(metric)
+
+    async def shutdown(self):
+        pass
+
+
+def serve_stub(port: int, latency: float, body_size: int, error_rate: float):
+    """
+    Runs stub HTTP server which responds to any path
+    """
+    body = b"x" * (body_size - 2) + b"OK" if body_size >= 2 else b"OK"
+
+    async def handle(request: web.Request) -> web.Response:
+        if latency:
+            await asyncio.sleep(latency)
+        status = 500 if random.random() < error_rate else 200
+        return web.Response(body=body, status=status)
+
+    app = web.Application()
+    app.router.add_get("/{path:.*}", handle)
+    web.run_app(app, host="127.0.0.1", port=port, print=None, access_log=None)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def percentile(values: t.Sequence[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+def run_case(entries: int, port: int, args: argparse.Namespace) -> t.Dict[str, float]:
+    """
+    Runs the monitor with given number of entries, executed in a separate process
+    """
+    logging.basicConfig(level=logging.ERROR)
+    with tempfile.TemporaryDirectory() as directory:
+        schedule_path = os.path.join(directory, "schedule.yaml")
+        schedule = [
+            {
+                "url": f"http://127.0.0.1:{port}/check/{i}",
+                "schedule": args.schedule,
+                **({"body_regex": args.regex} if args.regex else {}),
+            }
+            for i in range(entries)
+        ]
+        with open(schedule_path, "w") as f:
+            yaml.safe_dump(schedule, f)
+        settings = Settings(
+            schedule_path=schedule_path,
+            http_pool_limit=args.pool_limit,
+            http_pool_limit_per_host=args.pool_limit,
+            loader_queue_size=max(entries, 10000),
+        )
+        warmup = args.warmup
+        if warmup is None:
+            warmup = CronSchedule(args.schedule).interval
+        return asyncio.run(_run_monitor(settings, warmup, args.duration))
+
+
+async def _run_monitor(
+    settings: Settings, warmup: float, duration: float
+) -> t.Dict[str, float]:
+    loader = MemoryLoader()
+    monitor = HealthMonitor(settings, [loader])
+    await monitor.start()
+    # Skip the first period, when spread jobs are still starting
+    await asyncio.sleep(warmup)
+    # Keep all drift samples to calculate percentiles of the whole run
+    monitor.scheduler.drifts = deque()
+    loaded_before = loader.loaded
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    started_at = time.monotonic()
+    await asyncio.sleep(duration)
+    elapsed = time.monotonic() - started_at
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    loaded = loader.loaded - loaded_before
+    await monitor.shutdown()
+    cpu_time = (usage_after.ru_utime + usage_after.ru_stime) - (
+        usage_before.ru_utime + usage_before.ru_stime
+    )
+    drifts = list(monitor.scheduler.drifts)
+    return {
+        "checks_per_second": loaded / elapsed,
+        "failed_checks": loader.failed_checks,
+        "skipped": monitor.scheduler.skipped,
+        "drift_p50": percentile(drifts, 0.5),
+        "drift_p99": percentile(drifts, 0.99),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": usage_after.ru_maxrss / 1024,
+        "cpu_percent": cpu_time / elapsed * 100,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--entries",
+        default="1000,10000,100000",
+        help="comma-separated sizes of synthetic schedules",
+    )
+    parser.add_argument(
+        "--schedule", default="* * * * * */10", help="schedule of each entry"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30, help="duration of each run (seconds)"
+    )
+    parser.add_argument(
+        "--warmup",
+        type=float,
+        default=None,
+        help="time before measurements (seconds), one schedule interval by default",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.01, help="stub response latency (seconds)"
+    )
+    parser.add_argument(
+        "--body-size", type=int, default=1024, help="stub response size (bytes)"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.01, help="share of 500 responses"
+    )
+    parser.add_argument(
+        "--regex", default="OK", help="body_regex of entries, empty to disable"
+    )
+    parser.add_argument(
+        "--pool-limit", type=int, default=1000, help="HTTP connections limit"
+    )
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    port = free_port()
+    server = context.Process(
+        target=serve_stub,
+        args=(port, args.latency, args.body_size, args.error_rate),
+        daemon=True,
+    )
+    server.start()
+    try:
+        wait_for_port(port)
+        interval = CronSchedule(args.schedule).interval
+        print(
+            f"{'entries':>8}{'target/s':>10}{'checks/s':>10}{'failed':>8}{'skipped':>9}"
+            f"{'drift p50':>11}{'drift p99':>11}{'rss MiB':>9}{'cpu %':>7}"
+        )
+        for entries in (int(value) for value in args.entries.split(",")):
+            with context.Pool(1) as pool:
+                result = pool.apply(run_case, (entries, port, args))
+            print(
+                f"{entries:>8}{entries / interval:>10,.0f}"
+                f"{result['checks_per_second']:>10,.0f}"
+                f"{result['failed_checks']:>8}{result['skipped']:>9}"
+                f"{result['drift_p50']:>10.3f}s{result['drift_p99']:>10.3f}s"
+                f"{result['peak_rss_mb']:>9.0f}{result['cpu_percent']:>7.0f}"
+            )
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == "__main__":
+    main()
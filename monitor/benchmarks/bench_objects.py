@@ -0,0 +1,137 @@
+"""
+Benchmark of per-check objects: time to build the result of a check,
+convert it to metrics and serialize them to JSON, and memory taken by
+the result and metrics objects. Plain slotted objects used by the monitor
+are compared with pydantic models used before (kept here for comparison).
+
+Run from the monitor directory:
+    python -m benchmarks.bench_objects
+"""
+
+import argparse
+import timeit
+import tracemalloc
+import typing as t
+
+from multidict import CIMultiDict, CIMultiDictProxy
+from pydantic import BaseModel
+
+from monitor.job import HealthcheckJobResult
+from monitor.metrics import MetricsCollection, collect_metrics
+
+HEADERS = CIMultiDictProxy(
+    CIMultiDict(
+        {
+            "Content-Type": "text/html; charset=UTF-8",
+            "Content-Length": "1256",
+            "Cache-Control": "max-age=604800",
+            "Date": "Mon, 01 Jan 2024 00:00:00 GMT",
+            "ETag": '"3147526947"',
+            "Server": "ECS (dcb/7F83)",
+        }
+    )
+)
+
+
+class PydanticJobResult(BaseModel):
+    url: str
+    response_time: float
+    response_headers: dict
+    response_status: int
+    regex_found: t.Optional[bool] = None
+    dns_time: t.Optional[float] = None
+    connect_time: t.Optional[float] = None
+    ttfb: t.Optional[float] = None
+    download_time: t.Optional[float] = None
+    check_mode: t.Optional[str] = None
+    bytes_transferred: t.Optional[int] = None
+
+
+class PydanticMetrics(BaseModel):
+    url: str
+    response_time: float
+    status_code: int
+    regex_found: t.Optional[bool]
+    dns_time: t.Optional[float] = None
+    connect_time: t.Optional[float] = None
+    ttfb: t.Optional[float] = None
+    download_time: t.Optional[float] = None
+    check_mode: t.Optional[str] = None
+    bytes_transferred: t.Optional[int] = None
+
+
+def check_result_fields() -> t.Dict[str, t.Any]:
+    return dict(
+        url="https://example.com/some/health/endpoint",
+        response_time=0.123456,
+        response_headers=HEADERS,
+        response_status=200,
+        regex_found=True,
+        dns_time=None,
+        connect_time=None,
+        ttfb=0.1,
+        download_time=0.002,
+        check_mode="get",
+        bytes_transferred=1256,
+    )
+
+
+def pydantic_objects() -> t.Tuple[PydanticJobResult, PydanticMetrics]:
+    result = PydanticJobResult(**check_result_fields())
+    metrics = PydanticMetrics(
+        url=result.url,
+        response_time=result.response_time,
+        status_code=result.response_status,
+        regex_found=result.regex_found,
+        dns_time=result.dns_time,
+        connect_time=result.connect_time,
+        ttfb=result.ttfb,
+        download_time=result.download_time,
+        check_mode=result.check_mode,
+        bytes_transferred=result.bytes_transferred,
+    )
+    return result, metrics
+
+
+def slotted_objects() -> t.Tuple[HealthcheckJobResult, MetricsCollection]:
+    result = HealthcheckJobResult(**check_result_fields())
+    return result, collect_metrics(result)
+
+
+def memory_per_call(func: t.Callable[[], t.Any], number: int) -> float:
+    """
+    Average memory taken by objects returned by one call of the function
+    """
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        objects = [func() for _ in range(number)]
+        end, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # Don't count the list itself
+    return (end - start) / len(objects) - 8
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("-n", "--number", type=int, default=100000)
+    args = parser.parse_args()
+
+    cases = {"pydantic": pydantic_objects, "slotted": slotted_objects}
+    payloads = {name: func()[1].json().encode() for name, func in cases.items()}
+    assert payloads["pydantic"] == payloads["slotted"], "Serialized metrics differ"
+    print(f"{'objects':<10}{'us/check':>10}{'checks/s':>12}{'bytes/check':>13}")
+    for name, func in cases.items():
+        elapsed = timeit.timeit(lambda: func()[1].json().encode(), number=args.number)
+        memory = memory_per_call(func, min(args.number, 10000))
+        print(
+            f"{name:<10}{elapsed / args.number * 1e6:>10.2f}"
+            f"{args.number / elapsed:>12,.0f}{memory:>13,.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
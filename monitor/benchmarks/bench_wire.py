@@ -0,0 +1,54 @@
+"""
+Benchmark of metrics wire formats: size of message
+and encode/decode throughput of JSON and binary formats.
+
+Run from the monitor directory:
+    python -m benchmarks.bench_wire
+"""
+
+import argparse
+import timeit
+
+from monitor import wire
+from monitor.metrics import MetricsCollection
+
+METRICS = MetricsCollection(
+    url="https://example.com/some/health/endpoint",
+    response_time=0.123456,
+    status_code=200,
+    regex_found=True,
+    dns_time=0.001,
+    connect_time=0.02,
+    ttfb=0.1,
+    download_time=0.002,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--number", type=int, default=100000)
+    args = parser.parse_args()
+
+    json_data = METRICS.json().encode()
+    binary_data = wire.encode(METRICS)
+    cases = {
+        "json": (
+            lambda: METRICS.json().encode(),
+            lambda: MetricsCollection.parse_raw(json_data),
+            len(json_data),
+        ),
+        "binary": (
+            lambda: wire.encode(METRICS),
+            lambda: wire.decode(binary_data),
+            len(binary_data),
+        ),
+    }
+    print(f"{'format':<8}{'bytes/msg':>12}{'encode msg/s':>16}{'decode msg/s':>16}")
+    for name, (encode, decode, size) in cases.items():
+        encode_rate = args.number / timeit.timeit(encode, number=args.number)
+        decode_rate = args.number / timeit.timeit(decode, number=args.number)
+        print(f"{name:<8}{size:>12}{encode_rate:>16,.0f}{decode_rate:>16,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import typing as t
+
+from .aggregation import is_failure
+from .metrics import MetricsCollection
+
+
+class AdaptiveInterval:
+    """
+    Interval of health checks of a single url adapted to its recent health.
+    Interval grows by `backoff` times after each `stable_checks` healthy checks
+    in a row with the same status, up to max_interval. It drops to min_interval
+    right away on failure, error, status change or latency regression.
+    Latency regression is response time above `latency_factor` times
+    of the moving average of response time of successful checks.
+    """
+
+    __slots__ = (
+        "min_interval",
+        "max_interval",
+        "interval",
+        "stable_checks",
+        "backoff",
+        "latency_factor",
+        "streak",
+        "last_status",
+        "average_latency",
+    )
+
+    SMOOTHING = 0.2
+    """Weight of the latest response time in the moving average"""
+
+    def __init__(
+        self,
+        min_interval: float,
+        max_interval: float,
+        interval: float,
+        stable_checks: int = 10,
+        backoff: float = 2,
+        latency_factor: float = 2,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min(max(interval, min_interval), max_interval)
+        """Current interval between checks (in seconds)"""
+
+        self.stable_checks = stable_checks
+        self.backoff = backoff
+        self.latency_factor = latency_factor
+
+        self.streak = 0
+        """Number of healthy checks in a row since the last change of interval"""
+
+        self.last_status: t.Optional[int] = None
+        self.average_latency: t.Optional[float] = None
+
+    def observe(self, metrics: MetricsCollection) -> bool:
+        """
+        Updates interval with result of the next check
+        :param metrics: metrics of the check
+        :return: True if interval was changed
+        """
+        status_changed = (
+            self.last_status is not None and metrics.status_code != self.last_status
+        )
+        self.last_status = metrics.status_code
+        regressed = (
+            self.average_latency is not None
+            and metrics.response_time > self.average_latency * self.latency_factor
+        )
+        failed = is_failure(metrics)
+        if not failed:
+            # Regressed results count too, so persistent shift of latency becomes normal
+            if self.average_latency is None:
+                self.average_latency = metrics.response_time
+            else:
+                self.average_latency += self.SMOOTHING * (
+                    metrics.response_time - self.average_latency
+                )
+        if failed or status_changed or regressed:
+            self.streak = 0
+            return self._set_interval(self.min_interval)
+        self.streak += 1
+        if self.streak < self.stable_checks:
+            return False
+        self.streak = 0
+        return self._set_interval(min(self.interval * self.backoff, self.max_interval))
+
+    def observe_error(self) -> bool:
+        """
+        Updates interval when the check failed without response
+        :return: True if interval was changed
+        """
+        self.streak = 0
+        self.last_status = None
+        return self._set_interval(self.min_interval)
+
+    def _set_interval(self, interval: float) -> bool:
+        changed = interval != self.interval
+        self.interval = interval
+        return changed
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import time
+import typing as t
+
+from .metrics import MetricsCollection, Rollup
+from .sketch import LatencySketch
+
+logger = logging.getLogger(__name__)
+
+
+def is_failure(metrics: MetricsCollection) -> bool:
+    """
+    Health check is failed if url responded with error status
+    or body_regex wasn't found
+    """
+    return metrics.status_code >= 400 or metrics.regex_found is False
+
+
+class Aggregator:
+    """
+    Aggregates metrics of health checks into per-url rollups within time windows
+    aligned to the wall clock. Rollups of the window are emitted when it's over.
+    Metrics of failed checks are aggregated too, but they should be sent
+    as is in addition to rollups, so details of failures aren't lost.
+    """
+
+    def __init__(
+        self,
+        window: float,
+        emit: t.Callable[[Rollup], t.Awaitable[None]],
+        relative_accuracy: float = 0.01,
+        emit_batch_size: int = 1000,
+    ):
+        self.window = window
+        self.relative_accuracy = relative_accuracy
+        self.emit_batch_size = emit_batch_size
+
+        self.aggregated = 0
+        """Number of aggregated metrics"""
+
+        self.emitted = 0
+        """Number of emitted rollups"""
+
+        self._emit = emit
+        self._window_start = self._align(time.time())
+        self._rollups: t.Dict[str, Rollup] = {}
+        self._flusher: t.Optional[asyncio.Task] = None
+
+    def start(self):
+        """
+        Starts emitting rollups at the end of each window
+        """
+        self._flusher = asyncio.get_event_loop().create_task(self._flush_periodically())
+
+    async def stop(self):
+        """
+        Stops periodic emitting and emits rollups of the current window
+        """
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+
+    def add(self, metrics: MetricsCollection) -> bool:
+        """
+        Adds metrics to the rollup of its url in the current window
+        :param metrics: metrics of a health check
+        :return: True if metrics should be sent as is too
+        """
+        rollup = self._rollups.get(metrics.url)
+        if rollup is None:
+            rollup = self._rollups[metrics.url] = Rollup(
+                metrics.url,
+                self._window_start,
+                self._window_start + self.window,
+                LatencySketch(self.relative_accuracy),
+            )
+        failed = is_failure(metrics)
+        rollup.add(metrics, failed)
+        self.aggregated += 1
+        return failed
+
+    async def flush(self):
+        """
+        Emits rollups of the current window and starts the next one
+        """
+        rollups, self._rollups = self._rollups, {}
+        # Timer could fire slightly before the boundary, don't repeat the same window
+        self._window_start = max(
+            self._align(time.time()), self._window_start + self.window
+        )
+        for i, rollup in enumerate(rollups.values(), 1):
+            await self._emit(rollup)
+            if not i % self.emit_batch_size:
+                # Let health checks run between batches of a large window
+                await asyncio.sleep(0)
+        self.emitted += len(rollups)
+        if rollups:
+            logger.debug(f"Emitted {len(rollups)} rollups")
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self._window_start + self.window - time.time())
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Failed to emit rollups", exc_info=e)
+
+    def _align(self, timestamp: float) -> float:
+        return timestamp - timestamp % self.window
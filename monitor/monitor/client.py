@@ -0,0 +1,86 @@
+import logging
+from types import SimpleNamespace
+from typing import Optional
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig
+from aiohttp.tracing import (
+    TraceConnectionCreateEndParams,
+    TraceConnectionReuseconnParams,
+)
+
+from monitor.config import Settings
+from monitor.tracing import timing_trace_config
+
+logger = logging.getLogger(__name__)
+
+
+class HttpClientPool:
+    """
+    Long-lived HTTP client shared by all health check jobs.
+    Keeps a keep-alive connection pool with per-host limits and
+    a TTL-bound DNS cache, so jobs don't pay for a new TCP connection,
+    DNS lookup and TLS handshake on every run.
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.new_connections = 0
+        """Number of connections opened by the pool"""
+
+        self.reused_connections = 0
+        """Number of requests served by an already opened connection"""
+
+        self._session: Optional[ClientSession] = None
+
+    @property
+    def session(self) -> ClientSession:
+        """
+        Shared client session. Created on first access,
+        so it's always bound to the running event loop.
+        """
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+        return self._session
+
+    async def close(self):
+        """
+        Closes the session and all pooled connections
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        logger.debug(
+            f"HTTP client pool closed (new connections: {self.new_connections}, "
+            f"reused connections: {self.reused_connections})"
+        )
+
+    def _create_session(self) -> ClientSession:
+        connector = TCPConnector(
+            limit=self.settings.http_pool_limit,
+            limit_per_host=self.settings.http_pool_limit_per_host,
+            ttl_dns_cache=self.settings.http_dns_cache_ttl,
+            keepalive_timeout=self.settings.http_keepalive_timeout,
+        )
+        trace_config = TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_create)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuse)
+        return ClientSession(
+            connector=connector,
+            timeout=ClientTimeout(total=self.settings.request_timeout),
+            trace_configs=[trace_config, timing_trace_config()],
+        )
+
+    async def _on_connection_create(
+        self,
+        session: ClientSession,
+        ctx: SimpleNamespace,
+        params: TraceConnectionCreateEndParams,
+    ):
+        self.new_connections += 1
+
+    async def _on_connection_reuse(
+        self,
+        session: ClientSession,
+        ctx: SimpleNamespace,
+        params: TraceConnectionReuseconnParams,
+    ):
+        self.reused_connections += 1
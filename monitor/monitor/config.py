@@ -1,3 +1,5 @@
+from typing import Literal, Optional
+
 from pydantic import BaseSettings
 
 
@@ -6,9 +8,151 @@ class Settings(BaseSettings):
     Various settings parameters for WH Monitor application
     """
 
+    loaders: str = "kafka"
+    """Comma-separated list of loaders to use. Available loaders: kafka, file"""
+
+    workers: int = 1
+    """
+    Number of worker processes. Each worker checks its own
+    part of the schedule, sharded by url
+    """
+
+    schedule_path: str = "schedule.yaml"
+    """Path to the yaml file with schedule"""
+
+    schedule_reload_interval: float = 0
+    """
+    How often to check schedule file for changes and reload it (in seconds).
+    0 disables checks, schedule still could be reloaded with SIGHUP
+    """
+
+    node_index: int = 0
+    """Index of this node in the cluster of monitors, starting from 0"""
+
+    node_count: int = 1
+    """
+    Number of nodes in the cluster of monitors. Schedule is distributed
+    between nodes by consistent hashing of urls
+    """
+
     request_timeout: int = 20
     """Request timeout (in seconds)"""
 
+    http_pool_limit: int = 1000
+    """Total number of simultaneous connections in the shared HTTP pool"""
+
+    http_pool_limit_per_host: int = 10
+    """Number of simultaneous connections to the same host in the shared HTTP pool"""
+
+    http_dns_cache_ttl: int = 300
+    """How long resolved DNS entries are cached (in seconds)"""
+
+    http_keepalive_timeout: float = 30
+    """How long idle connections are kept in the pool (in seconds)"""
+
+    scheduler_batch_size: int = 1000
+    """Maximum number of due jobs fired by scheduler in one event loop iteration"""
+
+    schedule_spread: float = 60
+    """
+    Maximum offset (in seconds) used to spread jobs with the same schedule over
+    their interval, so they don't fire at the same instant. 0 disables spreading
+    """
+
+    max_concurrent_checks: Optional[int] = None
+    """Maximum number of health checks in flight. Unlimited if not set"""
+
+    max_concurrent_checks_per_host: Optional[int] = None
+    """Maximum number of health checks in flight for the same host. Unlimited if not set"""
+
+    loader_queue_size: int = 10000
+    """Maximum number of metrics waiting in the queue of each loader"""
+
+    loader_queue_overflow: Literal["block", "drop_newest", "drop_oldest"] = (
+        "drop_oldest"
+    )
+    """
+    What to do with new metrics when loader queue is full: block - wait for a free space,
+    drop_newest - drop new metrics, drop_oldest - drop the oldest metrics in the queue
+    """
+
+    loader_workers: int = 1
+    """Number of worker tasks which load metrics from the queue of each loader"""
+
+    loader_batch_size: int = 100
+    """Maximum number of metrics passed to the loader at once"""
+
+    adaptive_stable_checks: int = 10
+    """
+    Number of healthy checks in a row with the same status after which
+    interval of adaptive entries of the schedule grows
+    """
+
+    adaptive_backoff: float = 2
+    """How many times interval of adaptive entries grows after stable checks"""
+
+    adaptive_latency_factor: float = 2
+    """
+    Interval of adaptive entries drops to the minimum when response time exceeds
+    average response time of healthy checks this many times
+    """
+
+    aggregation_window: float = 0
+    """
+    Aggregate metrics into per-url rollups within windows of this length (in seconds)
+    and send rollups instead of metrics of each check. Metrics of failed checks
+    are still sent as is. 0 disables aggregation
+    """
+
+    aggregation_relative_accuracy: float = 0.01
+    """Relative accuracy of response time quantiles in rollups"""
+
+    body_chunk_size: int = 64 * 1024
+    """Size of chunks in which response body is read for regex matching (in bytes)"""
+
+    body_max_bytes: int = 1024 * 1024
+    """Maximum number of bytes of response body examined by body_regex"""
+
+    body_drain_bytes: int = 64 * 1024
+    """
+    Rest of response body up to this size (in bytes) is read and discarded after
+    the check, so the connection is kept alive and reused by the next checks.
+    Bodies of unknown length and larger ones are left unread. 0 disables draining
+    """
+
+    body_regex_overlap: int = 1024
+    """
+    Number of trailing characters from previous chunks kept for regex matching,
+    so matches across chunk boundaries are still found
+    """
+
+    body_regex_offload_bytes: int = 256 * 1024
+    """
+    Bodies larger than this (in bytes) are matched with body_regex in worker processes,
+    so long matches don't block the event loop. 0 disables offloading
+    """
+
+    body_regex_workers: int = 1
+    """Number of worker processes to match body_regex over large bodies"""
+
+    body_regex_timeout: float = 1
+    """
+    Maximum time of matching body_regex over a chunk of large body (in seconds).
+    Check fails if it's exceeded
+    """
+
+    instrumentation_port: int = 0
+    """
+    Port to serve internal stats of the monitor in Prometheus format on /metrics.
+    Each worker process uses the port shifted by its index. 0 disables it
+    """
+
+    instrumentation_host: str = "127.0.0.1"
+    """Address to serve internal stats of the monitor on"""
+
+    loop_monitor_interval: float = 0.1
+    """How often to measure blocking of the event loop (in seconds)"""
+
     debug: bool = False
     """Indicate is this node should work in debug mode"""
 
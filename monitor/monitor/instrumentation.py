@@ -0,0 +1,252 @@
+import logging
+import typing as t
+
+from aiohttp import web
+
+from .loaders.base import AbstractLoader
+from .loaders.kafka import KafkaLoader
+from .stats import Histogram
+
+if t.TYPE_CHECKING:
+    from .monitor import HealthMonitor
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PREFIX = "wh_monitor_"
+
+
+class _Exposition:
+    """
+    Builder of metrics page in Prometheus text format
+    """
+
+    def __init__(self):
+        self._lines: t.List[str] = []
+
+    def metric(
+        self,
+        name: str,
+        kind: str,
+        description: str,
+        samples: t.Iterable[t.Tuple[t.Dict[str, str], float]],
+    ):
+        name = PREFIX + name
+        self._lines.append(f"# HELP {name} {description}")
+        self._lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            self._lines.append(f"{name}{_labels(labels)} {value}")
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        histograms: t.Iterable[t.Tuple[t.Dict[str, str], Histogram]],
+    ):
+        name = PREFIX + name
+        self._lines.append(f"# HELP {name} {description}")
+        self._lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in histograms:
+            cumulative = 0
+            bounds = [str(bucket) for bucket in histogram.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, histogram.counts):
+                cumulative += count
+                bucket_labels = _labels({**labels, "le": bound})
+                self._lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            self._lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+            self._lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+    def render(self) -> str:
+        return "\n".join(self._lines) + "\n"
+
+
+def _labels(labels: t.Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    return f"{{{pairs}}}"
+
+
+def _loader_labels(index: int, loader: AbstractLoader) -> t.Dict[str, str]:
+    """
+    Labels of the loader, unique within the monitor: its name like in WH_LOADERS
+    and its index there, so loaders of the same kind don't share series
+    """
+    name = type(loader).__name__
+    if name.endswith("Loader"):
+        name = name[: -len("Loader")]
+    return {"loader": f"{name.lower()}-{index}"}
+
+
+def render_metrics(monitor: "HealthMonitor") -> str:
+    """
+    Renders internal stats of the monitor in Prometheus text format.
+    Stats are only read here, so scrapes don't add anything to the checks
+    :param monitor: monitor to render stats of
+    :return: metrics page
+    """
+    scheduler = monitor.scheduler
+    queues = [
+        (_loader_labels(index, queue.loader), queue)
+        for index, queue in enumerate(monitor.queues)
+    ]
+    page = _Exposition()
+    page.metric(
+        "scheduled_jobs", "gauge", "Number of scheduled checks", [({}, len(scheduler))]
+    )
+    page.metric(
+        "checks_in_flight",
+        "gauge",
+        "Number of checks in progress",
+        [({}, scheduler.in_flight)],
+    )
+    page.metric(
+        "checks_fired_total",
+        "counter",
+        "Number of started checks",
+        [({}, scheduler.fired)],
+    )
+    page.metric(
+        "checks_skipped_total",
+        "counter",
+        "Number of checks skipped because previous run was still in progress",
+        [({}, scheduler.skipped)],
+    )
+    page.histogram(
+        "scheduler_lag_seconds",
+        "Delay between scheduled and actual start of checks",
+        [({}, scheduler.lag)],
+    )
+    page.metric(
+        "event_loop_blocked_seconds_total",
+        "counter",
+        "Total time the event loop was blocked",
+        [({}, monitor.loop_monitor.blocked_time)],
+    )
+    page.histogram(
+        "event_loop_lag_seconds",
+        "Delay of the event loop timer callbacks",
+        [({}, monitor.loop_monitor.lag)],
+    )
+    page.metric(
+        "http_connections_total",
+        "counter",
+        "Number of requests by type of the connection used",
+        [
+            ({"connection": "new"}, monitor.http_client.new_connections),
+            ({"connection": "reused"}, monitor.http_client.reused_connections),
+        ],
+    )
+    page.metric(
+        "loader_queue_depth",
+        "gauge",
+        "Number of metrics waiting in the loader queue",
+        [(labels, queue.depth) for labels, queue in queues],
+    )
+    page.metric(
+        "loader_loaded_total",
+        "counter",
+        "Number of metrics passed to the loader",
+        [(labels, queue.loaded) for labels, queue in queues],
+    )
+    page.metric(
+        "loader_dropped_total",
+        "counter",
+        "Number of metrics dropped because loader queue was full",
+        [(labels, queue.dropped) for labels, queue in queues],
+    )
+    page.metric(
+        "loader_failed_total",
+        "counter",
+        "Number of metrics which loader failed to load",
+        [(labels, queue.failed) for labels, queue in queues],
+    )
+    page.histogram(
+        "publish_latency_seconds",
+        "Time between publishing metrics and its loading",
+        [(labels, queue.latency) for labels, queue in queues],
+    )
+    page.histogram(
+        "loader_batch_duration_seconds",
+        "Time the loader spends to load a batch of metrics",
+        [(labels, queue.load_time) for labels, queue in queues],
+    )
+    if monitor.aggregator is not None:
+        page.metric(
+            "aggregated_total",
+            "counter",
+            "Number of metrics aggregated into rollups",
+            [({}, monitor.aggregator.aggregated)],
+        )
+        page.metric(
+            "rollups_total",
+            "counter",
+            "Number of emitted rollups",
+            [({}, monitor.aggregator.emitted)],
+        )
+    if monitor.regex_pool is not None:
+        page.metric(
+            "regex_offloaded_total",
+            "counter",
+            "Number of body_regex matches run in worker processes",
+            [({}, monitor.regex_pool.matches)],
+        )
+        page.metric(
+            "regex_timeouts_total",
+            "counter",
+            "Number of body_regex matches which exceeded the timeout",
+            [({}, monitor.regex_pool.timeouts)],
+        )
+    kafka_loaders = [
+        (_loader_labels(index, loader), loader)
+        for index, loader in enumerate(monitor.loaders)
+        if isinstance(loader, KafkaLoader)
+    ]
+    if kafka_loaders:
+        page.metric(
+            "kafka_spooled",
+            "gauge",
+            "Number of metrics waiting in the spool for Kafka",
+            [(labels, loader.spooled) for labels, loader in kafka_loaders],
+        )
+    return page.render()
+
+
+class InstrumentationServer:
+    """
+    Small HTTP server which exposes internal stats of the monitor
+    for Prometheus on /metrics
+    """
+
+    def __init__(self, monitor: "HealthMonitor", host: str, port: int):
+        self.monitor = monitor
+        self.host = host
+        self.port = port
+        self._runner: t.Optional[web.AppRunner] = None
+
+    async def start(self):
+        """
+        Starts listening on the configured address
+        """
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(
+            f"Instrumentation is served on http://{self.host}:{self.port}/metrics"
+        )
+
+    async def stop(self):
+        """
+        Stops the server
+        """
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=render_metrics(self.monitor).encode(),
+            headers={"Content-Type": CONTENT_TYPE},
+        )
@@ -1,69 +1,368 @@
 import asyncio
-import datetime
 import logging
+import time
 import typing as t
 
-from aiohttp import ClientTimeout
+from aiohttp import ClientResponse, ClientTimeout, hdrs
 from aiohttp.client import ClientSession
-from pydantic import BaseModel
 
+from monitor.client import HttpClientPool
 from monitor.config import Settings
-from monitor.metrics import MetricsCollection, collect_metrics
+from monitor.limits import ConcurrencyLimiter
+from monitor.matching import RegexPool
+from monitor.metrics import MetricsCollection, StreamingRegexMatcher, collect_metrics
+from monitor.tracing import RequestTimings, timing_trace_config
 
 if t.TYPE_CHECKING:
     from monitor.monitor import JobParams
 
 logger = logging.getLogger(__name__)
 
+CheckMode = t.Literal["get", "head", "range", "conditional"]
 
-class HealthcheckJobResult(BaseModel):
+
+class HealthcheckJobResult:
+    """
+    Class to keep request result.
+    Plain slotted object without validation, since it's created on every check
+    from values produced by aiohttp
+    """
+
+    __slots__ = (
+        "url",
+        "response_time",
+        "response_headers",
+        "response_status",
+        "regex_found",
+        "dns_time",
+        "connect_time",
+        "ttfb",
+        "download_time",
+        "check_mode",
+        "bytes_transferred",
+    )
+
+    def __init__(
+        self,
+        url: str,
+        response_time: float,
+        response_headers: t.Mapping[str, str],
+        response_status: int,
+        regex_found: t.Optional[bool] = None,
+        dns_time: t.Optional[float] = None,
+        connect_time: t.Optional[float] = None,
+        ttfb: t.Optional[float] = None,
+        download_time: t.Optional[float] = None,
+        check_mode: t.Optional[str] = None,
+        bytes_transferred: t.Optional[int] = None,
+    ):
+        self.url = url
+        self.response_time = response_time
+        """Time from start of the request till response headers received"""
+        self.response_headers = response_headers
+        """Headers of the response as is, without copying"""
+        self.response_status = response_status
+        self.regex_found = regex_found
+        self.dns_time = dns_time
+        self.connect_time = connect_time
+        self.ttfb = ttfb
+        self.download_time = download_time
+        self.check_mode = check_mode
+        self.bytes_transferred = bytes_transferred
+
+
+class CachedValidators:
+    """
+    Validators of the last response and regex result for it
+    """
+
+    __slots__ = ("etag", "last_modified", "regex_found")
+
+    def __init__(
+        self,
+        etag: t.Optional[str],
+        last_modified: t.Optional[str],
+        regex_found: t.Optional[bool],
+    ):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.regex_found = regex_found
+
+
+class ValidatorsCache:
     """
-    Class to keep request result
+    Cache of ETag/Last-Modified validators for conditional checks.
+    Entries are keyed by url and body_regex, so result of one regex
+    is never reused for another one.
     """
 
-    url: str
-    request_start_at: datetime.datetime
-    response_received_at: datetime.datetime
-    response_headers: dict
-    response_content: bytes
-    response_status: int
+    def __init__(self):
+        self._entries: t.Dict[t.Tuple[str, t.Optional[str]], CachedValidators] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, job_params: "JobParams") -> t.Optional[CachedValidators]:
+        return self._entries.get((job_params.url, job_params.body_regex))
+
+    def put(
+        self,
+        job_params: "JobParams",
+        headers: t.Mapping[str, str],
+        regex_found: t.Optional[bool],
+    ):
+        """
+        Remembers validators of the response, if there are any
+        """
+        key = (job_params.url, job_params.body_regex)
+        etag = headers.get(hdrs.ETAG)
+        last_modified = headers.get(hdrs.LAST_MODIFIED)
+        if etag is None and last_modified is None:
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = CachedValidators(etag, last_modified, regex_found)
+
+    def discard(self, job_params: "JobParams"):
+        self._entries.pop((job_params.url, job_params.body_regex), None)
 
 
 async def healthcheck_job(
     job_params: "JobParams",
     on_result: t.Callable[[MetricsCollection], t.Awaitable[None]],
     on_error: t.Callable[["JobParams", Exception], t.Awaitable[None]],
-    sync_lock: asyncio.Lock,
+    sync_lock: t.Optional[asyncio.Lock],
     settings: Settings,
+    client: t.Optional[HttpClientPool] = None,
+    limiter: t.Optional[ConcurrencyLimiter] = None,
+    validators: t.Optional[ValidatorsCache] = None,
+    regex_pool: t.Optional[RegexPool] = None,
 ):
     """
     Makes request to target url, produce metrics and send them to output queue
     :param job_params: contains JobParams instance with details about this job
     :param on_result: callback function to call with results
     :param on_error: callback function to call with any errors
-    :param sync_lock: lock to keep one instance of each health check job at a time
+    :param sync_lock: lock to keep one instance of each health check job at a time.
+                      Could be None if caller already guarantees that,
+                      like monitor.scheduler.Scheduler does
     :param settings: instance of application settings
+    :param client: shared HTTP client pool. If omitted,
+                   a one-off session is created for this check
+    :param limiter: optional limiter of health checks in flight
+    :param validators: cache of response validators for conditional checks.
+                       If omitted, conditional checks make regular requests
+    :param regex_pool: pool of worker processes to match body_regex over large bodies.
+                       If omitted, all bodies are matched on the event loop
     """
+    if sync_lock is None:
+        await _check(
+            job_params,
+            on_result,
+            on_error,
+            settings,
+            client,
+            limiter,
+            validators,
+            regex_pool,
+        )
+        return
+
     if sync_lock.locked():
         logger.debug(f"Health check locked for {job_params}. Skipping.")
         return
 
     async with sync_lock:
-        start_at = datetime.datetime.utcnow()
-        try:
-            async with ClientSession(
-                timeout=ClientTimeout(total=settings.request_timeout)
-            ) as session:
-                async with session.get(job_params.url) as response:
-                    result = HealthcheckJobResult(
-                        url=job_params.url,
-                        request_start_at=start_at,
-                        response_received_at=datetime.datetime.utcnow(),
-                        response_headers=response.headers,
-                        response_content=await response.read(),
-                        response_status=response.status,
-                    )
-            metrics = collect_metrics(result, regex_pattern=job_params.body_regex)
-            await on_result(metrics)
-        except Exception as e:
-            await on_error(job_params, e)
+        await _check(
+            job_params,
+            on_result,
+            on_error,
+            settings,
+            client,
+            limiter,
+            validators,
+            regex_pool,
+        )
+
+
+async def _check(
+    job_params: "JobParams",
+    on_result: t.Callable[[MetricsCollection], t.Awaitable[None]],
+    on_error: t.Callable[["JobParams", Exception], t.Awaitable[None]],
+    settings: Settings,
+    client: t.Optional[HttpClientPool],
+    limiter: t.Optional[ConcurrencyLimiter],
+    validators: t.Optional[ValidatorsCache],
+    regex_pool: t.Optional[RegexPool],
+):
+    """
+    Makes request to target url, produce metrics and pass them to on_result callback
+    """
+    try:
+        if limiter is not None:
+            async with limiter.acquire(job_params.url.host):
+                result = await _fetch(
+                    job_params, settings, client, validators, regex_pool
+                )
+        else:
+            result = await _fetch(job_params, settings, client, validators, regex_pool)
+        metrics = collect_metrics(result)
+        await on_result(metrics)
+    except Exception as e:
+        await on_error(job_params, e)
+
+
+async def _fetch(
+    job_params: "JobParams",
+    settings: Settings,
+    client: t.Optional[HttpClientPool],
+    validators: t.Optional[ValidatorsCache],
+    regex_pool: t.Optional[RegexPool],
+) -> HealthcheckJobResult:
+    """
+    Makes request with shared client pool, or with one-off session if pool is omitted
+    """
+    if client is not None:
+        return await _request(
+            client.session, job_params, settings, validators, regex_pool
+        )
+    async with ClientSession(
+        timeout=ClientTimeout(total=settings.request_timeout),
+        trace_configs=[timing_trace_config()],
+    ) as session:
+        return await _request(session, job_params, settings, validators, regex_pool)
+
+
+async def _request(
+    session: ClientSession,
+    job_params: "JobParams",
+    settings: Settings,
+    validators: t.Optional[ValidatorsCache] = None,
+    regex_pool: t.Optional[RegexPool] = None,
+) -> HealthcheckJobResult:
+    """
+    Makes request to target url within given session according to the check mode
+    :param session: client session to make request with
+    :param job_params: contains JobParams instance with details about this job
+    :param settings: instance of application settings
+    :param validators: cache of response validators for conditional checks
+    :param regex_pool: pool of worker processes to match regex over large bodies
+    :return: request result
+    """
+    timings = RequestTimings()
+    method = hdrs.METH_HEAD if job_params.mode == "head" else hdrs.METH_GET
+    headers = {}
+    cached = None
+    if job_params.mode == "range":
+        headers[hdrs.RANGE] = f"bytes=0-{settings.body_max_bytes - 1}"
+    elif job_params.mode == "conditional" and validators is not None:
+        cached = validators.get(job_params)
+        if cached is not None and cached.etag is not None:
+            headers[hdrs.IF_NONE_MATCH] = cached.etag
+        if cached is not None and cached.last_modified is not None:
+            headers[hdrs.IF_MODIFIED_SINCE] = cached.last_modified
+    start_at = time.monotonic()
+    async with session.request(
+        method,
+        job_params.url,
+        headers=headers,
+        allow_redirects=True,
+        trace_request_ctx=timings,
+    ) as response:
+        received_at = time.monotonic()
+        regex_found = None
+        download_time = None
+        bytes_read = 0
+        matched = False
+        if response.status == 304 and cached is not None:
+            # Body wasn't changed since the previous check
+            regex_found = cached.regex_found
+        elif job_params.body_pattern is not None:
+            regex_found, bytes_read = await _match_body(
+                response, job_params.body_pattern, settings, regex_pool
+            )
+            matched = True
+        drained = await _drain_body(response, bytes_read, settings.body_drain_bytes)
+        bytes_read += drained
+        if matched or drained:
+            download_time = time.monotonic() - received_at
+        if job_params.mode == "conditional" and validators is not None:
+            if response.status != 304:
+                validators.put(job_params, response.headers, regex_found)
+        return HealthcheckJobResult(
+            url=job_params.url,
+            response_time=received_at - start_at,
+            response_headers=response.headers,
+            response_status=response.status,
+            regex_found=regex_found,
+            dns_time=timings.dns_time,
+            connect_time=timings.connect_time,
+            ttfb=timings.ttfb,
+            download_time=download_time,
+            check_mode=job_params.mode,
+            bytes_transferred=bytes_read,
+        )
+
+
+async def _match_body(
+    response: ClientResponse,
+    pattern: t.Pattern[str],
+    settings: Settings,
+    regex_pool: t.Optional[RegexPool] = None,
+) -> t.Tuple[bool, int]:
+    """
+    Reads response body chunk by chunk and looks for regex pattern in it.
+    Stops as soon as pattern is found or settings.body_max_bytes are read,
+    so the whole body is never kept in memory.
+    Once body turns out to be larger than settings.body_regex_offload_bytes,
+    chunks are matched in the regex pool instead of the event loop.
+    :param response: response to read body from
+    :param pattern: compiled regular expression to look for
+    :param settings: instance of application settings
+    :param regex_pool: pool of worker processes to match regex over large bodies
+    :return: True if pattern was found within first settings.body_max_bytes of the body,
+             and number of bytes read
+    """
+    matcher = StreamingRegexMatcher(pattern, settings.body_regex_overlap)
+    offload_bytes = settings.body_regex_offload_bytes if regex_pool else 0
+    bytes_read = 0
+    bytes_examined = 0
+    async for chunk in response.content.iter_chunked(settings.body_chunk_size):
+        bytes_read += len(chunk)
+        chunk = chunk[: settings.body_max_bytes - bytes_examined]
+        bytes_examined += len(chunk)
+        if offload_bytes and (
+            bytes_examined > offload_bytes
+            or (response.content_length or 0) > offload_bytes
+        ):
+            assert regex_pool is not None, "Configuration error"
+            window = matcher.window(chunk)
+            found = matcher.update(window, await regex_pool.search(pattern, window))
+        else:
+            found = matcher.feed(chunk)
+        if found or bytes_examined >= settings.body_max_bytes:
+            return matcher.found, bytes_read
+    return matcher.feed(b"", final=True), bytes_read
+
+
+async def _drain_body(response: ClientResponse, bytes_read: int, limit: int) -> int:
+    """
+    Reads and discards the rest of response body, so the connection is returned
+    to the pool when the response is released. Only bodies of known length
+    with the rest up to limit are drained, others are left unread
+    and aiohttp closes the connection, unless the body is received already
+    :param response: response to read body from
+    :param bytes_read: number of body bytes already read by the check
+    :param limit: maximum number of bytes to drain
+    :return: number of bytes read
+    """
+    content_length = response.content_length
+    if content_length is None or content_length - bytes_read > limit:
+        return 0
+    drained = 0
+    # Content-Length is enforced by aiohttp, so at most limit bytes are read
+    while True:
+        chunk = await response.content.readany()
+        if not chunk:
+            break
+        drained += len(chunk)
+    return drained
@@ -0,0 +1,56 @@
+import asyncio
+import typing as t
+from contextlib import asynccontextmanager
+
+
+class _HostSlot:
+    __slots__ = ("semaphore", "users")
+
+    def __init__(self, limit: int):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.users = 0
+
+
+class ConcurrencyLimiter:
+    """
+    Limits number of health checks in flight, both in total and per target host.
+    Any of the limits could be disabled by passing None.
+    """
+
+    def __init__(self, total: t.Optional[int], per_host: t.Optional[int]):
+        self._total = asyncio.Semaphore(total) if total else None
+        self._per_host = per_host
+        self._hosts: t.Dict[str, _HostSlot] = {}
+
+    @asynccontextmanager
+    async def acquire(self, host: t.Optional[str]):
+        """
+        Waits until one more check could be run for the given host
+        :param host: target host of the check
+        """
+        slot = None
+        if self._per_host and host:
+            slot = self._hosts.get(host)
+            if slot is None:
+                slot = self._hosts[host] = _HostSlot(self._per_host)
+            slot.users += 1
+        try:
+            if slot is not None:
+                await slot.semaphore.acquire()
+            try:
+                if self._total is not None:
+                    await self._total.acquire()
+                try:
+                    yield
+                finally:
+                    if self._total is not None:
+                        self._total.release()
+            finally:
+                if slot is not None:
+                    slot.semaphore.release()
+        finally:
+            if slot is not None:
+                slot.users -= 1
+                if slot.users == 0:
+                    # Don't keep semaphores for hosts without checks in flight
+                    del self._hosts[host]  # type: ignore
@@ -1,7 +1,8 @@
 from abc import ABC, abstractmethod
 from functools import wraps
+from typing import List, Union
 
-from monitor.metrics import MetricsCollection
+from monitor.metrics import MetricsCollection, Rollup
 
 
 def ensure_connected(func):
@@ -21,13 +22,21 @@ class AbstractLoader(ABC):
     """
 
     @abstractmethod
-    async def load(self, metric: MetricsCollection):
+    async def load(self, metric: Union[MetricsCollection, Rollup]):
         """
         Loads metrics
-        :param metric: metrics to load
+        :param metric: metrics or rollup of aggregated metrics to load
         """
         pass
 
+    async def load_batch(self, metrics: List[Union[MetricsCollection, Rollup]]):
+        """
+        Loads batch of metrics. Loaders could override it to load whole batch at once
+        :param metrics: list of metrics and rollups to load
+        """
+        for metric in metrics:
+            await self.load(metric)
+
     @abstractmethod
     async def connect(self):
         """
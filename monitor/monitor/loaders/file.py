@@ -0,0 +1,272 @@
+import asyncio
+import csv
+import datetime
+import gzip
+import io
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, List, Literal, Optional, Tuple, Union
+
+from pydantic import BaseSettings
+
+from monitor.metrics import MetricsCollection, Rollup
+
+from .base import AbstractLoader, ensure_connected
+
+logger = logging.getLogger(__name__)
+
+
+class FileLoaderSettings(BaseSettings):
+    path: str = "metrics.jsonl"
+    """Path to the output file"""
+
+    format: Literal["jsonl", "csv"] = "jsonl"
+    """Format of the output file"""
+
+    buffer_size: int = 1000
+    """Number of buffered metrics which triggers write to the file"""
+
+    flush_interval: float = 1
+    """Maximum time metrics are kept in the buffer before written (in seconds)"""
+
+    max_buffered: int = 100000
+    """
+    Maximum number of metrics kept in the buffer while they can't be written.
+    Oldest ones are dropped above it
+    """
+
+    rotate_bytes: int = 100 * 1024 * 1024
+    """Rotate file when it reaches this size (in bytes). 0 disables rotation by size"""
+
+    rotate_interval: float = 0
+    """Rotate file after this time since it was opened (in seconds). 0 disables it"""
+
+    compress: bool = False
+    """Compress rotated files with gzip"""
+
+    class Config:
+        env_prefix = "wh_file_"
+
+
+class FileLoader(AbstractLoader):
+    """
+    Loader to append metrics to local file in JSON lines or CSV format.
+    Metrics are buffered and written in batches, all file operations are made
+    in a dedicated thread, so they don't block the event loop.
+    Rotated files are renamed with timestamp suffix and optionally compressed.
+    Rollups of aggregated metrics are written only in JSON lines format,
+    since their columns differ from metrics columns.
+    Metrics which couldn't be written are kept in the buffer and written
+    with the next flush.
+    """
+
+    def __init__(self, settings: Optional[FileLoaderSettings] = None):
+        self._settings = settings or FileLoaderSettings()
+        self._buffer: List[Union[MetricsCollection, Rollup]] = []
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix="file-loader")
+        self._compressor = ThreadPoolExecutor(1, thread_name_prefix="file-compressor")
+        self._flusher: Optional[asyncio.Task] = None
+        self._file: Optional[IO[bytes]] = None
+        self._file_size = 0
+        self._opened_at = 0.0
+        self._fields = list(MetricsCollection.FIELDS)
+
+        self.written = 0
+        """Number of metrics written to the file"""
+
+        self.failed = 0
+        """Number of metrics dropped since they couldn't be written"""
+
+        self.skipped = 0
+        """Number of rollups skipped, since CSV format can't hold them"""
+
+    async def connect(self):
+        if self._flusher is None:
+            self._flusher = asyncio.get_event_loop().create_task(
+                self._flush_periodically()
+            )
+
+    @ensure_connected
+    async def load(self, metric: Union[MetricsCollection, Rollup]):
+        self._buffer.append(metric)
+        if len(self._buffer) >= self._settings.buffer_size:
+            await self._try_flush()
+
+    @ensure_connected
+    async def load_batch(self, metrics: List[Union[MetricsCollection, Rollup]]):
+        self._buffer.extend(metrics)
+        if len(self._buffer) >= self._settings.buffer_size:
+            await self._try_flush()
+
+    async def flush(self):
+        """
+        Writes buffered metrics to the file.
+        If write fails, metrics are put back to the buffer
+        """
+        if not self._buffer:
+            return
+        metrics, self._buffer = self._buffer, []
+        try:
+            written = await asyncio.get_event_loop().run_in_executor(
+                self._writer, self._write, metrics
+            )
+        except Exception:
+            self._buffer[:0] = metrics
+            self._trim_buffer()
+            raise
+        self.written += written
+        skipped = len(metrics) - written
+        if skipped and not self.skipped:
+            logger.warning("Rollups can't be written in CSV format, skip them")
+        self.skipped += skipped
+
+    async def shutdown(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+        try:
+            await self.flush()
+        except Exception as e:
+            self.failed += len(self._buffer)
+            self._buffer = []
+            logger.error("Failed to write metrics to the file on shutdown", exc_info=e)
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self._writer, self._close)
+        self._writer.shutdown()
+        # Wait for compression of rotated files without blocking the loop
+        await loop.run_in_executor(None, self._compressor.shutdown)
+        logger.debug(
+            f"FileLoader shutdown completed (written: {self.written}, "
+            f"failed: {self.failed}, skipped: {self.skipped})"
+        )
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self._settings.flush_interval)
+            await self._try_flush()
+
+    async def _try_flush(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(
+                f"Failed to write metrics to the file, "
+                f"{len(self._buffer)} metrics are kept in the buffer",
+                exc_info=e,
+            )
+
+    def _trim_buffer(self):
+        """
+        Drops oldest metrics above max_buffered
+        """
+        excess = len(self._buffer) - self._settings.max_buffered
+        if excess > 0:
+            del self._buffer[:excess]
+            self.failed += excess
+            logger.warning(f"Buffer of the file loader is full, drop {excess} metrics")
+
+    def _write(self, metrics: List[Union[MetricsCollection, Rollup]]) -> int:
+        """
+        Appends metrics to the file and rotates it if needed
+        :return: number of written metrics
+        """
+        if self._file is None:
+            self._open()
+        assert self._file is not None, "File is not opened"
+        text, written = self._serialize(metrics)
+        data = text.encode()
+        try:
+            self._write_all(data)
+        except Exception:
+            self._discard_partial_write()
+            raise
+        self._file_size += len(data)
+        if self._should_rotate():
+            try:
+                self._rotate()
+            except Exception as e:
+                # Metrics are written already, rotation is retried with the next write
+                logger.error("Failed to rotate metrics file", exc_info=e)
+        return written
+
+    def _write_all(self, data: bytes):
+        """
+        Writes data to the unbuffered file, so nothing is left pending
+        in a buffer to be written again with the retry
+        """
+        assert self._file is not None, "File is not opened"
+        view = memoryview(data)
+        while view:
+            view = view[self._file.write(view) :]
+
+    def _discard_partial_write(self):
+        """
+        Truncates the file to its size before the failed write, so metrics
+        which are put back to the buffer aren't written twice
+        """
+        assert self._file is not None, "File is not opened"
+        try:
+            os.ftruncate(self._file.fileno(), self._file_size)
+        except OSError as e:
+            logger.error("Failed to discard partially written metrics", exc_info=e)
+            # File size is read again when it's reopened by the next write
+            self._close()
+
+    def _serialize(
+        self, metrics: List[Union[MetricsCollection, Rollup]]
+    ) -> Tuple[str, int]:
+        """
+        :return: serialized metrics and their number
+        """
+        if self._settings.format == "jsonl":
+            return "".join(f"{metric.json()}\n" for metric in metrics), len(metrics)
+        output = io.StringIO()
+        writer = csv.DictWriter(output, self._fields)
+        if self._file_size == 0:
+            writer.writeheader()
+        rows = [
+            metric.dict() for metric in metrics if isinstance(metric, MetricsCollection)
+        ]
+        writer.writerows(rows)
+        return output.getvalue(), len(rows)
+
+    def _open(self):
+        self._file = open(self._settings.path, "ab", buffering=0)
+        self._file_size = os.path.getsize(self._settings.path)
+        self._opened_at = time.monotonic()
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _should_rotate(self) -> bool:
+        if (
+            self._settings.rotate_bytes
+            and self._file_size >= self._settings.rotate_bytes
+        ):
+            return True
+        return bool(
+            self._settings.rotate_interval
+            and time.monotonic() - self._opened_at >= self._settings.rotate_interval
+        )
+
+    def _rotate(self):
+        self._close()
+        suffix = datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S-%f")
+        rotated_path = f"{self._settings.path}.{suffix}"
+        os.rename(self._settings.path, rotated_path)
+        logger.debug(f"Metrics file rotated to {rotated_path}")
+        if self._settings.compress:
+            self._compressor.submit(self._compress, rotated_path)
+
+    @staticmethod
+    def _compress(path: str):
+        try:
+            with open(path, "rb") as source, gzip.open(f"{path}.gz", "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.remove(path)
+        except Exception as e:
+            logger.error(f"Failed to compress {path}", exc_info=e)
@@ -1,17 +1,65 @@
+import asyncio
 import logging
-from typing import Optional
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Literal, Optional, Set, Tuple, Union
 
 import aiokafka
+from aiokafka.errors import KafkaError
 from aiokafka.helpers import create_ssl_context
 from pydantic import BaseSettings
 
-from monitor.metrics import MetricsCollection
-from monitor.utils import BackoffPolicy
+from monitor import wire
+from monitor.metrics import MetricsCollection, Rollup
+from monitor.spool import DiskSpool
+from monitor.utils import BackoffPolicy, MaxRetriesExceeded
 
 from .base import AbstractLoader, ensure_connected
 
 logger = logging.getLogger(__name__)
 
+# Types of records, which define how to send them
+_JSON_RECORD = b"\x00"
+_BINARY_RECORD = b"\x01"
+_ROLLUP_RECORD = b"\x02"
+_RECORD_OPTIONS: Dict[bytes, Dict[str, Any]] = {
+    _JSON_RECORD: {},
+    _BINARY_RECORD: {"headers": [(wire.CONTENT_TYPE_HEADER, wire.BINARY_CONTENT_TYPE)]},
+    _ROLLUP_RECORD: {"headers": [(wire.CONTENT_TYPE_HEADER, wire.ROLLUP_CONTENT_TYPE)]},
+}
+_KEYED_RECORD = 0x80
+"""Flag of spooled records which keep the partitioning key before the value"""
+
+# Type of the record, partitioning key and encoded value
+Record = Tuple[bytes, Optional[bytes], bytes]
+
+
+def _pack_record(record: Record) -> bytes:
+    """
+    Packs record to keep it in the spool
+    """
+    record_type, key, value = record
+    if key is None:
+        return record_type + value
+    return (
+        bytes([record_type[0] | _KEYED_RECORD])
+        + struct.pack("<H", len(key))
+        + key
+        + value
+    )
+
+
+def _unpack_record(data: bytes) -> Record:
+    """
+    Unpacks record read from the spool
+    """
+    if not data[0] & _KEYED_RECORD:
+        # Spooled before records were keyed
+        return data[:1], None, data[1:]
+    (length,) = struct.unpack_from("<H", data, 1)
+    return bytes([data[0] & ~_KEYED_RECORD]), data[3 : 3 + length], data[3 + length :]
+
 
 class KafkaLoaderSettings(BaseSettings):
     bootstrap_servers: str
@@ -23,13 +71,69 @@ class KafkaLoaderSettings(BaseSettings):
     ssl_auth: bool = False
     """Enable SSL authentication mechanism for Kafka."""
 
+    wire_format: Literal["json", "binary"] = "json"
+    """
+    Encoding of metrics. Binary format is more compact and faster to process,
+    but requires metrics service which supports it
+    """
+
+    pipelined: bool = False
+    """
+    Send metrics without waiting for broker acknowledgement of each one.
+    Failed deliveries are retried in background
+    """
+
+    linger_ms: int = 0
+    """How long producer waits for more metrics to put them into the same batch"""
+
+    max_batch_size: int = 16384
+    """Maximum size of batch of metrics sent to the broker (in bytes)"""
+
+    compression_type: Optional[Literal["gzip", "snappy", "lz4", "zstd"]] = None
+    """Compression of metrics batches. No compression by default"""
+
+    buffer_size: int = 10000
+    """Maximum number of metrics waiting for delivery in pipelined mode"""
+
+    buffer_overflow: Literal["block", "drop"] = "block"
+    """
+    What to do with new metrics in pipelined mode when buffer is full:
+    block - wait until there is a free space, drop - drop metrics and count them
+    """
+
+    spool_dir: Optional[str] = None
+    """
+    Directory to spool metrics to while Kafka is unavailable.
+    Spooled metrics are sent in order as soon as Kafka is reachable again.
+    Spool is disabled by default
+    """
+
+    spool_max_bytes: int = 1024 * 1024 * 1024
+    """Maximum size of the spool (in bytes). The oldest metrics are dropped when it's exceeded"""
+
+    spool_segment_bytes: int = 16 * 1024 * 1024
+    """Size of a single spool file (in bytes)"""
+
+    spool_replay_batch_size: int = 1000
+    """Number of spooled metrics sent to Kafka at once on replay"""
+
+    spool_retry_interval: float = 5
+    """How often to try to reach Kafka while it's unavailable (in seconds)"""
+
     class Config:
         env_prefix = "wh_kafka_"
 
 
 class KafkaLoader(AbstractLoader):
     """
-    Loader to upload metrics to target Kafka topic
+    Loader to upload metrics to target Kafka topic.
+
+    If spool is enabled, metrics are written to the local disk spool while Kafka
+    is unavailable instead of failing. Background task reconnects to Kafka and
+    replays spooled metrics in batches, new metrics go to the spool until it's drained,
+    so the order is kept. Except for pipelined mode: metrics which failed
+    to be delivered are spooled after the ones spooled meanwhile,
+    so they are replayed out of the order of checks.
     """
 
     def __init__(self, settings: Optional[KafkaLoaderSettings] = None):
@@ -38,9 +142,52 @@ class KafkaLoader(AbstractLoader):
         # Kafka on fresh start could take up to 30 seconds to properly setup
         # so let's expect this in our backoff policy
         self._backoff_policy = BackoffPolicy(3, 10, 10)
+        self._delivery_backoff_policy = BackoffPolicy(3, 1, 1)
+        self._buffer = asyncio.Semaphore(self._settings.buffer_size)
+        self._redeliveries: Set[asyncio.Task] = set()
+        self._delivered = asyncio.Event()
+
+        self.in_flight = 0
+        """Number of metrics waiting for delivery in pipelined mode"""
+
+        self.dropped = 0
+        """Number of metrics dropped because buffer was full"""
+
+        self.failed = 0
+        """Number of metrics which weren't delivered even after retries"""
+
+        self.replayed = 0
+        """Number of metrics sent to Kafka from the spool"""
+
+        self._spool: Optional[DiskSpool] = None
+        self._spool_executor: Optional[ThreadPoolExecutor] = None
+        self._replayer: Optional[asyncio.Task] = None
+        self._replay_wakeup = asyncio.Event()
+        self._started = False
+        self._available = False
+        if self._settings.spool_dir is not None:
+            self._spool = DiskSpool(
+                self._settings.spool_dir,
+                segment_bytes=self._settings.spool_segment_bytes,
+                max_bytes=self._settings.spool_max_bytes,
+            )
+            self._spool_executor = ThreadPoolExecutor(
+                1, thread_name_prefix="kafka-spool"
+            )
+
+    @property
+    def spooled(self) -> int:
+        """Number of metrics waiting in the spool"""
+        return self._spool.depth if self._spool is not None else 0
 
     async def connect(self):
         if self._conn is None:
+            options = dict(
+                bootstrap_servers=self._settings.bootstrap_servers,
+                linger_ms=self._settings.linger_ms,
+                max_batch_size=self._settings.max_batch_size,
+                compression_type=self._settings.compression_type,
+            )
             if self._settings.ssl_auth:
                 ssl_context = create_ssl_context(
                     cafile="init/kafka/ca.pem",
@@ -48,27 +195,224 @@ class KafkaLoader(AbstractLoader):
                     keyfile="init/kafka/service.key",
                 )
                 self._conn = aiokafka.AIOKafkaProducer(
-                    bootstrap_servers=self._settings.bootstrap_servers,
+                    **options,
                     ssl_context=ssl_context,
                     security_protocol="SSL",
                 )
             else:
-                self._conn = aiokafka.AIOKafkaProducer(
-                    bootstrap_servers=self._settings.bootstrap_servers,
-                )
+                self._conn = aiokafka.AIOKafkaProducer(**options)
+            if self._spool is not None:
+                # Don't wait for Kafka, metrics are spooled until it's reachable
+                self._replayer = asyncio.get_event_loop().create_task(self._replay())
+                return
             await self._backoff_policy.run(self._conn.start)
+            self._started = self._available = True
             logger.debug(
                 f"Successfully established connection to Kafka on {self._settings.bootstrap_servers}"
             )
 
     @ensure_connected
-    async def load(self, result: MetricsCollection):
-        assert self._conn is not None, "Kafka connection is not initialized"
-        await self._conn.send_and_wait(
-            self._settings.output_topic, result.json().encode()
-        )
+    async def load(self, result: Union[MetricsCollection, Rollup]):
+        record = self._encode(result)
+        if self._spool is None:
+            await self._send(result, record)
+            return
+        if not self._available or self._spool.depth:
+            await self._to_spool([record])
+            return
+        try:
+            await self._send(result, record)
+        except KafkaError as e:
+            logger.warning("Failed to send metrics to Kafka, spool them", exc_info=e)
+            self._available = False
+            await self._to_spool([record])
+
+    @ensure_connected
+    async def load_batch(self, metrics: List[Union[MetricsCollection, Rollup]]):
+        if self._spool is not None and (not self._available or self._spool.depth):
+            await self._to_spool([self._encode(metric) for metric in metrics])
+            return
+        for metric in metrics:
+            await self.load(metric)
 
     async def shutdown(self):
+        if self._replayer is not None:
+            self._replayer.cancel()
+            await asyncio.gather(self._replayer, return_exceptions=True)
         if self._conn is not None:
+            await self._conn.flush()
+            if self.in_flight:
+                # Wait for delivery callbacks and retries of failed deliveries
+                await self._delivered.wait()
             await self._conn.stop()
-        logger.debug("KafkaLoader shutdown completed")
+        if self._spool is not None and self._spool_executor is not None:
+            await asyncio.get_event_loop().run_in_executor(
+                self._spool_executor, self._spool.close
+            )
+            self._spool_executor.shutdown()
+        logger.debug(
+            f"KafkaLoader shutdown completed (dropped: {self.dropped}, failed: {self.failed}, "
+            f"spooled: {self.spooled})"
+        )
+
+    async def _send(self, result: Union[MetricsCollection, Rollup], record: Record):
+        assert self._conn is not None, "Kafka connection is not initialized"
+        record_type, key, value = record
+        options = _RECORD_OPTIONS[record_type]
+        if not self._settings.pipelined:
+            await self._conn.send_and_wait(
+                self._settings.output_topic, value, key=key, **options
+            )
+            return
+
+        if (
+            self._settings.buffer_overflow == "drop"
+            and self.in_flight >= self._settings.buffer_size
+        ):
+            self.dropped += 1
+            logger.debug(f"Kafka buffer is full, drop metrics for {result.url}")
+            return
+        await self._buffer.acquire()
+        self.in_flight += 1
+        self._delivered.clear()
+        try:
+            delivery = await self._conn.send(
+                self._settings.output_topic, value, key=key, **options
+            )
+        except Exception:
+            self._release()
+            raise
+        delivery.add_done_callback(partial(self._on_delivery, record))
+
+    def _on_delivery(self, record: Record, delivery: asyncio.Future):
+        if delivery.cancelled() or delivery.exception() is None:
+            self._release()
+            return
+        if self._spool is not None:
+            logger.warning(
+                "Failed to deliver metrics to Kafka, spool them",
+                exc_info=delivery.exception(),
+            )
+            self._available = False
+            task = asyncio.get_event_loop().create_task(self._spool_undelivered(record))
+        else:
+            logger.warning(
+                "Failed to deliver metrics to Kafka, retry",
+                exc_info=delivery.exception(),
+            )
+            task = asyncio.get_event_loop().create_task(self._redeliver(record))
+        self._redeliveries.add(task)
+        task.add_done_callback(self._redeliveries.discard)
+
+    async def _redeliver(self, record: Record):
+        assert self._conn is not None, "Kafka connection is not initialized"
+        record_type, key, value = record
+        try:
+            await self._delivery_backoff_policy.run(
+                self._conn.send_and_wait,
+                self._settings.output_topic,
+                value,
+                key=key,
+                **_RECORD_OPTIONS[record_type],
+            )
+        except MaxRetriesExceeded:
+            self.failed += 1
+        finally:
+            self._release()
+
+    async def _spool_undelivered(self, record: Record):
+        try:
+            await self._to_spool([record])
+        finally:
+            self._release()
+
+    async def _to_spool(self, records: List[Record]):
+        assert self._spool is not None, "Spool is not enabled"
+        # Keep the type of each record, wire format could be changed before replay
+        await asyncio.get_event_loop().run_in_executor(
+            self._spool_executor,
+            self._spool.append,
+            [_pack_record(record) for record in records],
+        )
+        self._replay_wakeup.set()
+
+    async def _replay(self):
+        """
+        Connects to Kafka and sends spooled metrics whenever there are any
+        """
+        assert self._conn is not None, "Kafka connection is not initialized"
+        assert self._spool is not None, "Spool is not enabled"
+        while True:
+            try:
+                if not self._started:
+                    await self._conn.start()
+                    self._started = True
+                    logger.debug(
+                        f"Successfully established connection to Kafka on {self._settings.bootstrap_servers}"
+                    )
+                if self._spool.depth:
+                    logger.info(f"Replay {self._spool.depth} spooled metrics to Kafka")
+                while self._spool.depth:
+                    await self._replay_batch()
+                self._available = True
+                if self._spool.depth:
+                    continue
+                self._replay_wakeup.clear()
+                await self._replay_wakeup.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._available = False
+                logger.warning(
+                    f"Kafka is unavailable, {self._spool.depth} metrics are spooled. "
+                    f"Retry in {self._settings.spool_retry_interval}s",
+                    exc_info=e,
+                )
+                await asyncio.sleep(self._settings.spool_retry_interval)
+
+    async def _replay_batch(self):
+        """
+        Sends the batch of spooled metrics without waiting for each of them
+        and consumes it from the spool when all of them are delivered
+        """
+        assert self._conn is not None, "Kafka connection is not initialized"
+        assert self._spool is not None, "Spool is not enabled"
+        loop = asyncio.get_event_loop()
+        records = await loop.run_in_executor(
+            self._spool_executor,
+            self._spool.read,
+            self._settings.spool_replay_batch_size,
+        )
+        deliveries = []
+        for data in records:
+            record_type, key, value = _unpack_record(data)
+            deliveries.append(
+                await self._conn.send(
+                    self._settings.output_topic,
+                    value,
+                    key=key,
+                    **_RECORD_OPTIONS[record_type],
+                )
+            )
+        await asyncio.gather(*deliveries)
+        await loop.run_in_executor(self._spool_executor, self._spool.commit)
+        self.replayed += len(records)
+
+    def _encode(self, result: Union[MetricsCollection, Rollup]) -> Record:
+        """
+        Encodes metrics or rollup. Records are keyed by url, so all records
+        of the same url get to the same partition and are kept in order
+        :return: type of the record, partitioning key and encoded value
+        """
+        key = result.url.encode()
+        if isinstance(result, Rollup):
+            return _ROLLUP_RECORD, key, result.json().encode()
+        if self._settings.wire_format == "binary":
+            return _BINARY_RECORD, key, wire.encode(result)
+        return _JSON_RECORD, key, result.json().encode()
+
+    def _release(self):
+        self.in_flight -= 1
+        self._buffer.release()
+        if not self.in_flight:
+            self._delivered.set()
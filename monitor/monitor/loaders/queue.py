@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+import typing as t
+
+from monitor.metrics import MetricsCollection, Rollup
+from monitor.stats import Histogram
+
+from .base import AbstractLoader
+
+logger = logging.getLogger(__name__)
+
+OverflowPolicy = t.Literal["block", "drop_newest", "drop_oldest"]
+Item = t.Union[MetricsCollection, Rollup]
+
+
+class LoaderQueue:
+    """
+    Bounded queue in front of a single loader.
+    Metrics are put into the queue and loaded in batches by dedicated worker tasks,
+    so health checks don't wait for the loader and slow loader doesn't affect others.
+
+    When queue is full, new metrics are handled according to overflow policy:
+    block - wait for a free space, drop_newest - drop new metrics,
+    drop_oldest - drop the oldest metrics in the queue to make room for new ones.
+    """
+
+    def __init__(
+        self,
+        loader: AbstractLoader,
+        size: int = 10000,
+        workers: int = 1,
+        batch_size: int = 100,
+        overflow: OverflowPolicy = "drop_oldest",
+    ):
+        self.loader = loader
+        self.workers = workers
+        self.batch_size = batch_size
+        self.overflow = overflow
+
+        self.loaded = 0
+        """Number of metrics passed to the loader"""
+
+        self.dropped = 0
+        """Number of metrics dropped because queue was full"""
+
+        self.failed = 0
+        """Number of metrics which loader failed to load"""
+
+        self.last_latency = 0.0
+        """Time between putting the last loaded metrics into the queue and its loading"""
+
+        self.max_latency = 0.0
+        """Maximum time between putting metrics into the queue and its loading"""
+
+        self.latency = Histogram()
+        """Distribution of time between putting metrics into the queue and its loading"""
+
+        self.load_time = Histogram()
+        """Distribution of time the loader spends to load a batch"""
+
+        self._queue: "asyncio.Queue[t.Tuple[float, Item]]" = asyncio.Queue(size)
+        self._workers: t.List[asyncio.Task] = []
+
+    @property
+    def depth(self) -> int:
+        """Number of metrics waiting in the queue"""
+        return self._queue.qsize()
+
+    def start(self):
+        """
+        Starts worker tasks
+        """
+        loop = asyncio.get_event_loop()
+        self._workers = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10):
+        """
+        Waits until queue is drained and stops worker tasks
+        :param timeout: how long to wait for queue to drain
+        """
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"{self.depth} metrics left in the queue of {self.loader!r} on stop"
+            )
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def put(self, metrics: Item, wait: bool = False):
+        """
+        Puts metrics into the queue
+        :param metrics: metrics or rollup to load
+        :param wait: wait for a free space regardless of overflow policy
+        """
+        item = (time.monotonic(), metrics)
+        if wait or self.overflow == "block":
+            await self._queue.put(item)
+            return
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.overflow == "drop_oldest":
+                self._queue.get_nowait()
+                self._queue.task_done()
+                self._queue.put_nowait(item)
+
+    async def _work(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            started_at = time.monotonic()
+            try:
+                await self.loader.load_batch([metrics for _, metrics in batch])
+                self.loaded += len(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                logger.error(f"Failed to load metrics with {self.loader!r}", exc_info=e)
+            finally:
+                finished_at = time.monotonic()
+                self.load_time.observe(finished_at - started_at)
+                self.last_latency = finished_at - batch[0][0]
+                self.max_latency = max(self.max_latency, self.last_latency)
+                self.latency.observe(self.last_latency)
+                for _ in batch:
+                    self._queue.task_done()
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import multiprocessing
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+
+class RegexTimeoutError(Exception):
+    """
+    Regex matching didn't complete within the timeout
+    """
+
+
+def _search(pattern: t.Pattern[str], window: str) -> bool:
+    return pattern.search(window) is not None
+
+
+def _ping() -> bool:
+    return True
+
+
+class RegexPool:
+    """
+    Pool of worker processes to match regular expressions over large bodies
+    off the event loop. Threads wouldn't help here, since `re` holds the GIL
+    for the whole match. Workers are started on the first match.
+    If a match exceeds the timeout, the pool is replaced with a new one,
+    so a catastrophic regex doesn't occupy the worker forever.
+    Matches running in the replaced pool at that moment fail too.
+    """
+
+    def __init__(self, workers: int, timeout: float):
+        self.workers = workers
+        self.timeout = timeout
+
+        self.matches = 0
+        """Number of matches run in the pool"""
+
+        self.timeouts = 0
+        """Number of matches which exceeded the timeout"""
+
+        self._context = multiprocessing.get_context("spawn")
+        self._pool: t.Optional[t.Any] = None
+        self._ready: t.Optional[asyncio.Future] = None
+        self._pending: t.Set[asyncio.Future] = set()
+
+    async def search(self, pattern: t.Pattern[str], window: str) -> bool:
+        """
+        Looks for pattern in the window in a worker process
+        :param pattern: compiled regular expression
+        :param window: text to look for pattern in
+        :return: True if pattern was found
+        :raises RegexTimeoutError: if matching took longer than the timeout
+        """
+        loop = asyncio.get_running_loop()
+        if self._pool is None:
+            self._pool = self._context.Pool(self.workers)
+            # Start of the workers shouldn't count into the timeout of matches
+            self._ready = loop.run_in_executor(None, self._pool.apply, _ping)
+        pool, ready, pending = self._pool, self._ready, self._pending
+        assert ready is not None, "Configuration error"
+        await ready
+        future = loop.create_future()
+        pending.add(future)
+
+        def resolve(result: t.Any, error: bool = False):
+            loop.call_soon_threadsafe(_resolve, future, result, error)
+
+        pool.apply_async(
+            _search,
+            (pattern, window),
+            callback=resolve,
+            error_callback=lambda e: resolve(e, error=True),
+        )
+        self.matches += 1
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            if pending is self._pending:
+                self._restart()
+            raise RegexTimeoutError(
+                f"Regex {pattern.pattern!r} took longer than {self.timeout}s"
+            ) from None
+        finally:
+            pending.discard(future)
+
+    async def close(self):
+        """
+        Terminates worker processes
+        """
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.get_running_loop().run_in_executor(None, pool.terminate)
+
+    def _restart(self):
+        """
+        Terminates the pool and fails its matches, new one is started on the next match
+        """
+        logger.warning("Regex matching timed out, restart regex workers")
+        pool, self._pool = self._pool, None
+        pending, self._pending = self._pending, set()
+        for future in pending:
+            if not future.done():
+                future.set_exception(RegexTimeoutError("Regex workers were restarted"))
+        if pool is not None:
+            # Terminating waits for the workers to exit, keep it off the event loop
+            asyncio.get_running_loop().run_in_executor(None, pool.terminate)
+
+
+def _resolve(future: asyncio.Future, result: t.Any, error: bool):
+    if future.done():
+        return
+    if error:
+        future.set_exception(result)
+    else:
+        future.set_result(result)
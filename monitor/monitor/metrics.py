@@ -1,35 +1,253 @@
+import codecs
+import json
+import math
 import re
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Any, ClassVar, Dict, Optional, Pattern, Tuple, Union
 
-from pydantic import BaseModel
+from monitor.sketch import LatencySketch
 
 if TYPE_CHECKING:
     from monitor.job import HealthcheckJobResult
 
 
-class MetricsCollection(BaseModel):
-    url: str
-    response_time: float
-    status_code: int
-    regex_found: Optional[bool]
+class MetricsCollection:
+    """
+    Metrics of a single health check.
+    It's created on every check and serialized right away by loaders,
+    so it's a plain slotted object without validation: all values are produced
+    by the monitor itself. Serialization is compatible with the pydantic model
+    of the same name used by metrics service.
+    """
+
+    __slots__ = (
+        "url",
+        "response_time",
+        "status_code",
+        "regex_found",
+        "dns_time",
+        "connect_time",
+        "ttfb",
+        "download_time",
+        "check_mode",
+        "bytes_transferred",
+    )
+
+    FIELDS: ClassVar[Tuple[str, ...]] = __slots__
+    """Names of all fields in order of serialization"""
+
+    def __init__(
+        self,
+        url: str,
+        response_time: float,
+        status_code: int,
+        regex_found: Optional[bool] = None,
+        dns_time: Optional[float] = None,
+        connect_time: Optional[float] = None,
+        ttfb: Optional[float] = None,
+        download_time: Optional[float] = None,
+        check_mode: Optional[str] = None,
+        bytes_transferred: Optional[int] = None,
+    ):
+        self.url = url
+        self.response_time = response_time
+        self.status_code = status_code
+        self.regex_found = regex_found
+        self.dns_time = dns_time
+        """Time of DNS resolution. None if address was cached or connection reused"""
+        self.connect_time = connect_time
+        """Time of establishing connection with TLS handshake. None if connection reused"""
+        self.ttfb = ttfb
+        """Time from getting connection to receiving response headers"""
+        self.download_time = download_time
+        """Time of reading response body. None if body wasn't read"""
+        self.check_mode = check_mode
+        """Mode of the check: get, head, range or conditional"""
+        self.bytes_transferred = bytes_transferred
+        """
+        Number of response body bytes received by the check, including the rest
+        of the body drained to keep the connection alive
+        """
+
+    @classmethod
+    def construct(cls, **fields: Any) -> "MetricsCollection":
+        """
+        Creates metrics from fields, the same as constructor
+        """
+        return cls(**fields)
+
+    @classmethod
+    def parse_raw(cls, data: Union[str, bytes]) -> "MetricsCollection":
+        """
+        Parses metrics from JSON
+        """
+        return cls(**json.loads(data))
+
+    def dict(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in self.FIELDS}
 
+    def json(self) -> str:
+        return json.dumps(self.dict())
 
-def collect_metrics(
-    result: "HealthcheckJobResult", regex_pattern: Optional[str]
-) -> MetricsCollection:
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, MetricsCollection):
+            return NotImplemented
+        return all(
+            getattr(self, field) == getattr(other, field) for field in self.FIELDS
+        )
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in self.FIELDS)
+        return f"{type(self).__name__}({fields})"
+
+
+class Rollup:
+    """
+    Aggregated metrics of all health checks of the url within time window
+    """
+
+    __slots__ = (
+        "url",
+        "window_start",
+        "window_end",
+        "count",
+        "failures",
+        "status_counts",
+        "regex_checked",
+        "regex_found",
+        "response_time_min",
+        "response_time_max",
+        "response_time_sum",
+        "response_time_sketch",
+    )
+
+    FIELDS: ClassVar[Tuple[str, ...]] = __slots__
+    """Names of all fields in order of serialization"""
+
+    def __init__(
+        self, url: str, window_start: float, window_end: float, sketch: LatencySketch
+    ):
+        self.url = url
+        self.window_start = window_start
+        """Start of the window (unix timestamp)"""
+        self.window_end = window_end
+        """End of the window (unix timestamp)"""
+        self.count = 0
+        """Number of health checks"""
+        self.failures = 0
+        """Number of failed health checks, which were also sent as raw metrics"""
+        self.status_counts: Dict[str, int] = {}
+        """Number of health checks by status code"""
+        self.regex_checked = 0
+        """Number of health checks which examined body with regex"""
+        self.regex_found = 0
+        """Number of health checks which found regex in the body"""
+        self.response_time_min = math.inf
+        self.response_time_max = 0.0
+        self.response_time_sum = 0.0
+        self.response_time_sketch = sketch
+        """Distribution of response time"""
+
+    def add(self, metrics: MetricsCollection, failed: bool):
+        """
+        Adds metrics of a single health check
+        """
+        self.count += 1
+        if failed:
+            self.failures += 1
+        status = str(metrics.status_code)
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        if metrics.regex_found is not None:
+            self.regex_checked += 1
+            if metrics.regex_found:
+                self.regex_found += 1
+        response_time = metrics.response_time
+        if response_time < self.response_time_min:
+            self.response_time_min = response_time
+        if response_time > self.response_time_max:
+            self.response_time_max = response_time
+        self.response_time_sum += response_time
+        self.response_time_sketch.add(response_time)
+
+    def dict(self) -> Dict[str, Any]:
+        data = {field: getattr(self, field) for field in self.FIELDS}
+        data["response_time_sketch"] = self.response_time_sketch.to_dict()
+        return data
+
+    def json(self) -> str:
+        return json.dumps(self.dict())
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}(url={self.url!r}, window_start={self.window_start!r}, "
+            f"count={self.count!r}, failures={self.failures!r})"
+        )
+
+
+class StreamingRegexMatcher:
+    """
+    Runs regular expression over response body, which is fed chunk by chunk.
+    Last `overlap` characters of already examined body are kept
+    and prepended to the next chunk, so matches across chunk boundaries
+    are found as long as they are not longer than `overlap`.
+    Invalid UTF-8 sequences are replaced instead of failing the check.
+    """
+
+    def __init__(self, pattern: Union[str, Pattern[str]], overlap: int):
+        self.found = False
+        self.pattern = re.compile(pattern)
+        self._overlap = overlap
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._tail = ""
+
+    def feed(self, chunk: bytes, final: bool = False) -> bool:
+        """
+        Examine next chunk of the body
+        :param chunk: next chunk of the body
+        :param final: indicates that this is the last chunk
+        :return: True if pattern was found
+        """
+        if self.found:
+            return True
+        window = self.window(chunk, final)
+        return self.update(window, self.pattern.search(window) is not None)
+
+    def window(self, chunk: bytes, final: bool = False) -> str:
+        """
+        Decodes next chunk of the body and prepends kept characters to it,
+        so the pattern could be searched elsewhere
+        :param chunk: next chunk of the body
+        :param final: indicates that this is the last chunk
+        :return: text to search pattern in
+        """
+        return self._tail + self._decoder.decode(chunk, final=final)
+
+    def update(self, window: str, found: bool) -> bool:
+        """
+        Records result of the search in the window returned by `window`
+        :param window: searched text
+        :param found: True if pattern was found in it
+        :return: True if pattern was found
+        """
+        if found:
+            self.found = True
+        else:
+            self._tail = window[-self._overlap :] if self._overlap > 0 else ""
+        return self.found
+
+
+def collect_metrics(result: "HealthcheckJobResult") -> MetricsCollection:
     """
     Function which interprets results of health check and produce metrics
     """
-    metrics = MetricsCollection(
+    return MetricsCollection(
         url=result.url,
-        response_time=(
-            result.response_received_at - result.request_start_at
-        ).total_seconds(),
+        response_time=result.response_time,
         status_code=result.response_status,
+        regex_found=result.regex_found,
+        dns_time=result.dns_time,
+        connect_time=result.connect_time,
+        ttfb=result.ttfb,
+        download_time=result.download_time,
+        check_mode=result.check_mode,
+        bytes_transferred=result.bytes_transferred,
     )
-    if regex_pattern:
-        pattern = re.compile(regex_pattern)
-        metrics.regex_found = (
-            pattern.search(result.response_content.decode()) is not None
-        )
-    return metrics
@@ -1,15 +1,27 @@
 import asyncio
+import functools
 import logging
+import os
+import re
 import typing as t
 
 import yaml
-from aiocron import Cron
-from pydantic import BaseModel, HttpUrl
+from pydantic import BaseModel, HttpUrl, PrivateAttr, validator
 
+from .adaptive import AdaptiveInterval
+from .aggregation import Aggregator
+from .client import HttpClientPool
 from .config import Settings
-from .job import healthcheck_job
+from .instrumentation import InstrumentationServer
+from .job import CheckMode, ValidatorsCache, healthcheck_job
+from .limits import ConcurrencyLimiter
 from .loaders.base import AbstractLoader
-from .metrics import MetricsCollection
+from .loaders.queue import LoaderQueue
+from .matching import RegexPool
+from .metrics import MetricsCollection, Rollup
+from .scheduler import ScheduledJob, Scheduler
+from .sharding import AbstractMembership, HashRing, shard_index
+from .stats import LoopMonitor
 
 logger = logging.getLogger(__name__)
 
@@ -23,48 +35,219 @@ class JobParams(BaseModel):
     url: HttpUrl
     schedule: str
     body_regex: t.Optional[str]
+    spread: bool = True
+    """Spread this job within its schedule interval to avoid simultaneous runs"""
+    mode: CheckMode = "get"
+    """
+    How to check the url: get - regular GET request, head - HEAD request without body,
+    range - GET only the part of the body examined by body_regex,
+    conditional - GET with ETag/Last-Modified of the previous response,
+    so unchanged body isn't sent again and the previous regex result is reused
+    """
+    min_interval: t.Optional[float] = None
+    max_interval: t.Optional[float] = None
+    """
+    Check the url adaptively, with interval between checks (in seconds) within these
+    bounds: slower while it's stable, faster right away on errors, status changes
+    or latency regressions. Schedule sets the first check and the initial interval
+    """
+
+    _body_pattern: t.Optional[t.Pattern[str]] = PrivateAttr(None)
+
+    def __init__(self, **data: t.Any):
+        super().__init__(**data)
+        if self.body_regex:
+            self._body_pattern = re.compile(self.body_regex)
+
+    @property
+    def body_pattern(self) -> t.Optional[t.Pattern[str]]:
+        """
+        Compiled body_regex, compiled once when the schedule is parsed
+        """
+        return self._body_pattern
+
+    @validator("body_regex")
+    def check_body_regex(cls, body_regex: t.Optional[str]) -> t.Optional[str]:
+        if body_regex:
+            try:
+                re.compile(body_regex)
+            except re.error as e:
+                raise ValueError(f"Invalid body_regex: {e}")
+        return body_regex
+
+    @validator("max_interval", always=True)
+    def check_intervals(
+        cls, max_interval: t.Optional[float], values: t.Dict[str, t.Any]
+    ) -> t.Optional[float]:
+        min_interval = values.get("min_interval")
+        if (min_interval is None) != (max_interval is None):
+            raise ValueError("min_interval and max_interval should be set together")
+        if min_interval is not None and not 0 < min_interval <= max_interval:
+            raise ValueError(
+                "min_interval should be positive and not above max_interval"
+            )
+        return max_interval
+
+    @property
+    def adaptive(self) -> bool:
+        """
+        Interval between checks is adapted to the health of the url
+        """
+        return self.min_interval is not None
+
+    @validator("mode")
+    def check_mode_reads_body(cls, mode: str, values: t.Dict[str, t.Any]) -> str:
+        if mode == "head" and values.get("body_regex"):
+            raise ValueError("body_regex can't be checked in head mode")
+        return mode
 
 
 class HealthMonitor:
     """
     This is a main class for WH Monitor application.
     It collect results from periodic checks
-    and pass this results to loaders
+    and pass this results to loaders.
+
+    If membership is passed, only entries of the schedule owned by this node
+    are checked. Entries are distributed between nodes by consistent hashing of urls,
+    and ownership is updated on membership changes.
+    If shard is passed as (index, count), entries of this node are sharded further
+    between worker processes, and only entries of this shard are checked.
     """
 
     def __init__(
         self,
         settings: Settings,
         loaders: t.List[AbstractLoader],
+        shard: t.Optional[t.Tuple[int, int]] = None,
+        membership: t.Optional[AbstractMembership] = None,
     ):
         self.settings = settings
+        self.shard = shard
+        self.membership = membership
         self.loaders = loaders
-        self.jobs = self._parse_schedule()
+        self.queues: t.List[LoaderQueue] = []
+        self.http_client = HttpClientPool(settings)
+        self.limiter: t.Optional[ConcurrencyLimiter] = None
+        if settings.max_concurrent_checks or settings.max_concurrent_checks_per_host:
+            self.limiter = ConcurrencyLimiter(
+                settings.max_concurrent_checks,
+                settings.max_concurrent_checks_per_host,
+            )
+        self.validators = ValidatorsCache()
+        self.regex_pool: t.Optional[RegexPool] = None
+        if settings.body_regex_offload_bytes:
+            self.regex_pool = RegexPool(
+                settings.body_regex_workers, settings.body_regex_timeout
+            )
+        self.aggregator: t.Optional[Aggregator] = None
+        if settings.aggregation_window > 0:
+            self.aggregator = Aggregator(
+                settings.aggregation_window,
+                self._publish_rollup,
+                relative_accuracy=settings.aggregation_relative_accuracy,
+            )
+        self.scheduler = Scheduler(
+            batch_size=settings.scheduler_batch_size,
+            max_spread=settings.schedule_spread,
+        )
+        self.loop_monitor = LoopMonitor(settings.loop_monitor_interval)
+        self.instrumentation: t.Optional[InstrumentationServer] = None
+        if settings.instrumentation_port:
+            port = settings.instrumentation_port + (shard[0] if shard else 0)
+            self.instrumentation = InstrumentationServer(
+                self, settings.instrumentation_host, port
+            )
+        self._parsed: t.Dict[tuple, JobParams] = {}
+        self.entries = self._parse_schedule()
+        self._schedule_mtime = self._get_schedule_mtime()
+        self._reload_lock = asyncio.Lock()
+        self._watcher: t.Optional[asyncio.Task] = None
+        self._scheduled: t.Dict[t.Tuple[str, str], ScheduledJob] = {}
+        self._adaptive: t.Dict[t.Tuple[str, str], AdaptiveInterval] = {}
+        self._ring: t.Optional[HashRing] = None
+        if membership is not None:
+            self._ring = HashRing(membership.members())
+        self._apply_ownership()
+
+    @property
+    def jobs(self) -> t.List[JobParams]:
+        """
+        Entries of the schedule checked by this monitor
+        """
+        return [job.args[0] for job in self._scheduled.values()]
 
     async def start(self):
         """
-        Starts all scheduled jobs
+        Starts loader queues and all scheduled jobs
         """
-        for j in self.jobs:
-            j.start()
+        self.queues = [
+            LoaderQueue(
+                loader,
+                size=self.settings.loader_queue_size,
+                workers=self.settings.loader_workers,
+                batch_size=self.settings.loader_batch_size,
+                overflow=self.settings.loader_queue_overflow,
+            )
+            for loader in self.loaders
+        ]
+        for queue in self.queues:
+            queue.start()
+        if self.aggregator is not None:
+            self.aggregator.start()
+        self.loop_monitor.start()
+        if self.instrumentation is not None:
+            await self.instrumentation.start()
+        if self.membership is not None:
+            await self.membership.start(self.on_membership_change)
+        self.scheduler.start()
+        if self.settings.schedule_reload_interval > 0:
+            self._watcher = asyncio.get_event_loop().create_task(self._watch_schedule())
         logger.info("Jobs are scheduled")
 
     async def shutdown(self):
         """
-        Stops all cron jobs and loaders and do any other required tasks for shutdown
+        Stops all scheduled jobs and loaders and do any other required tasks for shutdown
         """
-        for job in self.jobs:
-            job.stop()
+        if self._watcher is not None:
+            self._watcher.cancel()
+        if self.membership is not None:
+            await self.membership.stop()
+        await self.scheduler.stop()
+        logger.info(
+            f"Scheduler stopped (fired: {self.scheduler.fired}, "
+            f"skipped: {self.scheduler.skipped}, "
+            f"max drift: {self.scheduler.max_drift:.3f}s)"
+        )
+        if self.aggregator is not None:
+            await self.aggregator.stop()
+        await asyncio.gather(*[queue.stop() for queue in self.queues])
+        for queue in self.queues:
+            logger.info(
+                f"{queue.loader!r} queue stopped (loaded: {queue.loaded}, "
+                f"dropped: {queue.dropped}, failed: {queue.failed}, "
+                f"max latency: {queue.max_latency:.3f}s)"
+            )
         coros = [asyncio.wait_for(loader.shutdown(), 10) for loader in self.loaders]
         await asyncio.gather(*coros)
+        await self.http_client.close()
+        if self.regex_pool is not None:
+            await self.regex_pool.close()
+        if self.instrumentation is not None:
+            await self.instrumentation.stop()
+        self.loop_monitor.stop()
         logger.info("Shutdown completed")
 
     async def publish(self, metrics: MetricsCollection):
         """
-        Method used by health check jobs to publish their results
+        Method used by health check jobs to publish their results.
+        Metrics are put into queue of each loader and loaded in background.
+        If aggregation is enabled, only metrics of failed checks are put as is
         """
-        loads = [loader.load(metrics) for loader in self.loaders]
-        await asyncio.gather(*loads)
+        if self.aggregator is not None and not self.aggregator.add(metrics):
+            return
+        for queue in self.queues:
+            await queue.put(metrics)
 
     async def on_error_callback(self, job_params: JobParams, exc: Exception):
         """
@@ -72,27 +255,223 @@ class HealthMonitor:
         """
         logger.error(f"Exception during job {job_params.url}", exc_info=exc)
 
-    def _parse_schedule(self) -> t.List[Cron]:
+    async def reload_schedule(self):
+        """
+        Reloads schedule and applies only the difference with the current one:
+        starts added entries, stops removed ones and updates changed ones in place.
+        Current schedule is kept if new one couldn't be parsed.
+        """
+        async with self._reload_lock:
+            loop = asyncio.get_event_loop()
+            try:
+                self._schedule_mtime = self._get_schedule_mtime()
+                entries, self._parsed = await loop.run_in_executor(
+                    None, self._read_schedule, self._parsed
+                )
+            except Exception as e:
+                logger.error("Failed to reload schedule, keep current one", exc_info=e)
+                return
+            self.entries = entries
+            self._apply_ownership()
+
+    async def on_membership_change(self):
+        """
+        Rebuilds hash ring on cluster membership change and takes over
+        or gives away entries of the schedule accordingly
+        """
+        assert self.membership is not None, "Membership is not configured"
+        members = self.membership.members()
+        logger.info(f"Cluster membership changed, members: {members}")
+        self._ring = HashRing(members)
+        self._apply_ownership()
+
+    async def _publish_rollup(self, rollup: Rollup):
+        """
+        Puts rollup into queue of each loader.
+        Rollup replaces many metrics, so it's never dropped on queue overflow
+        """
+        for queue in self.queues:
+            await queue.put(rollup, wait=True)
+
+    async def _publish_adaptive(
+        self, key: t.Tuple[str, str], metrics: MetricsCollection
+    ):
+        """
+        Adapts interval of the entry to the result of its check and publishes it
+        """
+        adaptive = self._adaptive.get(key)
+        if adaptive is not None and adaptive.observe(metrics):
+            self._reschedule(key, adaptive)
+        await self.publish(metrics)
+
+    async def _on_adaptive_error(
+        self, key: t.Tuple[str, str], job_params: JobParams, exc: Exception
+    ):
+        """
+        Speeds up checks of the entry which failed without response
+        """
+        adaptive = self._adaptive.get(key)
+        if adaptive is not None and adaptive.observe_error():
+            self._reschedule(key, adaptive)
+        await self.on_error_callback(job_params, exc)
+
+    def _reschedule(self, key: t.Tuple[str, str], adaptive: AdaptiveInterval):
+        job = self._scheduled.get(key)
+        if job is not None:
+            logger.debug(f"Check {key[0]} every {adaptive.interval}s")
+            self.scheduler.reschedule(job, adaptive.interval)
+
+    def _owns(self, job_params: JobParams) -> bool:
+        """
+        Checks if entry of the schedule belongs to this node and process
+        """
+        if self._ring is not None:
+            assert self.membership is not None, "Membership is not configured"
+            if self._ring.owner(job_params.url) != self.membership.node_id:
+                return False
+        if self.shard is not None:
+            index, count = self.shard
+            if shard_index(job_params.url, count) != index:
+                return False
+        return True
+
+    def _apply_ownership(self):
         """
-        Parse yaml schedule and create periodic jobs for each entry
-        :return: list of prepared Cron jobs for each entry in the schedule
+        Schedules owned entries which aren't scheduled yet,
+        removes scheduled entries which aren't owned anymore
+        and updates parameters of scheduled entries which were changed.
+        Entries are identified by url and schedule
         """
+        owned = {
+            (job_params.url, job_params.schedule): job_params
+            for job_params in self.entries
+            if self._owns(job_params)
+        }
+        removed = [key for key in self._scheduled if key not in owned]
+        for key in removed:
+            job = self._scheduled.pop(key)
+            self.scheduler.remove(job)
+            self.validators.discard(job.args[0])
+            self._adaptive.pop(key, None)
+        added = [key for key in owned if key not in self._scheduled]
+        for key in added:
+            self._scheduled[key] = self._schedule_job(key, owned[key])
+        changed = 0
+        for key, job in self._scheduled.items():
+            job_params = owned[key]
+            if job.args[0] is job_params or job.args[0] == job_params:
+                continue
+            changed += 1
+            previous = job.args[0]
+            if (previous.spread, previous.min_interval, previous.max_interval) != (
+                job_params.spread,
+                job_params.min_interval,
+                job_params.max_interval,
+            ):
+                # Offset within the interval and callbacks depend on them, so reschedule
+                self.scheduler.remove(job)
+                self._adaptive.pop(key, None)
+                self._scheduled[key] = self._schedule_job(key, job_params)
+            else:
+                job.args = (job_params, *job.args[1:])
+        logger.info(
+            f"{len(self._scheduled)} of {len(self.entries)} jobs are owned "
+            f"({len(added)} added, {len(removed)} removed, {changed} changed)"
+        )
+
+    def _schedule_job(
+        self, key: t.Tuple[str, str], job_params: JobParams
+    ) -> ScheduledJob:
+        on_result = self.publish
+        on_error = self.on_error_callback
+        interval = None
+        if job_params.adaptive:
+            assert job_params.min_interval is not None, "Configuration error"
+            assert job_params.max_interval is not None, "Configuration error"
+            schedule = self.scheduler.schedule(job_params.schedule)
+            adaptive = self._adaptive[key] = AdaptiveInterval(
+                job_params.min_interval,
+                job_params.max_interval,
+                schedule.interval,
+                stable_checks=self.settings.adaptive_stable_checks,
+                backoff=self.settings.adaptive_backoff,
+                latency_factor=self.settings.adaptive_latency_factor,
+            )
+            on_result = functools.partial(self._publish_adaptive, key)
+            on_error = functools.partial(self._on_adaptive_error, key)
+            interval = adaptive.interval
+        return self.scheduler.add(
+            job_params.schedule,
+            healthcheck_job,
+            job_params,
+            on_result,
+            on_error,
+            None,
+            self.settings,
+            self.http_client,
+            self.limiter,
+            self.validators,
+            self.regex_pool,
+            spread_key=job_params.url if job_params.spread else None,
+            interval=interval,
+        )
+
+    async def _watch_schedule(self):
+        """
+        Periodically checks modification time of the schedule file
+        and reloads it on change
+        """
+        while True:
+            await asyncio.sleep(self.settings.schedule_reload_interval)
+            mtime = self._get_schedule_mtime()
+            if mtime is not None and mtime != self._schedule_mtime:
+                logger.info("Schedule file changed, reload it")
+                await self.reload_schedule()
+
+    def _get_schedule_mtime(self) -> t.Optional[int]:
+        try:
+            return os.stat(self.settings.schedule_path).st_mtime_ns
+        except OSError as e:
+            logger.error("Failed to check schedule file", exc_info=e)
+            return None
+
+    def _parse_schedule(self) -> t.List[JobParams]:
+        """
+        Parse yaml schedule. Entries which weren't changed since previous parsing
+        are reused without validation
+        :return: list of job parameters for each entry in the schedule
+        """
+        jobs, self._parsed = self._read_schedule(self._parsed)
+        return jobs
+
+    def _read_schedule(
+        self, previous: t.Dict[tuple, JobParams]
+    ) -> t.Tuple[t.List[JobParams], t.Dict[tuple, JobParams]]:
+        """
+        Reads and validates yaml schedule without changing the state of the monitor,
+        so it could be run in a thread
+        :param previous: parsed entries of the previous schedule by their raw values
+        :return: list of job parameters for each entry in the schedule
+                 and parsed entries of this schedule by their raw values
+        """
+        with open(self.settings.schedule_path) as f:
+            schedule = yaml.safe_load(f.read()) or []
+        parsed = {}
         jobs = []
-        with open("schedule.yaml") as f:
-            schedule = yaml.safe_load(f.read())
-            logger.info(f"Total {len(schedule)} jobs parsed")
-            for entry in schedule:
+        keys = set()
+        for entry in schedule:
+            raw_key = tuple(sorted(entry.items()))
+            job_params = previous.get(raw_key)
+            if job_params is None:
                 job_params = JobParams(**entry)
-                cron = Cron(
-                    job_params.schedule,
-                    func=healthcheck_job,
-                    args=(
-                        job_params,
-                        self.publish,
-                        self.on_error_callback,
-                        asyncio.Lock(),
-                        self.settings,
-                    ),
+            key = (job_params.url, job_params.schedule)
+            if key in keys:
+                raise ValueError(
+                    f"Duplicate entry for {job_params.url} with schedule "
+                    f"'{job_params.schedule}', entries are identified by both of them"
                 )
-                jobs.append(cron)
-        return jobs
+            keys.add(key)
+            parsed[raw_key] = job_params
+            jobs.append(job_params)
+        logger.info(f"Total {len(jobs)} jobs parsed")
+        return jobs, parsed
@@ -0,0 +1,339 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import time
+import typing as t
+import zlib
+from collections import deque
+
+from croniter import croniter
+
+from .stats import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class CronSchedule:
+    """
+    Parsed cron expression. The format is the same as in regular cron,
+    except optional sixth field for seconds (like `* * * * * */30`).
+    One instance is shared by all jobs with the same expression.
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self._tz = datetime.datetime.now().astimezone().tzinfo
+        self._iter = croniter(expression, self._to_datetime(time.time()))
+        self._last_from: t.Optional[float] = None
+        self._last_next = 0.0
+        first_run = self.next_after(time.time())
+        self.interval = self.next_after(first_run) - first_run
+        """Period between two consecutive fire times"""
+
+    def next_after(self, timestamp: float) -> float:
+        """
+        Calculates next fire time after given timestamp.
+        Jobs with the same schedule are rescheduled from the same timestamp,
+        so the last result is cached and calculated only once per batch.
+        :param timestamp: unix timestamp to calculate next fire time from
+        :return: unix timestamp of the next fire time
+        """
+        if timestamp != self._last_from:
+            self._iter.set_current(self._to_datetime(timestamp))
+            self._last_next = self._iter.get_next(float)
+            self._last_from = timestamp
+        return self._last_next
+
+    def _to_datetime(self, timestamp: float) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(timestamp, self._tz)
+
+
+class ScheduledJob:
+    """
+    Single entry of the scheduler
+    """
+
+    __slots__ = (
+        "schedule",
+        "func",
+        "args",
+        "offset",
+        "base_run",
+        "next_run",
+        "last_run",
+        "interval",
+        "running",
+        "active",
+    )
+
+    def __init__(
+        self,
+        schedule: CronSchedule,
+        func: t.Callable[..., t.Awaitable[None]],
+        args: t.Tuple[t.Any, ...],
+        offset: float,
+    ):
+        self.schedule = schedule
+        self.func = func
+        self.args = args
+        self.offset = offset
+        """Constant shift of this job's fire times against its schedule"""
+
+        self.base_run = 0.0
+        """Next fire time according to the schedule, without offset"""
+
+        self.next_run = 0.0
+
+        self.last_run = 0.0
+        """Scheduled time of the last run, 0 if job wasn't run yet"""
+
+        self.interval: t.Optional[float] = None
+        """
+        Fixed period of the job after its first run, which overrides the schedule.
+        Could be changed on the fly with Scheduler.reschedule
+        """
+
+        self.running = False
+        self.active = True
+
+
+class Scheduler:
+    """
+    Runs periodic jobs with cron-like schedules.
+    All jobs are kept in a single min-heap ordered by their next fire time,
+    and only one event loop timer is armed for the earliest of them.
+    Due jobs are fired in batches. Job is skipped if its previous run
+    is still in progress.
+
+    Jobs which share the same schedule could be spread over its interval
+    (up to max_spread seconds) by a stable offset derived from the spread key,
+    so they don't all fire at the same instant. The period of each job stays the same.
+
+    Job could be run with a fixed interval instead of its schedule,
+    which is changed on the fly with `reschedule`.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 1000,
+        max_spread: float = 0,
+        drift_samples: int = 10000,
+    ):
+        self.batch_size = batch_size
+        """Maximum number of jobs fired in one event loop iteration"""
+
+        self.max_spread = max_spread
+        """Maximum offset of spread jobs (in seconds). 0 disables spreading"""
+
+        self.fired = 0
+        """Total number of fired jobs"""
+
+        self.skipped = 0
+        """Number of runs skipped because previous run of the job was still in progress"""
+
+        self.max_drift = 0.0
+        """Maximum observed delay between scheduled and actual fire time (in seconds)"""
+
+        self.drifts: t.Deque[float] = deque(maxlen=drift_samples)
+        """Recently observed delays between scheduled and actual fire time"""
+
+        self.lag = Histogram()
+        """Distribution of delays between scheduled and actual fire time"""
+
+        self._heap: t.List[t.Tuple[float, int, ScheduledJob]] = []
+        self._schedules: t.Dict[str, CronSchedule] = {}
+        self._sequence = itertools.count()
+        self._tasks: t.Set[asyncio.Task] = set()
+        self._timer: t.Optional[asyncio.Handle] = None
+        self._timer_at = 0.0
+        self._jobs_count = 0
+        self.running = False
+
+    def __len__(self) -> int:
+        return self._jobs_count
+
+    @property
+    def in_flight(self) -> int:
+        """Number of job runs in progress"""
+        return len(self._tasks)
+
+    def add(
+        self,
+        expression: str,
+        func: t.Callable[..., t.Awaitable[None]],
+        *args,
+        spread_key: t.Optional[str] = None,
+        interval: t.Optional[float] = None,
+    ) -> ScheduledJob:
+        """
+        Schedules new periodic job
+        :param expression: cron-like schedule
+        :param func: coroutine function to run
+        :param args: arguments for the func
+        :param spread_key: key to derive stable offset of the job within its interval.
+                           Job isn't spread if key is omitted
+        :param interval: fixed period of the job (in seconds). If passed, schedule
+                         only sets the first run of the job
+        :return: scheduled job, which could be used to remove it later
+        """
+        schedule = self.schedule(expression)
+        offset = 0.0
+        if spread_key is not None and self.max_spread > 0:
+            window = min(schedule.interval, self.max_spread)
+            offset = zlib.crc32(spread_key.encode()) / 2**32 * window
+        job = ScheduledJob(schedule, func, args, offset)
+        job.interval = interval
+        self._push(job, schedule.next_after(time.time()))
+        self._jobs_count += 1
+        return job
+
+    def schedule(self, expression: str) -> CronSchedule:
+        """
+        Parses cron-like schedule, or returns already parsed one
+        :param expression: cron-like schedule
+        :return: parsed schedule shared by all jobs with this expression
+        """
+        schedule = self._schedules.get(expression)
+        if schedule is None:
+            schedule = self._schedules[expression] = CronSchedule(expression)
+        return schedule
+
+    def remove(self, job: ScheduledJob):
+        """
+        Removes job from the scheduler. Run in progress is not interrupted.
+        :param job: job to remove
+        """
+        if job.active:
+            job.active = False
+            self._jobs_count -= 1
+
+    def reschedule(self, job: ScheduledJob, interval: float):
+        """
+        Changes period of the job on the fly. Next run is moved to the interval
+        after the last run, or to now if that time has already passed
+        :param job: job to reschedule
+        :param interval: new period of the job (in seconds)
+        """
+        job.interval = interval
+        if not job.active or not job.last_run:
+            return
+        next_run = max(job.last_run + interval, time.time())
+        if next_run == job.next_run:
+            return
+        # Previous heap entry becomes stale and is skipped when popped
+        job.next_run = next_run
+        job.base_run = next_run - job.offset
+        heapq.heappush(self._heap, (next_run, next(self._sequence), job))
+        self._arm()
+
+    def start(self):
+        """
+        Starts firing scheduled jobs
+        """
+        self.running = True
+        self._arm()
+
+    async def stop(self, timeout: float = 10):
+        """
+        Stops firing jobs and waits for runs in progress
+        :param timeout: how long to wait for runs in progress before cancel them
+        """
+        self.running = False
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+
+    def _push(self, job: ScheduledJob, base_run: float):
+        job.base_run = base_run
+        job.next_run = base_run + job.offset
+        heapq.heappush(self._heap, (job.next_run, next(self._sequence), job))
+        self._arm()
+
+    def _arm(self):
+        """
+        Arms the event loop timer for the earliest job in the heap
+        """
+        if not self.running or not self._heap:
+            return
+        run_at = self._heap[0][0]
+        if self._timer is not None:
+            if self._timer_at <= run_at:
+                return
+            self._timer.cancel()
+        loop = asyncio.get_event_loop()
+        self._timer_at = run_at
+        self._timer = loop.call_at(
+            loop.time() + max(run_at - time.time(), 0), self._fire
+        )
+
+    def _fire(self):
+        """
+        Fires batch of due jobs and reschedules them
+        """
+        self._timer = None
+        now = time.time()
+        fired = 0
+        batch_drift = 0.0
+        while self._heap and self._heap[0][0] <= now and fired < self.batch_size:
+            run_at, _, job = heapq.heappop(self._heap)
+            if not job.active or run_at != job.next_run:
+                continue
+            fired += 1
+            batch_drift = max(batch_drift, now - run_at)
+            self._record_drift(now - run_at)
+            job.last_run = run_at
+            self._run(job)
+            if job.interval is not None:
+                next_run = run_at + job.interval
+                if next_run <= now:
+                    next_run = now + job.interval
+                job.base_run = next_run - job.offset
+                job.next_run = next_run
+            else:
+                base_run = job.schedule.next_after(job.base_run)
+                if base_run + job.offset <= now:
+                    # We are behind the whole period, don't try to catch up
+                    base_run = job.schedule.next_after(now - job.offset)
+                job.base_run = base_run
+                job.next_run = base_run + job.offset
+            heapq.heappush(self._heap, (job.next_run, next(self._sequence), job))
+        if fired:
+            logger.debug(f"Fired {fired} jobs, drift {batch_drift:.3f}s")
+        if self._heap and self._heap[0][0] <= now:
+            self._timer_at = now
+            self._timer = asyncio.get_event_loop().call_soon(self._fire)
+        else:
+            self._arm()
+
+    def _run(self, job: ScheduledJob):
+        if job.running:
+            self.skipped += 1
+            logger.debug(f"Previous run of {job.args[:1]} is in progress. Skipping.")
+            return
+        self.fired += 1
+        job.running = True
+        task = asyncio.get_event_loop().create_task(job.func(*job.args))
+        self._tasks.add(task)
+        task.add_done_callback(lambda task: self._on_done(job, task))
+
+    def _on_done(self, job: ScheduledJob, task: asyncio.Task):
+        job.running = False
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(
+                "Unhandled exception in scheduled job", exc_info=task.exception()
+            )
+
+    def _record_drift(self, drift: float):
+        self.drifts.append(drift)
+        self.lag.observe(drift)
+        if drift > self.max_drift:
+            self.max_drift = drift
+            if drift > 1:
+                logger.warning(f"Scheduler is behind the schedule for {drift:.3f}s")
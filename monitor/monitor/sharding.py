@@ -0,0 +1,95 @@
+import bisect
+import hashlib
+import typing as t
+import zlib
+from abc import ABC, abstractmethod
+
+
+def shard_index(key: str, count: int) -> int:
+    """
+    Stable shard number of the key, which is the same in every process
+    (unlike built-in hash, which is randomized per process)
+    :param key: key to shard, e.g. job url
+    :param count: total number of shards
+    :return: shard number in range [0, count)
+    """
+    return zlib.crc32(key.encode()) % count
+
+
+class HashRing:
+    """
+    Consistent hash ring. Each node is placed on the ring several times (replicas),
+    and key belongs to the first node clockwise from the key's position.
+    Adding or removing a node moves only about 1/N of the keys.
+    """
+
+    def __init__(self, nodes: t.Iterable[str], replicas: int = 100):
+        points = sorted(
+            (self._hash(f"{node}#{replica}"), node)
+            for node in set(nodes)
+            for replica in range(replicas)
+        )
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, key: str) -> t.Optional[str]:
+        """
+        :param key: key to find owner for, e.g. job url
+        :return: node which owns the key or None if the ring is empty
+        """
+        if not self._points:
+            return None
+        position = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._nodes[position]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class AbstractMembership(ABC):
+    """
+    Interface for sources of cluster membership.
+    Provides identity of the current node and list of all nodes in the cluster.
+    """
+
+    node_id: str
+
+    @abstractmethod
+    def members(self) -> t.List[str]:
+        """
+        :return: identities of all alive nodes, including the current one
+        """
+        pass
+
+    async def start(self, on_change: t.Callable[[], t.Awaitable[None]]):
+        """
+        Starts watching for membership changes
+        :param on_change: callback to call when list of members changed
+        """
+        pass
+
+    async def stop(self):
+        """
+        Stops watching for membership changes
+        """
+        pass
+
+
+class StaticMembership(AbstractMembership):
+    """
+    Fixed cluster of node_count nodes, where current node has node_index
+    """
+
+    def __init__(self, node_index: int, node_count: int):
+        if not 0 <= node_index < node_count:
+            raise ValueError(f"Node index {node_index} out of range [0, {node_count})")
+        self.node_id = self.node_name(node_index)
+        self._members = [self.node_name(index) for index in range(node_count)]
+
+    def members(self) -> t.List[str]:
+        return self._members
+
+    @staticmethod
+    def node_name(index: int) -> str:
+        return f"node-{index}"
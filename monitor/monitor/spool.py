@@ -0,0 +1,223 @@
+import logging
+import os
+import struct
+import typing as t
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+_LENGTH = struct.Struct("<I")
+_SUFFIX = ".spool"
+
+
+class _Segment:
+    __slots__ = ("path", "sequence", "size", "records")
+
+    def __init__(self, path: str, sequence: int, size: int = 0, records: int = 0):
+        self.path = path
+        self.sequence = sequence
+        self.size = size
+        self.records = records
+
+
+class DiskSpool:
+    """
+    Durable FIFO queue of binary records on local disk.
+    Records are appended sequentially to segment files with length prefix,
+    and segments are deleted when all their records are consumed.
+    Total size of segments is bounded by max_bytes: when it's exceeded,
+    the oldest segments are dropped.
+
+    Consumption is tracked per segment, so after restart records of partially
+    consumed segment are read again (at-least-once delivery).
+    Segment is synced to disk when it's closed, i.e. on rotation and on close.
+    Records of the active segment are only flushed to the OS: they survive a crash
+    of the process, but crash of the host may lose records appended since
+    the last rotation.
+    Spool isn't thread-safe, all calls should be made from the same thread.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 16 * 1024 * 1024,
+        max_bytes: int = 1024 * 1024 * 1024,
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+
+        self.depth = 0
+        """Number of records waiting to be consumed"""
+
+        self.size = 0
+        """Total size of segment files (in bytes)"""
+
+        self.dropped = 0
+        """Number of records dropped because spool exceeded max_bytes"""
+
+        os.makedirs(directory, exist_ok=True)
+        self._segments: t.Deque[_Segment] = deque(self._load_segments())
+        self._writer: t.Optional[t.BinaryIO] = None
+        self._read_offset = 0
+        self._peek_offset = 0
+        self._peek_records = 0
+        if self.depth:
+            logger.info(f"Found {self.depth} records in spool {directory}")
+
+    def append(self, records: t.Iterable[bytes]):
+        """
+        Appends records to the end of the spool
+        """
+        for record in records:
+            segment = self._active_segment()
+            assert self._writer is not None, "Segment is not opened"
+            self._writer.write(_LENGTH.pack(len(record)))
+            self._writer.write(record)
+            written = _LENGTH.size + len(record)
+            segment.size += written
+            segment.records += 1
+            self.size += written
+            self.depth += 1
+            if segment.size >= self.segment_bytes:
+                self._close_writer()
+        if self._writer is not None:
+            self._writer.flush()
+        self._enforce_max_bytes()
+
+    def read(self, max_records: int) -> t.List[bytes]:
+        """
+        Reads records from the head of the spool without consuming them.
+        Records are read from one segment at a time.
+        Call commit to consume them.
+        :param max_records: maximum number of records to read
+        :return: list of records, empty if spool is empty
+        """
+        self._peek_records = 0
+        if not self.depth:
+            return []
+        segment = self._segments[0]
+        records = []
+        with open(segment.path, "rb") as f:
+            f.seek(self._read_offset)
+            offset = self._read_offset
+            while len(records) < max_records and offset < segment.size:
+                (length,) = _LENGTH.unpack(f.read(_LENGTH.size))
+                records.append(f.read(length))
+                offset += _LENGTH.size + length
+        self._peek_offset = offset
+        self._peek_records = len(records)
+        return records
+
+    def commit(self):
+        """
+        Consumes records returned by the last read
+        """
+        if not self._peek_records:
+            return
+        segment = self._segments[0]
+        self._read_offset = self._peek_offset
+        self.depth -= self._peek_records
+        self._peek_records = 0
+        if self._read_offset >= segment.size and (
+            self._writer is None or len(self._segments) > 1
+        ):
+            self._delete_head()
+
+    def close(self):
+        """
+        Syncs and closes currently written segment
+        """
+        self._close_writer()
+
+    def _active_segment(self) -> _Segment:
+        if self._writer is None:
+            sequence = self._segments[-1].sequence + 1 if self._segments else 0
+            segment = _Segment(
+                os.path.join(self.directory, f"{sequence:020d}{_SUFFIX}"), sequence
+            )
+            self._segments.append(segment)
+            self._writer = open(segment.path, "ab")
+        return self._segments[-1]
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            self._writer.close()
+            self._writer = None
+            self._sync_directory()
+            head = self._segments[0]
+            if len(self._segments) == 1 and self._read_offset >= head.size:
+                self._delete_head()
+
+    def _sync_directory(self):
+        """
+        Syncs directory, so entries of new segments are kept after crash of the host
+        """
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _delete_head(self):
+        segment = self._segments.popleft()
+        os.remove(segment.path)
+        self.size -= segment.size
+        self._read_offset = 0
+        self._peek_records = 0
+
+    def _enforce_max_bytes(self):
+        while self.size > self.max_bytes and len(self._segments) > 1:
+            segment = self._segments[0]
+            consumed = self._consumed_records(segment)
+            dropped = segment.records - consumed
+            self.depth -= dropped
+            self.dropped += dropped
+            logger.warning(f"Spool is full, drop {dropped} oldest records")
+            self._delete_head()
+
+    def _consumed_records(self, segment: _Segment) -> int:
+        if not self._read_offset:
+            return 0
+        consumed = 0
+        with open(segment.path, "rb") as f:
+            offset = 0
+            while offset < self._read_offset:
+                (length,) = _LENGTH.unpack(f.read(_LENGTH.size))
+                f.seek(length, os.SEEK_CUR)
+                offset += _LENGTH.size + length
+                consumed += 1
+        return consumed
+
+    def _load_segments(self) -> t.List[_Segment]:
+        """
+        Loads segments left from the previous run.
+        Incomplete record at the end of segment (e.g. after crash) is truncated
+        """
+        segments = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            segment = _Segment(path, int(name[: -len(_SUFFIX)]))
+            file_size = os.path.getsize(path)
+            with open(path, "rb") as f:
+                while segment.size + _LENGTH.size <= file_size:
+                    (length,) = _LENGTH.unpack(f.read(_LENGTH.size))
+                    if segment.size + _LENGTH.size + length > file_size:
+                        break
+                    f.seek(length, os.SEEK_CUR)
+                    segment.size += _LENGTH.size + length
+                    segment.records += 1
+            if segment.size < file_size:
+                logger.warning(f"Truncate incomplete record at the end of {path}")
+                os.truncate(path, segment.size)
+            if not segment.records:
+                os.remove(path)
+                continue
+            segments.append(segment)
+            self.size += segment.size
+            self.depth += segment.records
+        return segments
@@ -0,0 +1,94 @@
+import asyncio
+import bisect
+import logging
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+"""Default histogram buckets (in seconds)"""
+
+
+class Histogram:
+    """
+    Distribution of observed values over fixed buckets.
+    Observation is just a binary search and two additions,
+    so it's cheap enough to be used on hot paths.
+    """
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: t.Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        """Upper bounds of buckets, the last one is implicitly +Inf"""
+
+        self.counts = [0] * (len(self.buckets) + 1)
+        """Number of observed values in each bucket (not cumulative)"""
+
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class LoopMonitor:
+    """
+    Measures how long the event loop is blocked.
+    Periodic timer is armed every interval, and the delay of its callback
+    against the expected time is the time the loop was busy with something else.
+    """
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+
+        self.lag = Histogram()
+        """Delays of the timer callback (in seconds)"""
+
+        self.blocked_time = 0.0
+        """Total time the event loop was blocked (in seconds)"""
+
+        self._handle: t.Optional[asyncio.TimerHandle] = None
+        self._expected = 0.0
+
+    def start(self):
+        """
+        Starts measuring
+        """
+        loop = asyncio.get_event_loop()
+        self._expected = loop.time() + self.interval
+        self._handle = loop.call_at(self._expected, self._tick)
+
+    def stop(self):
+        """
+        Stops measuring
+        """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _tick(self):
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        lag = max(now - self._expected, 0)
+        self.lag.observe(lag)
+        self.blocked_time += lag
+        if lag > 1:
+            logger.warning(f"Event loop was blocked for {lag:.3f}s")
+        self._expected = now + self.interval
+        self._handle = loop.call_at(self._expected, self._tick)
@@ -0,0 +1,116 @@
+import time
+import typing as t
+from types import SimpleNamespace
+
+from aiohttp import ClientSession, TraceConfig
+
+
+class RequestTimings:
+    """
+    Timestamps of request phases, taken with monotonic clock.
+    Instance should be passed as trace_request_ctx of the request,
+    and it's filled by hooks of timing_trace_config.
+    """
+
+    __slots__ = (
+        "dns_start",
+        "dns_end",
+        "connect_start",
+        "connect_end",
+        "connection_acquired",
+        "headers_received",
+    )
+
+    def __init__(self):
+        self.dns_start: t.Optional[float] = None
+        self.dns_end: t.Optional[float] = None
+        self.connect_start: t.Optional[float] = None
+        self.connect_end: t.Optional[float] = None
+        self.connection_acquired: t.Optional[float] = None
+        self.headers_received: t.Optional[float] = None
+
+    @property
+    def dns_time(self) -> t.Optional[float]:
+        """
+        Time of DNS resolution. None if address was cached or connection reused
+        """
+        if self.dns_start is None or self.dns_end is None:
+            return None
+        return self.dns_end - self.dns_start
+
+    @property
+    def connect_time(self) -> t.Optional[float]:
+        """
+        Time of establishing new connection, including TLS handshake for https
+        and excluding DNS resolution. None if connection was reused
+        """
+        if self.connect_start is None or self.connect_end is None:
+            return None
+        return self.connect_end - self.connect_start - (self.dns_time or 0)
+
+    @property
+    def ttfb(self) -> t.Optional[float]:
+        """
+        Time from getting connection to receiving response headers
+        """
+        if self.connection_acquired is None or self.headers_received is None:
+            return None
+        return self.headers_received - self.connection_acquired
+
+
+def _ctx_timings(ctx: SimpleNamespace) -> t.Optional[RequestTimings]:
+    timings = ctx.trace_request_ctx
+    return timings if isinstance(timings, RequestTimings) else None
+
+
+async def _on_dns_start(session: ClientSession, ctx: SimpleNamespace, params):
+    timings = _ctx_timings(ctx)
+    if timings is not None:
+        timings.dns_start = time.monotonic()
+
+
+async def _on_dns_end(session: ClientSession, ctx: SimpleNamespace, params):
+    timings = _ctx_timings(ctx)
+    if timings is not None:
+        timings.dns_end = time.monotonic()
+
+
+async def _on_connect_start(session: ClientSession, ctx: SimpleNamespace, params):
+    timings = _ctx_timings(ctx)
+    if timings is not None:
+        timings.connect_start = time.monotonic()
+
+
+async def _on_connect_end(session: ClientSession, ctx: SimpleNamespace, params):
+    timings = _ctx_timings(ctx)
+    if timings is not None:
+        timings.connect_end = timings.connection_acquired = time.monotonic()
+
+
+async def _on_connection_reuse(session: ClientSession, ctx: SimpleNamespace, params):
+    timings = _ctx_timings(ctx)
+    if timings is not None:
+        timings.connection_acquired = time.monotonic()
+
+
+async def _on_request_end(session: ClientSession, ctx: SimpleNamespace, params):
+    timings = _ctx_timings(ctx)
+    if timings is not None:
+        timings.headers_received = time.monotonic()
+
+
+def timing_trace_config() -> TraceConfig:
+    """
+    Creates trace config, which records request phases into RequestTimings
+    passed as trace_request_ctx of the request.
+    Note: aiohttp doesn't expose separate hook for TLS handshake,
+    so it is a part of the connect phase.
+    """
+    trace_config = TraceConfig()
+    trace_config.on_dns_resolvehost_start.append(_on_dns_start)
+    trace_config.on_dns_resolvehost_end.append(_on_dns_end)
+    trace_config.on_connection_create_start.append(_on_connect_start)
+    trace_config.on_connection_create_end.append(_on_connect_end)
+    trace_config.on_connection_reuseconn.append(_on_connection_reuse)
+    trace_config.on_request_end.append(_on_request_end)
+    return trace_config
@@ -0,0 +1,129 @@
+import logging
+import multiprocessing
+import os
+import signal
+import time
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerSupervisor:
+    """
+    Runs target function in a pool of worker processes and supervises them.
+    Each worker gets its index and total number of workers,
+    crashed workers are restarted, and all of them are stopped together on shutdown.
+    SIGHUP is forwarded to all workers.
+    """
+
+    def __init__(
+        self,
+        target: t.Callable[[int, int], None],
+        count: int,
+        check_interval: float = 1,
+        restart_delay: float = 1,
+        stop_timeout: float = 30,
+    ):
+        """
+        :param target: function to run in each worker. Called with worker index
+                       and total number of workers. Should handle SIGTERM as graceful
+                       shutdown. Must be picklable, as workers are spawned
+        :param count: number of workers
+        :param check_interval: how often to check workers health (in seconds)
+        :param restart_delay: minimal delay between restarts of the same worker
+        :param stop_timeout: how long to wait for graceful workers shutdown
+        """
+        self.target = target
+        self.count = count
+        self.check_interval = check_interval
+        self.restart_delay = restart_delay
+        self.stop_timeout = stop_timeout
+
+        self.restarts = 0
+        """Total number of restarted workers"""
+
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: t.List[t.Optional[multiprocessing.process.BaseProcess]] = [
+            None
+        ] * count
+        self._started_at = [0.0] * count
+        self._stopping = False
+
+    @property
+    def pids(self) -> t.List[t.Optional[int]]:
+        return [process.pid if process else None for process in self._processes]
+
+    def run(self):
+        """
+        Starts workers and supervise them until SIGTERM or SIGINT received
+        """
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+        signal.signal(signal.SIGHUP, self._forward_signal)
+        self.start()
+        while not self._stopping:
+            time.sleep(self.check_interval)
+            self.check()
+        self.stop()
+
+    def start(self):
+        """
+        Starts all workers
+        """
+        for index in range(self.count):
+            self._start_worker(index)
+        logger.info(f"Started {self.count} workers")
+
+    def check(self):
+        """
+        Restarts workers which aren't alive
+        """
+        for index, process in enumerate(self._processes):
+            if self._stopping or process is None or process.is_alive():
+                continue
+            if time.monotonic() - self._started_at[index] < self.restart_delay:
+                continue
+            logger.error(
+                f"Worker {index} (pid {process.pid}) exited with code {process.exitcode}, "
+                f"restart it"
+            )
+            process.close()
+            self.restarts += 1
+            self._start_worker(index)
+
+    def stop(self):
+        """
+        Gracefully stops all workers, kills ones which didn't stop in time
+        """
+        self._stopping = True
+        processes = [process for process in self._processes if process is not None]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + self.stop_timeout
+        for process in processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning(f"Worker {process.pid} didn't stop in time, kill it")
+                process.kill()
+                process.join()
+        logger.info("All workers stopped")
+
+    def _start_worker(self, index: int):
+        process = self._context.Process(
+            target=self.target,
+            args=(index, self.count),
+            name=f"monitor-worker-{index}",
+        )
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+
+    def _forward_signal(self, signum, frame):
+        for process in self._processes:
+            if process is not None and process.is_alive() and process.pid:
+                os.kill(process.pid, signum)
+
+    def _on_signal(self, signum, frame):
+        logger.info(f"Received signal {signum}, stop workers")
+        self._stopping = True
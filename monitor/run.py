@@ -1,25 +1,73 @@
 import asyncio
 import logging
+import os
+import signal
+import typing as t
 
 from monitor.config import Settings
-from monitor.loaders.kafka import KafkaLoader
+from monitor.loaders.base import AbstractLoader
+from monitor.loaders.file import FileLoader, FileLoaderSettings
+from monitor.loaders.kafka import KafkaLoader, KafkaLoaderSettings
 from monitor.log import setup_logging
 from monitor.monitor import HealthMonitor
+from monitor.sharding import StaticMembership
+from monitor.workers import WorkerSupervisor
 
 logger = logging.getLogger(__name__)
 
 # General event which indicate that shutdown completed
 shutdown_completed = asyncio.Event()
 
+LOADERS: t.Dict[str, t.Type[AbstractLoader]] = {
+    "kafka": KafkaLoader,
+    "file": FileLoader,
+}
 
-async def main(shutdown: asyncio.Event):
+
+def create_loader(
+    name: str, shard: t.Optional[t.Tuple[int, int]] = None
+) -> AbstractLoader:
+    """
+    Creates loader by its name
+    :param name: name of the loader
+    :param shard: index of the worker's shard and number of shards
+    """
+    if name == "kafka" and shard is not None:
+        kafka_settings = KafkaLoaderSettings()
+        if kafka_settings.spool_dir is not None:
+            # Spool can't be shared between worker processes
+            kafka_settings.spool_dir = os.path.join(
+                kafka_settings.spool_dir, f"worker-{shard[0]}"
+            )
+        return KafkaLoader(kafka_settings)
+    if name == "file" and shard is not None:
+        file_settings = FileLoaderSettings()
+        # File can't be shared between worker processes, since each of them rotates it
+        root, ext = os.path.splitext(file_settings.path)
+        file_settings.path = f"{root}.worker-{shard[0]}{ext}"
+        return FileLoader(file_settings)
+    return LOADERS[name]()
+
+
+async def main(shutdown: asyncio.Event, shard: t.Optional[t.Tuple[int, int]] = None):
+    # Don't let SIGHUP kill the process before there is a monitor to reload
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
     settings = Settings()
 
     setup_logging(settings)
 
     logger.info("Start Health Monitor")
 
-    monitor = HealthMonitor(settings, [KafkaLoader()])
+    membership = None
+    if settings.node_count > 1:
+        membership = StaticMembership(settings.node_index, settings.node_count)
+    loaders = [
+        create_loader(name.strip(), shard) for name in settings.loaders.split(",")
+    ]
+    monitor = HealthMonitor(settings, loaders, shard=shard, membership=membership)
+    asyncio.get_event_loop().add_signal_handler(
+        signal.SIGHUP, lambda: asyncio.ensure_future(monitor.reload_schedule())
+    )
     await monitor.start()
 
     await shutdown.wait()
@@ -29,11 +77,28 @@ async def main(shutdown: asyncio.Event):
     shutdown_completed.set()
 
 
-if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
+def run_worker(index: int, count: int):
+    """
+    Entrypoint of the worker process, which runs monitor for its shard of the schedule
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
     shutdown_event = asyncio.Event()
-    try:
-        loop.run_until_complete(main(shutdown_event))
-    except KeyboardInterrupt:
-        shutdown_event.set()
-        loop.run_until_complete(shutdown_completed.wait())
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, shutdown_event.set)
+    loop.run_until_complete(main(shutdown_event, shard=(index, count)))
+
+
+if __name__ == "__main__":
+    settings = Settings()
+    if settings.workers > 1:
+        setup_logging(settings)
+        WorkerSupervisor(run_worker, settings.workers).run()
+    else:
+        loop = asyncio.get_event_loop()
+        shutdown_event = asyncio.Event()
+        try:
+            loop.run_until_complete(main(shutdown_event))
+        except KeyboardInterrupt:
+            shutdown_event.set()
+            loop.run_until_complete(shutdown_completed.wait())
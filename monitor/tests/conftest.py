@@ -1,18 +1,23 @@
-from unittest.mock import AsyncMock, Mock
+from unittest.mock import Mock
 
 import pytest
-from aiocron import Cron
 
 from monitor.config import Settings
 from monitor.loaders.base import AbstractLoader
-from monitor.monitor import HealthMonitor
+from monitor.monitor import HealthMonitor, JobParams
 
 
 @pytest.fixture
 def monitor(monkeypatch):
     settings = Settings()
     monkeypatch.setattr(
-        HealthMonitor, "_parse_schedule", Mock(return_value=[AsyncMock(spec=Cron)])
+        HealthMonitor,
+        "_parse_schedule",
+        Mock(
+            return_value=[
+                JobParams(url="http://example.com", schedule="* * * * * */30")
+            ]
+        ),
     )
     monitor = HealthMonitor(settings, loaders=[Mock(spec=AbstractLoader)])
     yield monitor
@@ -0,0 +1,42 @@
+from monitor.adaptive import AdaptiveInterval
+from monitor.metrics import MetricsCollection
+
+
+def metrics(status_code: int = 200, response_time: float = 0.1) -> MetricsCollection:
+    return MetricsCollection(
+        url="http://example.com",
+        response_time=response_time,
+        status_code=status_code,
+        regex_found=None,
+    )
+
+
+def test_adaptive_interval_slows_down_when_stable():
+    adaptive = AdaptiveInterval(10, 100, 5, stable_checks=3, backoff=2)
+    assert adaptive.interval == 10
+    changes = [adaptive.observe(metrics()) for _ in range(9)]
+    assert changes == [False, False, True] * 3
+    assert adaptive.interval == 80
+    for _ in range(3):
+        adaptive.observe(metrics())
+    assert adaptive.interval == 100
+
+
+def test_adaptive_interval_speeds_up_right_away():
+    adaptive = AdaptiveInterval(10, 100, 100, stable_checks=3, latency_factor=2)
+    adaptive.observe(metrics())
+    assert adaptive.observe(metrics(status_code=500))
+    assert adaptive.interval == 10
+
+    adaptive.interval = 100
+    assert adaptive.observe(metrics(status_code=200))
+    assert adaptive.interval == 10
+
+    adaptive.interval = 100
+    assert adaptive.observe(metrics(response_time=1))
+    assert adaptive.interval == 10
+
+    adaptive.interval = 100
+    assert adaptive.observe_error()
+    assert adaptive.interval == 10
+    assert adaptive.streak == 0
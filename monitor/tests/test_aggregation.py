@@ -0,0 +1,60 @@
+import json
+from unittest.mock import AsyncMock
+
+import pytest
+
+from monitor.aggregation import Aggregator
+from monitor.metrics import MetricsCollection, Rollup
+from monitor.sketch import LatencySketch
+
+
+def test_latency_sketch_quantiles():
+    sketch = LatencySketch(relative_accuracy=0.01)
+    values = [i / 1000 for i in range(1, 1001)]
+    for value in values:
+        sketch.add(value)
+    for q in (0.5, 0.9, 0.99):
+        assert sketch.quantile(q) == pytest.approx(values[int(q * 999)], rel=0.01)
+
+    other = LatencySketch.from_dict(json.loads(json.dumps(sketch.to_dict())))
+    other.add(0)
+    sketch.merge(other)
+    assert sketch.count == 2001
+    assert sketch.quantile(0) == 0
+    assert sketch.quantile(0.5) == pytest.approx(0.5, rel=0.01)
+    assert LatencySketch().quantile(0.5) is None
+
+
+@pytest.mark.asyncio
+async def test_aggregator_rollups():
+    emit = AsyncMock()
+    aggregator = Aggregator(60, emit)
+    metrics = [
+        MetricsCollection(url="http://a.com", response_time=1, status_code=200),
+        MetricsCollection(
+            url="http://a.com", response_time=3, status_code=200, regex_found=True
+        ),
+        MetricsCollection(
+            url="http://a.com", response_time=2, status_code=200, regex_found=False
+        ),
+        MetricsCollection(url="http://b.com", response_time=5, status_code=503),
+    ]
+    assert [aggregator.add(m) for m in metrics] == [False, False, True, True]
+    await aggregator.flush()
+
+    rollups = {call.args[0].url: call.args[0] for call in emit.call_args_list}
+    assert list(rollups) == ["http://a.com", "http://b.com"]
+    rollup: Rollup = rollups["http://a.com"]
+    assert rollup.window_end - rollup.window_start == 60
+    assert rollup.window_start % 60 == 0
+    assert [rollup.count, rollup.failures, rollup.status_counts] == [3, 1, {"200": 3}]
+    assert [rollup.regex_checked, rollup.regex_found] == [2, 1]
+    assert [rollup.response_time_min, rollup.response_time_max] == [1, 3]
+    assert rollup.response_time_sketch.quantile(0.5) == pytest.approx(2, rel=0.01)
+    data = json.loads(rollup.json())
+    assert data["response_time_sketch"]["relative_accuracy"] == 0.01
+    assert rollups["http://b.com"].status_counts == {"503": 1}
+
+    await aggregator.flush()
+    assert aggregator.emitted == 2
+    assert emit.call_count == 2
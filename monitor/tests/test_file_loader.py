@@ -0,0 +1,149 @@
+import csv
+import errno
+import gzip
+import json
+
+import pytest
+
+from monitor.loaders.file import FileLoader, FileLoaderSettings
+from monitor.metrics import MetricsCollection, Rollup
+from monitor.sketch import LatencySketch
+from run import create_loader
+
+
+def make_metrics(count):
+    return [
+        MetricsCollection(
+            url=f"http://example.com/{i}", response_time=i, status_code=200
+        )
+        for i in range(count)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_file_loader_jsonl(tmp_path):
+    path = tmp_path / "metrics.jsonl"
+    loader = FileLoader(FileLoaderSettings(path=str(path), buffer_size=3))
+    metrics = make_metrics(5)
+    for metric in metrics[:4]:
+        await loader.load(metric)
+    assert loader.written == 3
+    await loader.load_batch(metrics[4:])
+    await loader.shutdown()
+    lines = path.read_text().splitlines()
+    assert [MetricsCollection(**json.loads(line)) for line in lines] == metrics
+
+
+@pytest.mark.asyncio
+async def test_file_loader_csv(tmp_path):
+    path = tmp_path / "metrics.csv"
+    loader = FileLoader(FileLoaderSettings(path=str(path), format="csv"))
+    metrics = make_metrics(3)
+    await loader.load_batch(metrics)
+    await loader.flush()
+    await loader.load_batch(metrics)
+    await loader.shutdown()
+    with open(path) as f:
+        rows = list(csv.DictReader(f))
+    assert [row["url"] for row in rows] == [metric.url for metric in metrics] * 2
+
+
+@pytest.mark.asyncio
+async def test_file_loader_rotation(tmp_path):
+    path = tmp_path / "metrics.jsonl"
+    loader = FileLoader(
+        FileLoaderSettings(path=str(path), buffer_size=2, rotate_bytes=1, compress=True)
+    )
+    metrics = make_metrics(6)
+    for i in range(0, 6, 2):
+        await loader.load_batch(metrics[i : i + 2])
+    await loader.shutdown()
+    rotated = sorted(tmp_path.glob("metrics.jsonl.*.gz"))
+    assert len(rotated) == 3
+    lines = [
+        line
+        for file in rotated
+        for line in gzip.decompress(file.read_bytes()).splitlines()
+    ]
+    assert len(lines) == 6
+    assert not path.exists()
+
+
+@pytest.mark.asyncio
+async def test_file_loader_keeps_metrics_on_write_failure(tmp_path):
+    path = tmp_path / "missing" / "metrics.jsonl"
+    loader = FileLoader(
+        FileLoaderSettings(path=str(path), buffer_size=2, max_buffered=3)
+    )
+    metrics = make_metrics(4)
+    await loader.load_batch(metrics[:2])
+    await loader.load_batch(metrics[2:])
+    # Oldest metric is dropped above max_buffered
+    assert [loader.written, loader.failed] == [0, 1]
+    path.parent.mkdir()
+    await loader.shutdown()
+    lines = path.read_text().splitlines()
+    assert [MetricsCollection(**json.loads(line)) for line in lines] == metrics[1:]
+    assert [loader.written, loader.failed] == [3, 1]
+
+
+class FullDiskFile:
+    """
+    Writes half of the data and fails, like a file on the full disk
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, data):
+        self.file.write(data[: len(data) // 2])
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+@pytest.mark.asyncio
+async def test_file_loader_discards_partial_write(tmp_path):
+    path = tmp_path / "metrics.jsonl"
+    loader = FileLoader(FileLoaderSettings(path=str(path), buffer_size=2))
+    metrics = make_metrics(4)
+    await loader.load_batch(metrics[:2])
+    loader._file = FullDiskFile(loader._file)  # type: ignore
+    await loader.load_batch(metrics[2:])
+    assert [loader.written, len(loader._buffer)] == [2, 2]
+    loader._file = loader._file.file  # type: ignore
+    await loader.shutdown()
+    lines = path.read_text().splitlines()
+    # Metrics put back to the buffer are written once
+    assert [MetricsCollection(**json.loads(line)) for line in lines] == metrics
+    assert loader.written == 4
+
+
+@pytest.mark.asyncio
+async def test_file_loader_csv_skips_rollups(tmp_path):
+    path = tmp_path / "metrics.csv"
+    loader = FileLoader(FileLoaderSettings(path=str(path), format="csv"))
+    rollup = Rollup("http://example.com", 0, 60, LatencySketch())
+    await loader.load_batch([*make_metrics(2), rollup])
+    await loader.shutdown()
+    assert [loader.written, loader.skipped] == [2, 1]
+
+
+@pytest.mark.asyncio
+async def test_file_loader_path_per_worker(tmp_path, monkeypatch):
+    monkeypatch.setenv("WH_FILE_PATH", str(tmp_path / "metrics.jsonl"))
+    metrics = make_metrics(4)
+    for index in range(2):
+        loader = create_loader("file", shard=(index, 2))
+        await loader.load_batch(metrics[index * 2 : index * 2 + 2])
+        await loader.shutdown()
+    assert sorted(file.name for file in tmp_path.iterdir()) == [
+        "metrics.worker-0.jsonl",
+        "metrics.worker-1.jsonl",
+    ]
+    lines = (tmp_path / "metrics.worker-1.jsonl").read_text().splitlines()
+    assert [MetricsCollection(**json.loads(line)) for line in lines] == metrics[2:]
@@ -1,17 +1,175 @@
+import asyncio
 from unittest.mock import AsyncMock, MagicMock, Mock, mock_open, patch
 
 import pytest
+import yaml
 
-from monitor.metrics import MetricsCollection
-from monitor.monitor import HealthMonitor
+from monitor.config import Settings
+from monitor.metrics import MetricsCollection, Rollup
+from monitor.monitor import HealthMonitor, JobParams
 
 
 @pytest.mark.asyncio
 async def test_health_monitor(monitor: HealthMonitor):
     await monitor.start()
-    monitor.jobs[0].start.assert_called_once()
+    assert monitor.scheduler.running
+    assert len(monitor.scheduler) == 1
     metrics = MetricsCollection(
         url="http://example.com", response_time=1, status_code=200, regex_found=True
     )
     await monitor.publish(metrics)
-    monitor.loaders[0].load.assert_called_once_with(metrics)  # type: ignore
+    await monitor.shutdown()
+    monitor.loaders[0].load_batch.assert_called_once_with([metrics])  # type: ignore
+    monitor.loaders[0].shutdown.assert_called_once()  # type: ignore
+
+
+def test_health_monitor_shards(monkeypatch):
+    schedule = [
+        JobParams(url=f"http://{i}.example.com", schedule="* * * * * */30")
+        for i in range(100)
+    ]
+    monkeypatch.setattr(HealthMonitor, "_parse_schedule", Mock(return_value=schedule))
+    shards = [
+        HealthMonitor(Settings(), loaders=[], shard=(index, 4)).jobs
+        for index in range(4)
+    ]
+    assert all(shard for shard in shards)
+    assert sorted(job.url for shard in shards for job in shard) == sorted(
+        job.url for job in schedule
+    )
+
+
+@pytest.mark.asyncio
+async def test_health_monitor_reload_schedule(tmp_path):
+    schedule_path = tmp_path / "schedule.yaml"
+    schedule = [
+        {"url": f"http://{i}.example.com", "schedule": "* * * * * */30"}
+        for i in range(5)
+    ]
+    schedule_path.write_text(yaml.safe_dump(schedule))
+    monitor = HealthMonitor(Settings(schedule_path=str(schedule_path)), loaders=[])
+    scheduled = dict(monitor._scheduled)
+
+    schedule[0]["body_regex"] = "Example"
+    schedule[1]["spread"] = False
+    schedule.pop()
+    schedule.append({"url": "http://new.example.com", "schedule": "* * * * *"})
+    schedule_path.write_text(yaml.safe_dump(schedule))
+    await monitor.reload_schedule()
+
+    assert len(monitor.scheduler) == 5
+    assert sorted(job.url for job in monitor.jobs) == sorted(
+        entry["url"] for entry in schedule
+    )
+    keys = list(scheduled)
+    assert monitor._scheduled[keys[0]] is scheduled[keys[0]]
+    assert monitor._scheduled[keys[0]].args[0].body_regex == "Example"
+    assert monitor._scheduled[keys[1]] is not scheduled[keys[1]]
+    assert monitor._scheduled[keys[1]].offset == 0
+    assert all(monitor._scheduled[key] is scheduled[key] for key in keys[2:4])
+    assert keys[4] not in monitor._scheduled
+
+    schedule_path.write_text("- url: not an url")
+    await monitor.reload_schedule()
+    assert len(monitor.scheduler) == 5
+
+
+@pytest.mark.asyncio
+async def test_health_monitor_reload_schedule_concurrently(tmp_path):
+    schedule_path = tmp_path / "schedule.yaml"
+    schedule = [
+        {"url": f"http://{i}.example.com", "schedule": "* * * * * */30"}
+        for i in range(3)
+    ]
+    schedule_path.write_text(yaml.safe_dump(schedule))
+    monitor = HealthMonitor(Settings(schedule_path=str(schedule_path)), loaders=[])
+    schedule.append({"url": "http://new.example.com", "schedule": "* * * * *"})
+    schedule_path.write_text(yaml.safe_dump(schedule))
+    # SIGHUP during periodic reload
+    await asyncio.gather(monitor.reload_schedule(), monitor.reload_schedule())
+    assert len(monitor.scheduler) == 4
+    assert len(monitor._parsed) == 4
+
+
+@pytest.mark.asyncio
+async def test_health_monitor_rejects_duplicate_entries(tmp_path):
+    schedule_path = tmp_path / "schedule.yaml"
+    entry = {"url": "http://example.com", "schedule": "* * * * * */30"}
+    schedule_path.write_text(yaml.safe_dump([entry]))
+    monitor = HealthMonitor(Settings(schedule_path=str(schedule_path)), loaders=[])
+
+    # Entries differ by body_regex only, but would be run as one job
+    schedule_path.write_text(yaml.safe_dump([entry, {**entry, "body_regex": "OK"}]))
+    await monitor.reload_schedule()
+    assert [job.body_regex for job in monitor.jobs] == [None]
+    with pytest.raises(ValueError):
+        HealthMonitor(Settings(schedule_path=str(schedule_path)), loaders=[])
+
+
+@pytest.mark.asyncio
+async def test_health_monitor_aggregation(monkeypatch):
+    monkeypatch.setattr(HealthMonitor, "_parse_schedule", Mock(return_value=[]))
+    loader = AsyncMock()
+    monitor = HealthMonitor(Settings(aggregation_window=60), loaders=[loader])
+    await monitor.start()
+    ok = MetricsCollection(url="http://example.com", response_time=1, status_code=200)
+    failed = MetricsCollection(
+        url="http://example.com", response_time=1, status_code=500
+    )
+    await monitor.publish(ok)
+    await monitor.publish(failed)
+    await monitor.shutdown()
+    loaded = [
+        item for call in loader.load_batch.call_args_list for item in call.args[0]
+    ]
+    assert loaded[0] is failed
+    assert isinstance(loaded[1], Rollup)
+    assert [loaded[1].count, loaded[1].failures] == [2, 1]
+
+
+@pytest.mark.asyncio
+async def test_health_monitor_adaptive_interval(monkeypatch):
+    schedule = [
+        JobParams(
+            url="http://example.com",
+            schedule="* * * * * */30",
+            min_interval=5,
+            max_interval=600,
+        ),
+        JobParams(url="http://fixed.example.com", schedule="* * * * * */30"),
+    ]
+    monkeypatch.setattr(HealthMonitor, "_parse_schedule", Mock(return_value=schedule))
+    monitor = HealthMonitor(Settings(adaptive_stable_checks=2), loaders=[])
+    adaptive_job = monitor._scheduled[("http://example.com", "* * * * * */30")]
+    fixed_job = monitor._scheduled[("http://fixed.example.com", "* * * * * */30")]
+    assert [adaptive_job.interval, fixed_job.interval] == [30, None]
+    adaptive_job.last_run = adaptive_job.next_run - 30
+
+    on_result = adaptive_job.args[1]
+    for _ in range(2):
+        await on_result(
+            MetricsCollection(
+                url="http://example.com",
+                response_time=0.1,
+                status_code=200,
+                regex_found=None,
+            )
+        )
+    assert adaptive_job.interval == 60
+    assert adaptive_job.next_run == pytest.approx(adaptive_job.last_run + 60)
+
+    on_error = adaptive_job.args[2]
+    await on_error(schedule[0], ValueError("Connection refused"))
+    assert adaptive_job.interval == 5
+
+
+def test_job_params_intervals_validation():
+    with pytest.raises(ValueError):
+        JobParams(url="http://example.com", schedule="* * * * *", min_interval=5)
+    with pytest.raises(ValueError):
+        JobParams(
+            url="http://example.com",
+            schedule="* * * * *",
+            min_interval=60,
+            max_interval=5,
+        )
@@ -3,10 +3,15 @@ from typing import Tuple
 from unittest.mock import AsyncMock
 
 import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
 from aioresponses import aioresponses
+from pydantic import ValidationError
 
+from monitor.client import HttpClientPool
 from monitor.config import Settings
-from monitor.job import healthcheck_job
+from monitor.job import ValidatorsCache, healthcheck_job
+from monitor.matching import RegexPool
 from monitor.metrics import MetricsCollection
 from monitor.monitor import JobParams
 
@@ -87,3 +92,229 @@ async def test_healthcheck_job_locked(monkeypatch):
     )
     on_result.assert_not_called()
     on_error.assert_not_called()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "body, max_bytes, expected",
+    [
+        ("<p>filler</p><h1>Hello</h1>", 1024, True),
+        ("<p>filler</p><h1>Hello</h1>", 10, False),
+        ("<p>filler</p>", 1024, False),
+    ],
+)
+async def test_healthcheck_job_streaming_regex(body, max_bytes, expected):
+    settings = Settings(body_chunk_size=4, body_max_bytes=max_bytes)
+    with aioresponses() as mocked_session:
+        mocked_session.get("http://example.com", status=200, body=body)
+        job_params = JobParams(
+            url="http://example.com", schedule="* * * * *", body_regex="<h1>Hello</h1>"
+        )
+        on_result = AsyncMock()
+        on_error = AsyncMock()
+        await healthcheck_job(
+            job_params=job_params,
+            settings=settings,
+            on_result=on_result,
+            on_error=on_error,
+            sync_lock=asyncio.Lock(),
+        )
+        on_error.assert_not_called()
+        collected_metrics: MetricsCollection = on_result.call_args_list[0][0][0]
+        assert collected_metrics.regex_found is expected
+
+
+@pytest.mark.asyncio
+async def test_healthcheck_job_without_regex():
+    settings = Settings()
+    with aioresponses() as mocked_session:
+        mocked_session.get("http://example.com", status=200, body="<h1>Hello</h1>")
+        job_params = JobParams(url="http://example.com", schedule="* * * * *")
+        on_result = AsyncMock()
+        on_error = AsyncMock()
+        await healthcheck_job(
+            job_params=job_params,
+            settings=settings,
+            on_result=on_result,
+            on_error=on_error,
+            sync_lock=asyncio.Lock(),
+        )
+        collected_metrics: MetricsCollection = on_result.call_args_list[0][0][0]
+        assert [collected_metrics.status_code, collected_metrics.regex_found] == [
+            200,
+            None,
+        ]
+
+
+@pytest.mark.asyncio
+async def test_healthcheck_job_offloads_large_body():
+    settings = Settings(body_chunk_size=1024, body_regex_offload_bytes=2048)
+    regex_pool = RegexPool(workers=1, timeout=5)
+    with aioresponses() as mocked_session:
+        mocked_session.get(
+            "http://example.com", status=200, body="x" * 10000 + "<h1>Hello</h1>"
+        )
+        job_params = JobParams(
+            url="http://example.com", schedule="* * * * *", body_regex="<h1>Hello</h1>"
+        )
+        on_result = AsyncMock()
+        on_error = AsyncMock()
+        try:
+            await healthcheck_job(
+                job_params,
+                on_result,
+                on_error,
+                None,
+                settings,
+                regex_pool=regex_pool,
+            )
+        finally:
+            await regex_pool.close()
+    on_error.assert_not_called()
+    assert on_result.call_args[0][0].regex_found is True
+    assert regex_pool.matches > 0
+
+
+def test_job_params_compile_regex_once():
+    job_params = JobParams(
+        url="http://example.com", schedule="* * * * *", body_regex="<h1>.*</h1>"
+    )
+    assert job_params.body_pattern is not None
+    assert job_params.body_pattern.pattern == "<h1>.*</h1>"
+    assert (
+        JobParams(url="http://example.com", schedule="* * * * *").body_pattern is None
+    )
+    with pytest.raises(ValidationError):
+        JobParams(url="http://example.com", schedule="* * * * *", body_regex="(")
+
+
+async def ok_handler(request: web.Request) -> web.Response:
+    return web.Response(text="OK")
+
+
+@pytest.mark.asyncio
+async def test_healthcheck_job_phase_timings():
+    app = web.Application()
+    app.router.add_get("/", ok_handler)
+    async with TestServer(app) as server:
+        settings = Settings()
+        pool = HttpClientPool(settings)
+        on_result = AsyncMock()
+        on_error = AsyncMock()
+        job_params = JobParams(
+            url=str(server.make_url("/")), schedule="* * * * *", body_regex="OK"
+        )
+        for _ in range(2):
+            await healthcheck_job(
+                job_params, on_result, on_error, None, settings, client=pool
+            )
+        await pool.close()
+    on_error.assert_not_called()
+    first: MetricsCollection = on_result.call_args_list[0][0][0]
+    second: MetricsCollection = on_result.call_args_list[1][0][0]
+    assert first.regex_found and second.regex_found
+    assert first.connect_time is not None and first.connect_time >= 0
+    assert second.connect_time is None
+    for metrics in (first, second):
+        assert 0 <= metrics.ttfb <= metrics.response_time
+        assert metrics.download_time >= 0
+
+
+async def sized_handler(request: web.Request) -> web.Response:
+    return web.Response(body=b"x" * int(request.match_info["size"]))
+
+
+async def chunked_handler(request: web.Request) -> web.StreamResponse:
+    response = web.StreamResponse()
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+    await response.write(b"OK")
+    await response.write_eof()
+    return response
+
+
+@pytest.mark.asyncio
+async def test_healthcheck_job_reuses_connection_without_regex():
+    app = web.Application()
+    app.router.add_get("/", ok_handler)
+    app.router.add_get("/chunked", chunked_handler)
+    app.router.add_get("/{size}", sized_handler)
+    async with TestServer(app) as server:
+        settings = Settings()
+        pool = HttpClientPool(settings)
+        on_result = AsyncMock()
+        on_error = AsyncMock()
+        # Connection is closed if body larger than aiohttp buffer is left unread
+        for path in ("/", "/30000", "/chunked", "/300000", "/"):
+            job_params = JobParams(url=str(server.make_url(path)), schedule="* * * * *")
+            await healthcheck_job(
+                job_params, on_result, on_error, None, settings, client=pool
+            )
+        await pool.close()
+    on_error.assert_not_called()
+    results = [call[0][0] for call in on_result.call_args_list]
+    # Only small bodies of known length are drained
+    assert [m.bytes_transferred for m in results] == [2, 30000, 0, 0, 2]
+    # Only the connection with large body left unread is closed
+    assert [pool.new_connections, pool.reused_connections] == [2, 3]
+
+
+async def conditional_handler(request: web.Request) -> web.Response:
+    if request.headers.get("If-None-Match") == '"v1"':
+        return web.Response(status=304)
+    body = b"OK" * 100
+    if request.http_range.stop is not None:
+        return web.Response(status=206, body=body[request.http_range])
+    return web.Response(body=body, headers={"ETag": '"v1"'})
+
+
+@pytest.mark.asyncio
+async def test_healthcheck_job_check_modes():
+    app = web.Application()
+    app.router.add_get("/", conditional_handler)
+    async with TestServer(app) as server:
+        settings = Settings(body_max_bytes=10)
+        pool = HttpClientPool(settings)
+        validators = ValidatorsCache()
+        on_result = AsyncMock()
+        on_error = AsyncMock()
+        url = str(server.make_url("/"))
+        jobs = [
+            JobParams(url=url, schedule="* * * * *", mode="head"),
+            JobParams(url=url, schedule="* * * * *", body_regex="OK", mode="range"),
+            JobParams(
+                url=url, schedule="* * * * *", body_regex="OK", mode="conditional"
+            ),
+            JobParams(
+                url=url, schedule="* * * * *", body_regex="OK", mode="conditional"
+            ),
+        ]
+        for job_params in jobs:
+            await healthcheck_job(
+                job_params,
+                on_result,
+                on_error,
+                None,
+                settings,
+                client=pool,
+                validators=validators,
+            )
+        await pool.close()
+    on_error.assert_not_called()
+    results = [call[0][0] for call in on_result.call_args_list]
+    assert [
+        (m.check_mode, m.status_code, m.regex_found, m.bytes_transferred)
+        for m in results
+    ] == [
+        ("head", 200, None, 0),
+        ("range", 206, True, 10),
+        ("conditional", 200, True, 200),
+        ("conditional", 304, True, 0),
+    ]
+
+
+def test_job_params_head_mode_without_regex():
+    with pytest.raises(ValueError):
+        JobParams(
+            url="http://example.com", schedule="* * * * *", body_regex="OK", mode="head"
+        )
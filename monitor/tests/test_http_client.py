@@ -0,0 +1,26 @@
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from monitor.client import HttpClientPool
+from monitor.config import Settings
+
+
+async def ok_handler(request: web.Request) -> web.Response:
+    return web.Response(text="OK")
+
+
+@pytest.mark.asyncio
+async def test_http_client_pool_reuses_connections():
+    app = web.Application()
+    app.router.add_get("/", ok_handler)
+    async with TestServer(app) as server:
+        pool = HttpClientPool(Settings())
+        for _ in range(3):
+            async with pool.session.get(server.make_url("/")) as response:
+                assert response.status == 200
+                await response.read()
+        assert [pool.new_connections, pool.reused_connections] == [1, 2]
+        session = pool.session
+        await pool.close()
+        assert session.closed
@@ -0,0 +1,76 @@
+import asyncio
+import socket
+import time
+from unittest.mock import Mock
+
+import aiohttp
+import pytest
+
+from monitor.config import Settings
+from monitor.loaders.base import AbstractLoader
+from monitor.metrics import MetricsCollection
+from monitor.monitor import HealthMonitor, JobParams
+from monitor.stats import Histogram, LoopMonitor
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1]
+    assert [histogram.count, histogram.sum] == [4, pytest.approx(5.65)]
+
+
+@pytest.mark.asyncio
+async def test_loop_monitor_measures_blocking():
+    loop_monitor = LoopMonitor(interval=0.01)
+    loop_monitor.start()
+    await asyncio.sleep(0.02)
+    # Block the event loop
+    time.sleep(0.1)
+    await asyncio.sleep(0.02)
+    loop_monitor.stop()
+    assert loop_monitor.lag.count >= 2
+    assert loop_monitor.blocked_time >= 0.05
+
+
+@pytest.mark.asyncio
+async def test_instrumentation_endpoint(monkeypatch):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    monkeypatch.setattr(
+        HealthMonitor,
+        "_parse_schedule",
+        Mock(return_value=[JobParams(url="http://example.com", schedule="* * * * *")]),
+    )
+    monitor = HealthMonitor(
+        Settings(instrumentation_port=port),
+        loaders=[Mock(spec=AbstractLoader), Mock(spec=AbstractLoader)],
+    )
+    await monitor.start()
+    await monitor.publish(
+        MetricsCollection(url="http://example.com", response_time=1, status_code=200)
+    )
+    await asyncio.sleep(0)
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+            assert response.status == 200
+            assert response.content_type == "text/plain"
+            page = await response.text()
+    await monitor.shutdown()
+
+    lines = page.splitlines()
+    assert "# TYPE wh_monitor_scheduler_lag_seconds histogram" in lines
+    assert "wh_monitor_scheduled_jobs 1" in lines
+    assert "wh_monitor_checks_in_flight 0" in lines
+    assert "wh_monitor_checks_skipped_total 0" in lines
+    # Loaders of the same kind are labeled by their index
+    for loader in ("mock-0", "mock-1"):
+        labels = f'loader="{loader}"'
+        assert f"wh_monitor_loader_loaded_total{{{labels}}} 1" in lines
+        assert f"wh_monitor_publish_latency_seconds_count{{{labels}}} 1" in lines
+        assert (
+            f'wh_monitor_publish_latency_seconds_bucket{{{labels},le="+Inf"}} 1'
+            in lines
+        )
@@ -1,9 +1,21 @@
+import asyncio
 from unittest.mock import AsyncMock
 
+import aiokafka
 import pytest
+from aiokafka.errors import KafkaConnectionError
 
-from monitor.loaders.kafka import KafkaLoader, KafkaLoaderSettings
-from monitor.metrics import MetricsCollection
+from monitor import wire
+from monitor.loaders.kafka import (
+    _BINARY_RECORD,
+    KafkaLoader,
+    KafkaLoaderSettings,
+    _pack_record,
+    _unpack_record,
+)
+from monitor.metrics import MetricsCollection, Rollup
+from monitor.sketch import LatencySketch
+from monitor.utils import BackoffPolicy
 
 
 @pytest.mark.asyncio
@@ -21,5 +33,144 @@ async def test_kafka_loader(monkeypatch):
     )
     await loader.load(metrics)
     mocked_connection.send_and_wait.assert_called_once_with(
-        settings.output_topic, metrics.json().encode()
+        settings.output_topic, metrics.json().encode(), key=b"http://example.com"
     )
+
+
+@pytest.mark.asyncio
+async def test_kafka_loader_pipelined(monkeypatch):
+    settings = KafkaLoaderSettings(
+        bootstrap_servers="localhost:9092",
+        output_topic="wh_metrics",
+        pipelined=True,
+        buffer_size=2,
+        buffer_overflow="drop",
+    )
+    loader = KafkaLoader(settings)
+    loop = asyncio.get_event_loop()
+    deliveries = [loop.create_future(), loop.create_future()]
+    mocked_connection = AsyncMock()
+    mocked_connection.send.side_effect = deliveries
+    monkeypatch.setattr(loader, "_conn", mocked_connection)
+    monkeypatch.setattr(loader, "_delivery_backoff_policy", BackoffPolicy(3, 0, 0))
+    metrics = MetricsCollection(
+        url="http://example.com", status_code=200, response_time=1
+    )
+    for _ in range(3):
+        await loader.load(metrics)
+    assert [loader.in_flight, loader.dropped] == [2, 1]
+    mocked_connection.send_and_wait.assert_not_called()
+
+    deliveries[0].set_result(None)
+    deliveries[1].set_exception(ValueError("Delivery failed"))
+    await loader.shutdown()
+    mocked_connection.flush.assert_called_once()
+    mocked_connection.send_and_wait.assert_called_once_with(
+        settings.output_topic, metrics.json().encode(), key=b"http://example.com"
+    )
+    assert [loader.in_flight, loader.failed] == [0, 0]
+
+
+@pytest.mark.asyncio
+async def test_kafka_loader_binary_wire_format(monkeypatch):
+    settings = KafkaLoaderSettings(
+        bootstrap_servers="localhost:9092",
+        output_topic="wh_metrics",
+        wire_format="binary",
+    )
+    loader = KafkaLoader(settings)
+    mocked_connection = AsyncMock()
+    monkeypatch.setattr(loader, "_conn", mocked_connection)
+    metrics = MetricsCollection(
+        url="http://example.com", status_code=200, response_time=1
+    )
+    await loader.load(metrics)
+    mocked_connection.send_and_wait.assert_called_once_with(
+        settings.output_topic,
+        wire.encode(metrics),
+        key=b"http://example.com",
+        headers=[(wire.CONTENT_TYPE_HEADER, wire.BINARY_CONTENT_TYPE)],
+    )
+
+
+@pytest.mark.asyncio
+async def test_kafka_loader_spools_metrics_while_kafka_is_unavailable(
+    monkeypatch, tmp_path
+):
+    settings = KafkaLoaderSettings(
+        bootstrap_servers="localhost:9092",
+        output_topic="wh_metrics",
+        spool_dir=str(tmp_path),
+        spool_retry_interval=0.01,
+    )
+    mocked_connection = AsyncMock()
+    connected = asyncio.Event()
+
+    async def start():
+        if not connected.is_set():
+            raise KafkaConnectionError()
+
+    mocked_connection.start.side_effect = start
+    mocked_connection.send.side_effect = lambda *args, **kwargs: asyncio.sleep(0)
+    monkeypatch.setattr(
+        aiokafka, "AIOKafkaProducer", lambda **kwargs: mocked_connection
+    )
+    loader = KafkaLoader(settings)
+    metrics = [
+        MetricsCollection(
+            url=f"http://{i}.example.com", status_code=200, response_time=1
+        )
+        for i in range(3)
+    ]
+    await loader.load(metrics[0])
+    await loader.load_batch(metrics[1:])
+    assert loader.spooled == 3
+    mocked_connection.send_and_wait.assert_not_called()
+
+    connected.set()
+    while loader.spooled:
+        await asyncio.sleep(0.01)
+    assert loader.replayed == 3
+    assert [
+        (call.args, call.kwargs) for call in mocked_connection.send.call_args_list
+    ] == [
+        ((settings.output_topic, m.json().encode()), {"key": m.url.encode()})
+        for m in metrics
+    ]
+    await loader.load(metrics[0])
+    mocked_connection.send_and_wait.assert_called_once_with(
+        settings.output_topic, metrics[0].json().encode(), key=b"http://0.example.com"
+    )
+    await loader.shutdown()
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_kafka_loader_rollup(monkeypatch):
+    settings = KafkaLoaderSettings(
+        bootstrap_servers="localhost:9092",
+        output_topic="wh_metrics",
+        wire_format="binary",
+    )
+    loader = KafkaLoader(settings)
+    mocked_connection = AsyncMock()
+    monkeypatch.setattr(loader, "_conn", mocked_connection)
+    rollup = Rollup("http://example.com", 0, 60, LatencySketch())
+    rollup.add(
+        MetricsCollection(url="http://example.com", status_code=200, response_time=1),
+        failed=False,
+    )
+    await loader.load(rollup)
+    mocked_connection.send_and_wait.assert_called_once_with(
+        settings.output_topic,
+        rollup.json().encode(),
+        key=b"http://example.com",
+        headers=[(wire.CONTENT_TYPE_HEADER, wire.ROLLUP_CONTENT_TYPE)],
+    )
+
+
+def test_kafka_loader_spooled_records():
+    keyed = (_BINARY_RECORD, b"http://example.com", b"value")
+    assert _unpack_record(_pack_record(keyed)) == keyed
+    # Records spooled before keys were added
+    assert _unpack_record(_BINARY_RECORD + b"value") == (_BINARY_RECORD, None, b"value")
@@ -0,0 +1,33 @@
+import asyncio
+
+import pytest
+
+from monitor.limits import ConcurrencyLimiter
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "total, per_host, expected",
+    [(None, 2, {"a": 2, "b": 2}), (3, None, 3), (3, 1, {"a": 1, "b": 1})],
+)
+async def test_concurrency_limiter(total, per_host, expected):
+    limiter = ConcurrencyLimiter(total, per_host)
+    in_flight = {"a": 0, "b": 0}
+    max_in_flight = {"a": 0, "b": 0}
+    max_total = 0
+
+    async def check(host):
+        nonlocal max_total
+        async with limiter.acquire(host):
+            in_flight[host] += 1
+            max_in_flight[host] = max(max_in_flight[host], in_flight[host])
+            max_total = max(max_total, sum(in_flight.values()))
+            await asyncio.sleep(0.01)
+            in_flight[host] -= 1
+
+    await asyncio.gather(*[check(host) for host in "ab" * 5])
+    if isinstance(expected, dict):
+        assert max_in_flight == expected
+    else:
+        assert max_total == expected
+    assert limiter._hosts == {}
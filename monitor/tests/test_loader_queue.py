@@ -0,0 +1,66 @@
+import asyncio
+from unittest.mock import Mock
+
+import pytest
+
+from monitor.loaders.base import AbstractLoader
+from monitor.loaders.queue import LoaderQueue
+from monitor.metrics import MetricsCollection
+
+
+def make_metrics(count):
+    return [
+        MetricsCollection(
+            url=f"http://example.com/{i}", response_time=1, status_code=200
+        )
+        for i in range(count)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_loader_queue_batches():
+    loader = Mock(spec=AbstractLoader)
+    queue = LoaderQueue(loader, size=10, batch_size=3)
+    metrics = make_metrics(5)
+    for metric in metrics:
+        await queue.put(metric)
+    assert queue.depth == 5
+    queue.start()
+    await queue.stop()
+    assert loader.load_batch.call_args_list[0][0][0] == metrics[:3]
+    assert loader.load_batch.call_args_list[1][0][0] == metrics[3:]
+    assert [queue.depth, queue.loaded, queue.dropped] == [0, 5, 0]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "overflow, expected", [("drop_newest", [0, 1]), ("drop_oldest", [2, 3])]
+)
+async def test_loader_queue_overflow(overflow, expected):
+    loader = Mock(spec=AbstractLoader)
+    queue = LoaderQueue(loader, size=2, overflow=overflow)
+    metrics = make_metrics(4)
+    for metric in metrics:
+        await queue.put(metric)
+    assert queue.dropped == 2
+    queue.start()
+    await queue.stop()
+    loader.load_batch.assert_called_once_with([metrics[i] for i in expected])
+
+
+@pytest.mark.asyncio
+async def test_loader_queue_slow_loader_does_not_block_put():
+    release = asyncio.Event()
+
+    async def slow_load(batch):
+        await release.wait()
+
+    loader = Mock(spec=AbstractLoader)
+    loader.load_batch.side_effect = slow_load
+    queue = LoaderQueue(loader, size=100, batch_size=1)
+    queue.start()
+    for metric in make_metrics(10):
+        await asyncio.wait_for(queue.put(metric), 0.1)
+    release.set()
+    await queue.stop()
+    assert queue.loaded == 10
@@ -0,0 +1,38 @@
+import re
+
+import pytest
+
+from monitor.matching import RegexPool, RegexTimeoutError
+from monitor.metrics import StreamingRegexMatcher
+
+
+def test_streaming_matcher_replaces_invalid_utf8():
+    matcher = StreamingRegexMatcher(re.compile("OK"), 16)
+    assert not matcher.feed(b"\xff\xfe broken ")
+    assert matcher.feed(b"O\xc3") is False
+    assert matcher.feed(b"K", final=True) is False
+    assert StreamingRegexMatcher("OK", 16).feed(b"\xff OK", final=True)
+
+
+@pytest.mark.asyncio
+async def test_regex_pool_search():
+    pool = RegexPool(workers=1, timeout=5)
+    try:
+        assert await pool.search(re.compile("<h1>.*</h1>"), "x" * 100 + "<h1>Hi</h1>")
+        assert not await pool.search(re.compile("missing"), "x" * 100)
+    finally:
+        await pool.close()
+    assert [pool.matches, pool.timeouts] == [2, 0]
+
+
+@pytest.mark.asyncio
+async def test_regex_pool_timeout_restarts_workers():
+    pool = RegexPool(workers=1, timeout=0.2)
+    try:
+        with pytest.raises(RegexTimeoutError):
+            # Catastrophic backtracking
+            await pool.search(re.compile("(a+)+$"), "a" * 64 + "b")
+        assert pool.timeouts == 1
+        assert await pool.search(re.compile("b$"), "a" * 64 + "b")
+    finally:
+        await pool.close()
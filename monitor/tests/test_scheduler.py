@@ -0,0 +1,116 @@
+import asyncio
+import time
+
+import pytest
+
+from monitor.scheduler import CronSchedule, Scheduler
+
+
+def test_cron_schedule_seconds_field():
+    schedule = CronSchedule("* * * * * */30")
+    assert schedule.next_after(1000.0) == 1020.0
+    assert schedule.next_after(1020.0) == 1050.0
+
+
+def test_scheduler_shares_parsed_schedules():
+    async def job():
+        pass
+
+    scheduler = Scheduler()
+    first = scheduler.add("* * * * * */30", job)
+    second = scheduler.add("* * * * * */30", job)
+    third = scheduler.add("*/5 * * * *", job)
+    assert first.schedule is second.schedule
+    assert first.schedule is not third.schedule
+    assert len(scheduler) == 3
+    scheduler.remove(third)
+    assert len(scheduler) == 2
+
+
+@pytest.mark.asyncio
+async def test_scheduler_fires_due_jobs():
+    calls = []
+    all_fired = asyncio.Event()
+
+    async def job(number):
+        calls.append(number)
+        if len(calls) == 5:
+            all_fired.set()
+
+    scheduler = Scheduler(batch_size=2)
+    for number in range(5):
+        scheduler.add("* * * * * *", job, number)
+    scheduler.start()
+    await asyncio.wait_for(all_fired.wait(), 1.5)
+    await scheduler.stop()
+    assert sorted(calls) == [0, 1, 2, 3, 4]
+    assert scheduler.fired == 5
+    assert len(scheduler.drifts) == 5
+    assert scheduler.max_drift < 0.5
+
+
+@pytest.mark.asyncio
+async def test_scheduler_skips_running_job():
+    release = asyncio.Event()
+
+    async def job():
+        await release.wait()
+
+    scheduler = Scheduler()
+    scheduler.add("* * * * * *", job)
+
+    async def wait_skipped():
+        while not scheduler.skipped:
+            await asyncio.sleep(0.05)
+
+    scheduler.start()
+    await asyncio.wait_for(wait_skipped(), 3)
+    assert [scheduler.fired, scheduler.skipped] == [1, 1]
+    release.set()
+    await scheduler.stop()
+
+
+def test_scheduler_spreads_jobs_within_interval():
+    async def job():
+        pass
+
+    scheduler = Scheduler(max_spread=60)
+    jobs = [
+        scheduler.add("* * * * * */30", job, spread_key=f"https://{i}.example.com")
+        for i in range(100)
+    ]
+    offsets = [job.offset for job in jobs]
+    assert all(0 <= offset < 30 for offset in offsets)
+    assert len(set(offsets)) > 90
+    assert jobs[0].next_run == pytest.approx(jobs[0].base_run + jobs[0].offset)
+    not_spread = scheduler.add("* * * * * */30", job)
+    assert not_spread.offset == 0
+    same_key = Scheduler(max_spread=60).add(
+        "* * * * * */30", job, spread_key="https://0.example.com"
+    )
+    assert same_key.offset == jobs[0].offset
+
+
+@pytest.mark.asyncio
+async def test_scheduler_reschedules_job():
+    runs = []
+
+    async def job():
+        runs.append(time.time())
+
+    scheduler = Scheduler()
+    scheduled = scheduler.add("* * * * * *", job, interval=60)
+    scheduler.start()
+    while not runs:
+        await asyncio.sleep(0.05)
+    assert scheduled.next_run == pytest.approx(scheduled.last_run + 60)
+    scheduler.reschedule(scheduled, 0.2)
+    assert scheduled.next_run == pytest.approx(scheduled.last_run + 0.2)
+    await asyncio.wait_for(_wait_for_runs(runs, 3), 2)
+    await scheduler.stop()
+    assert runs[2] - runs[1] == pytest.approx(0.2, abs=0.1)
+
+
+async def _wait_for_runs(runs, count):
+    while len(runs) < count:
+        await asyncio.sleep(0.05)
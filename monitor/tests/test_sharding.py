@@ -0,0 +1,81 @@
+from unittest.mock import Mock
+
+import pytest
+
+from monitor.config import Settings
+from monitor.monitor import HealthMonitor, JobParams
+from monitor.sharding import AbstractMembership, HashRing, StaticMembership
+
+
+class ClusterMembership(AbstractMembership):
+    """
+    Membership shared by several monitors to simulate cluster changes locally
+    """
+
+    def __init__(self, node_id, cluster):
+        self.node_id = node_id
+        self.cluster = cluster
+
+    def members(self):
+        return self.cluster
+
+
+def test_hash_ring_moves_only_part_of_keys():
+    keys = [f"http://{i}.example.com" for i in range(10000)]
+    nodes = [StaticMembership.node_name(i) for i in range(4)]
+    before = HashRing(nodes)
+    after = HashRing(nodes + [StaticMembership.node_name(4)])
+    moved = sum(before.owner(key) != after.owner(key) for key in keys)
+    assert 0.1 < moved / len(keys) < 0.3
+    assert HashRing([]).owner(keys[0]) is None
+
+
+def test_static_membership():
+    membership = StaticMembership(1, 3)
+    assert membership.node_id == "node-1"
+    assert membership.members() == ["node-0", "node-1", "node-2"]
+    with pytest.raises(ValueError):
+        StaticMembership(3, 3)
+
+
+@pytest.mark.asyncio
+async def test_health_monitor_cluster_membership_change(monkeypatch):
+    schedule = [
+        JobParams(url=f"http://{i}.example.com", schedule="* * * * * */30")
+        for i in range(1000)
+    ]
+    monkeypatch.setattr(HealthMonitor, "_parse_schedule", Mock(return_value=schedule))
+    cluster = [StaticMembership.node_name(i) for i in range(4)]
+    monitors = [
+        HealthMonitor(
+            Settings(), loaders=[], membership=ClusterMembership(node_id, cluster)
+        )
+        for node_id in cluster
+    ]
+
+    def owned():
+        return {
+            job.url: monitor.membership.node_id
+            for monitor in monitors
+            for job in monitor.jobs
+        }
+
+    before = owned()
+    assert sum(len(monitor.jobs) for monitor in monitors) == len(schedule)
+    assert len(before) == len(schedule)
+
+    cluster.append(StaticMembership.node_name(4))
+    monitors.append(
+        HealthMonitor(
+            Settings(), loaders=[], membership=ClusterMembership(cluster[-1], cluster)
+        )
+    )
+    for monitor in monitors[:-1]:
+        await monitor.on_membership_change()
+    after = owned()
+    assert sum(len(monitor.jobs) for monitor in monitors) == len(schedule)
+    assert len(after) == len(schedule)
+    moved = sum(before[url] != after[url] for url in before)
+    assert moved == len(monitors[-1].jobs)
+    assert 0.1 < moved / len(schedule) < 0.3
+    assert all(len(monitor.scheduler) == len(monitor.jobs) for monitor in monitors)
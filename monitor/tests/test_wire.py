@@ -0,0 +1,63 @@
+import struct
+
+import pytest
+
+from monitor import wire
+from monitor.metrics import MetricsCollection
+
+
+@pytest.mark.parametrize(
+    "metrics",
+    [
+        MetricsCollection(url="https://example.com", status_code=200, response_time=3),
+        MetricsCollection(
+            url="https://example.com/ünïcode",
+            status_code=503,
+            response_time=0.25,
+            regex_found=False,
+            dns_time=0.01,
+            connect_time=0.05,
+            ttfb=0.1,
+            download_time=0.2,
+        ),
+        MetricsCollection(
+            url="https://example.com",
+            status_code=200,
+            response_time=1,
+            regex_found=True,
+        ),
+        MetricsCollection(
+            url="https://example.com",
+            status_code=304,
+            response_time=1,
+            regex_found=True,
+            check_mode="conditional",
+            bytes_transferred=0,
+        ),
+    ],
+)
+def test_wire_roundtrip(metrics):
+    data = wire.encode(metrics)
+    assert len(data) < len(metrics.json().encode())
+    assert wire.decode(data) == metrics
+    headers = [(wire.CONTENT_TYPE_HEADER, wire.BINARY_CONTENT_TYPE)]
+    assert wire.decode_message(data, headers) == metrics
+    assert wire.decode_message(metrics.json().encode(), None) == metrics
+    assert wire.decode_message(metrics.json().encode(), []) == metrics
+
+
+def test_wire_unsupported_version():
+    metrics = MetricsCollection(
+        url="https://example.com", status_code=200, response_time=3
+    )
+    data = bytes([wire.VERSION + 1]) + wire.encode(metrics)[1:]
+    with pytest.raises(wire.UnsupportedWireFormat):
+        wire.decode(data)
+
+
+def test_wire_decodes_version_1():
+    url = b"https://example.com"
+    data = struct.pack("<BBHd", 1, 0b11, 200, 0.5) + struct.pack("<H", len(url)) + url
+    assert wire.decode(data) == MetricsCollection(
+        url="https://example.com", status_code=200, response_time=0.5, regex_found=True
+    )
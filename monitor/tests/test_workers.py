@@ -0,0 +1,25 @@
+import os
+import signal
+import time
+
+from monitor.workers import WorkerSupervisor
+
+
+def sleep_forever(index, count):
+    time.sleep(60)
+
+
+def test_worker_supervisor_restarts_crashed_workers():
+    supervisor = WorkerSupervisor(sleep_forever, 2, restart_delay=0, stop_timeout=5)
+    supervisor.start()
+    try:
+        pids = supervisor.pids
+        os.kill(pids[0], signal.SIGKILL)
+        supervisor._processes[0].join(5)  # type: ignore
+        supervisor.check()
+        assert supervisor.restarts == 1
+        assert supervisor.pids[0] != pids[0]
+        assert supervisor.pids[1] == pids[1]
+    finally:
+        supervisor.stop()
+    assert not any(process.is_alive() for process in supervisor._processes)